@@ -1,25 +1,190 @@
-from flask import Flask, render_template, request, jsonify, make_response
-import requests
+from flask import Flask, render_template, request, jsonify, make_response, Response, g, has_request_context
 import os
 import json
+import csv
+import io
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime, timedelta
 import logging
 import gzip
+import hashlib
+import codecs
+import re
+import struct
+import sys
+import unicodedata
+import sqlite3
+import threading
+import time
+import random
+import tempfile
+import math
+import bisect
+import uuid
+import heapq
+import itertools
+import contextvars
+import importlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 from functools import partial
+from array import array
+
+# Cold-start mode for serverless deployments (on by default on Vercel): heavy
+# modules are imported on first use, and caches that would only write to a
+# per-instance temp directory default to memory
+COLD_START_MODE = os.environ.get('COLD_START_MODE', '1' if os.environ.get('VERCEL') else '0').lower() in (
+    '1', 'true', 'yes')
+
+class DeferredModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # importlib holds the import lock, so concurrent first accesses import once
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+if COLD_START_MODE:
+    requests = DeferredModule('requests')
+else:
+    import requests
+
+def default_db_path(filename):
+    """Default SQLite file for a cache: in the temp directory, or '' (memory only) in cold-start mode."""
+    return '' if COLD_START_MODE else os.path.join(tempfile.gettempdir(), filename)
 
 app = Flask(__name__)
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+# LOG_FORMAT=json emits the per-request summary as one JSON object per line.
+# Full payload dumps are only built at DEBUG, or for a sampled fraction of
+# requests (LOG_PAYLOAD_SAMPLE_RATE, 0.0-1.0) which then log them at INFO.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', 0))
+LOG_TRUNCATE_CHARS = 2000
+
+logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO))
 logger = logging.getLogger(__name__)
 
-# Compression threshold (1MB)
-COMPRESSION_THRESHOLD = 1024 * 1024
+# Responses above this many bytes are gzipped for clients that accept it
+COMPRESSION_THRESHOLD = int(os.environ.get('COMPRESSION_THRESHOLD', 1024))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+
+# Douglas-Peucker segments longer than this are measured with numpy (if installed)
+DOUGLAS_PEUCKER_VECTOR_MIN = 64
+# Routes with fewer points are quantised and decoded in pure Python, so small
+# ones (sample data, short trips) never pay for importing numpy
+ROUTE_VECTOR_MIN_POINTS = 256
+
+# Bytes read from the Lepton response per step of the streaming parser
+TOLL_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Route encodings a client can ask for via `route_format` or `Accept: ...; route=<format>`
+ROUTE_FORMATS = ('coordinates', 'polyline', 'delta')
+ROUTE_PRECISION = 5
+
+# Toll quote cache: max in-memory entries, TTL in seconds and optional SQLite file
+TOLL_CACHE_SIZE = int(os.environ.get('TOLL_CACHE_SIZE', 512))
+TOLL_CACHE_TTL = int(os.environ.get('TOLL_CACHE_TTL', 6 * 60 * 60))
+TOLL_CACHE_DB = os.environ.get('TOLL_CACHE_DB')
+
+# Route store behind GET /route/<route_id>: max routes and TTL (routes are
+# shared through TOLL_CACHE_DB when it is set), simplification pyramids kept
+# in memory, the zoom band of each pyramid level, the simplification tolerance
+# in screen pixels and the viewport width the overview level is picked for
+ROUTE_STORE_SIZE = int(os.environ.get('ROUTE_STORE_SIZE', 512))
+ROUTE_STORE_TTL = int(os.environ.get('ROUTE_STORE_TTL', TOLL_CACHE_TTL))
+ROUTE_PYRAMID_CACHE_SIZE = int(os.environ.get('ROUTE_PYRAMID_CACHE_SIZE', 32))
+ROUTE_ZOOM_BANDS = ((0, 6), (7, 8), (9, 10), (11, 12), (13, 14), (15, 22))
+ROUTE_PIXEL_TOLERANCE = float(os.environ.get('ROUTE_PIXEL_TOLERANCE', 0.5))
+ROUTE_OVERVIEW_PIXELS = 1024
+
+# Toll-plaza catalogue learned from live responses and used for /estimate_toll:
+# SQLite file (memory only unless set, so no state is shared by accident), grid
+# cell size in degrees, match corridor in metres, max age of prices/coverage in
+# seconds and the share of a route's length that must lie in surveyed grid cells
+TOLL_CATALOGUE_DB = os.environ.get('TOLL_CATALOGUE_DB', '')
+TOLL_CATALOGUE_CELL_DEG = float(os.environ.get('TOLL_CATALOGUE_CELL_DEG', 0.05))
+TOLL_CATALOGUE_CORRIDOR_M = float(os.environ.get('TOLL_CATALOGUE_CORRIDOR_M', 60))
+TOLL_CATALOGUE_MAX_AGE = int(os.environ.get('TOLL_CATALOGUE_MAX_AGE', 7 * 24 * 60 * 60))
+TOLL_CATALOGUE_MIN_COVERAGE = float(os.environ.get('TOLL_CATALOGUE_MIN_COVERAGE', 0.95))
+# Booths with the same name closer than this are treated as one plaza
+TOLL_PLAZA_MERGE_M = 500
+# Route geometries sent to Lepton are simplified until their encoded polyline
+# fits in this many characters, keeping the request URL within server limits
+LEPTON_POLYLINE_MAX_CHARS = 6000
+
+# Geocode cache: long-lived, persisted to SQLite, pre-seeded from bundled city centroids
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 4096))
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 90 * 24 * 60 * 60))
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 24 * 60 * 60))
+GEOCODE_CACHE_DB = os.environ.get(
+    'GEOCODE_CACHE_DB', default_db_path('ft_geocode_cache.sqlite3'))
+CITY_CENTROIDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'india_cities.csv')
+
+# Place autocomplete (/autocomplete) over the bundled gazetteer: aliases and
+# toll plazas next to the cities above, the prebuilt trie written by
+# build_place_index.py (at the repository root) and completions kept per
+# trie node
+PLACE_ALIASES_FILE = os.path.join(os.path.dirname(CITY_CENTROIDS_FILE), 'place_aliases.csv')
+TOLL_PLAZAS_FILE = os.path.join(os.path.dirname(CITY_CENTROIDS_FILE), 'toll_plazas.csv')
+PLACE_INDEX_FILE = os.environ.get('PLACE_INDEX_FILE', os.path.join(os.path.dirname(CITY_CENTROIDS_FILE), 'places.idx'))
+PLACE_INDEX_TOP_K = 10
+AUTOCOMPLETE_MAX_RESULTS = 20
+AUTOCOMPLETE_MAX_INPUT = 64
+
+# Fuel price cache: prices change at most daily, so entries are keyed by date and
+# a spatial cell (grid square of FUEL_GRID_DEG degrees, or nearest known city)
+FUEL_CACHE_SIZE = int(os.environ.get('FUEL_CACHE_SIZE', 4096))
+FUEL_CACHE_DB = os.environ.get('FUEL_CACHE_DB')
+FUEL_SNAP_MODE = os.environ.get('FUEL_SNAP_MODE', 'grid')
+FUEL_GRID_DEG = float(os.environ.get('FUEL_GRID_DEG', 0.05))
+FUEL_CITY_SNAP_KM = float(os.environ.get('FUEL_CITY_SNAP_KM', 25))
+
+# Metrics: latency samples kept per stage for quantiles, and whether to send Server-Timing
+METRICS_WINDOW = int(os.environ.get('METRICS_WINDOW', 2048))
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING', '1').lower() not in ('0', 'false', 'no')
+
+# Upstream HTTP client: timeouts (seconds), retries, connection pool and circuit breaker
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 2))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 8))
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 32))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+# Connections the async client (asgi.py) may hold open at once across all hosts
+ASYNC_UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_MAX_CONNECTIONS', 512))
+
+# Lepton admission control: request rate per second (0 = unlimited) and burst,
+# adaptive concurrency bounds, the latency rise over the fastest recent
+# responses that counts as congestion (0 = ignore latency), the share of the
+# limit bulk calls may use, and the longest a call may queue for a slot
+LEPTON_RATE_LIMIT = float(os.environ.get('LEPTON_RATE_LIMIT', 0))
+LEPTON_RATE_BURST = float(os.environ.get('LEPTON_RATE_BURST', 0))
+LEPTON_CONCURRENCY_INITIAL = int(os.environ.get('LEPTON_CONCURRENCY_INITIAL', 16))
+LEPTON_CONCURRENCY_MIN = int(os.environ.get('LEPTON_CONCURRENCY_MIN', 2))
+LEPTON_CONCURRENCY_MAX = int(os.environ.get('LEPTON_CONCURRENCY_MAX', 64))
+LEPTON_LATENCY_TOLERANCE = float(os.environ.get('LEPTON_LATENCY_TOLERANCE', 2.0))
+LEPTON_BULK_SHARE = float(os.environ.get('LEPTON_BULK_SHARE', 0.75))
+LEPTON_QUEUE_TIMEOUT = float(os.environ.get('LEPTON_QUEUE_TIMEOUT', 30))
 
 # API Keys
 API_KEY = os.environ.get('LEPTON_API_KEY')
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY')
 
+# Upstream base URLs, overridable to point at a stand-in such as benchmarks/mock_upstream.py
+LEPTON_API_BASE = os.environ.get('LEPTON_API_BASE', 'https://api.leptonmaps.com').rstrip('/')
+GOOGLE_MAPS_API_BASE = os.environ.get('GOOGLE_MAPS_API_BASE', 'https://maps.googleapis.com').rstrip('/')
+
 logger.info(f"Lepton API Key present: {'Yes' if API_KEY else 'No'}")
 logger.info(f"Google Maps API Key present: {'Yes' if GOOGLE_MAPS_API_KEY else 'No'}")
 
@@ -88,15 +253,39 @@ app.secret_key = os.urandom(24)
 # Secure password for bulk operations - in production, use environment variable
 BULK_PASSWORD = "allmovementnochaos"
 
-# Common city name corrections
-CITY_CORRECTIONS = {
-    'belary': 'bellary',
-    'banglore': 'bangalore',
-    'bengaluru': 'bangalore',
-    'bombay': 'mumbai',
-    'calcutta': 'kolkata',
-    'poona': 'pune'
-}
+# Bulk toll processing: number of rows looked up concurrently per upload
+BULK_MAX_WORKERS = int(os.environ.get('BULK_MAX_WORKERS', 8))
+BULK_CSV_COLUMNS = ['origin', 'way_points', 'destination', 'journey_type']
+BULK_RESULT_COLUMNS = ['number_of_tolls', 'total_toll_price', 'status', 'error_message']
+
+# Durable bulk jobs: SQLite store (/bulk_jobs is disabled unless it is set),
+# rows committed per checkpoint, seconds a worker holds a job between
+# checkpoints, and how long finished jobs are kept
+BULK_JOBS_DB = os.environ.get('BULK_JOBS_DB', '')
+BULK_JOB_CHECKPOINT_ROWS = int(os.environ.get('BULK_JOB_CHECKPOINT_ROWS', 50))
+BULK_JOB_LEASE = float(os.environ.get('BULK_JOB_LEASE', 120))
+BULK_JOB_RETENTION = int(os.environ.get('BULK_JOB_RETENTION', 7 * 24 * 60 * 60))
+
+# Multi-vehicle quotes: concurrent upstream calls per request
+MULTI_VEHICLE_MAX_WORKERS = int(os.environ.get('MULTI_VEHICLE_MAX_WORKERS', 6))
+
+# Waypoint journeys quoted leg by leg (off by default, or per request with
+# `split_legs`): each leg is cached like a direct quote and missing legs are
+# fetched concurrently, up to this many at a time
+TOLL_SPLIT_LEGS = os.environ.get('TOLL_SPLIT_LEGS', '0').lower() in ('1', 'true', 'yes')
+TOLL_LEG_MAX_WORKERS = int(os.environ.get('TOLL_LEG_MAX_WORKERS', 8))
+
+# Trip cost: default road km between fuel price samples, cap on samples per
+# route and concurrent fuel lookups per request
+TRIP_FUEL_SAMPLE_KM = float(os.environ.get('TRIP_FUEL_SAMPLE_KM', 50))
+TRIP_MAX_FUEL_SAMPLES = int(os.environ.get('TRIP_MAX_FUEL_SAMPLES', 100))
+TRIP_FUEL_MAX_WORKERS = int(os.environ.get('TRIP_FUEL_MAX_WORKERS', 8))
+
+# Batch fuel prices (/get_fuel_prices): max locations and fuel types per
+# request and concurrent lookups per request
+FUEL_BATCH_MAX_LOCATIONS = int(os.environ.get('FUEL_BATCH_MAX_LOCATIONS', 200))
+FUEL_BATCH_MAX_FUEL_TYPES = 4
+FUEL_BATCH_MAX_WORKERS = int(os.environ.get('FUEL_BATCH_MAX_WORKERS', 32))
 
 def is_coordinates(location):
     """Check if input is coordinates (either string or object format)."""
@@ -153,7 +342,9 @@ def process_location(location):
         return parse_coordinates(location)
         
     if isinstance(location, str):
-        return CITY_CORRECTIONS.get(location.lower(), location)
+        # Known city names and aliases (bombay, bengaluru) resolve to the gazetteer name. Misspellings are
+        # left alone: the gazetteer lacks most towns, and Mandla is one letter from Mandya
+        return load_place_index().resolve(location, kinds=('city',)) or location
         
     return None
 
@@ -176,419 +367,3931 @@ def process_waypoints(waypoints):
     
     return processed
 
-def compress_response(response_data):
-    """Compress response data if it exceeds threshold"""
-    json_str = json.dumps(response_data)
-    if len(json_str) > COMPRESSION_THRESHOLD:
-        compressed = gzip.compress(json_str.encode('utf-8'))
-        response = make_response(compressed)
-        response.headers['Content-Encoding'] = 'gzip'
-        response.headers['Content-Type'] = 'application/json'
-        return response
-    return jsonify(response_data)
+class ResultCache:
+    """Thread-safe LRU cache with per-entry TTL and an optional SQLite backend.
 
-def simplify_coordinates(coords, tolerance=0.00001):
-    """Simplify route coordinates using Douglas-Peucker algorithm"""
-    if len(coords) <= 2:
-        return coords
-        
-    def point_line_distance(point, start, end):
-        if start == end:
-            return ((point[0] - start[0]) ** 2 + (point[1] - start[1]) ** 2) ** 0.5
-            
-        n = abs((end[1] - start[1]) * point[0] - (end[0] - start[0]) * point[1] + end[0] * start[1] - end[1] * start[0])
-        d = ((end[1] - start[1]) ** 2 + (end[0] - start[0]) ** 2) ** 0.5
-        return n / d if d > 0 else 0
-        
-    dmax = 0
-    index = 0
-    for i in range(1, len(coords) - 1):
-        d = point_line_distance(coords[i], coords[0], coords[-1])
-        if d > dmax:
-            index = i
-            dmax = d
-            
-    if dmax > tolerance:
-        results1 = simplify_coordinates(coords[:index + 1], tolerance)
-        results2 = simplify_coordinates(coords[index:], tolerance)
-        return results1[:-1] + results2
-    else:
-        return [coords[0], coords[-1]]
+    Values must be JSON serialisable and are shared between callers, so treat
+    them as read-only. With ``db_path`` set, entries are also written to a
+    SQLite table so they survive restarts and are shared by every worker
+    process; the in-memory LRU stays in front of it as the hot layer.
+    """
 
-@app.route('/')
-def index():
-    return render_template('index.html', google_maps_api_key=GOOGLE_MAPS_API_KEY)
+    registry = {}
 
-@app.route('/get_toll_data', methods=['POST'])
-def get_toll_data():
-    # 1. Log incoming request data
-    data = request.json
-    logger.info("=== INCOMING REQUEST DATA ===")
-    logger.info(json.dumps(data, indent=2))
-    
-    # Extract and validate data
-    if not isinstance(data, dict):
-        return jsonify({'error': 'Invalid request data format'}), 400
+    def __init__(self, name, max_entries=512, ttl=3600, db_path=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._db_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        ResultCache.registry[name] = self
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    @staticmethod
+    def make_key(key):
+        return key if isinstance(key, str) else json.dumps(key, separators=(',', ':'))
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.name}" ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, value, expires_at):
+        """Store an entry in the in-memory layer; caller holds the lock."""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        key = self.make_key(key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
         
-    origin = str(data.get('origin', '')).strip()
-    destination = str(data.get('destination', '')).strip()
-    waypoints = data.get('waypoints', [])
-    journey_type = data.get('journey_type')
-    
-    # Process locations
-    processed_origin = process_location(origin)
-    processed_destination = process_location(destination)
-    processed_waypoints = process_waypoints(waypoints)
-    
-    if not processed_origin or not processed_destination:
-        return jsonify({'error': 'Invalid origin or destination format'}), 400
-    
-    logger.info("=== PROCESSED LOCATIONS ===")
-    logger.info(f"Processed Origin: {processed_origin}")
-    logger.info(f"Processed Destination: {processed_destination}")
-    logger.info(f"Processed Waypoints: {processed_waypoints}")
-    
-    # Format locations for API
-    params = {
-        'origin': processed_origin,
-        'destination': processed_destination,
-        'journey_type': journey_type,
-        'include_route': True,
-        'include_route_metadata': True,
-        'include_booths': True,
-        'include_booths_locations': True
+        if self.db_path:
+            try:
+                conn = self._db()
+                row = conn.execute(
+                    f'SELECT value, expires_at FROM "{self.name}" WHERE key = ?', (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    conn.execute(f'UPDATE "{self.name}" SET accessed_at = ? WHERE key = ?', (now, key))
+                    conn.commit()
+                    value = json.loads(row[0])
+                    with self._lock:
+                        self._remember(key, value, row[1])
+                        self.hits += 1
+                    return value
+            except sqlite3.Error as e:
+                logger.error(f"{self.name} cache read failed: {str(e)}")
+        
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        if not self.enabled:
+            return
+        key = self.make_key(key)
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires_at)
+        
+        if self.db_path:
+            try:
+                conn = self._db()
+                conn.execute(
+                    f'INSERT OR REPLACE INTO "{self.name}" (key, value, expires_at, accessed_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, json.dumps(value, separators=(',', ':')), expires_at, now)
+                )
+                self._db_writes += 1
+                if self._db_writes % 100 == 0:
+                    self._prune_db(conn, now)
+                conn.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.error(f"{self.name} cache write failed: {str(e)}")
+
+    def _prune_db(self, conn, now):
+        """Drop expired rows and trim the table back to ``max_entries`` by last access."""
+        conn.execute(f'DELETE FROM "{self.name}" WHERE expires_at <= ?', (now,))
+        conn.execute(
+            f'DELETE FROM "{self.name}" WHERE key NOT IN ('
+            f'SELECT key FROM "{self.name}" ORDER BY accessed_at DESC LIMIT ?)',
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            conn = self._db()
+            conn.execute(f'DELETE FROM "{self.name}"')
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'backend': 'sqlite' if self.db_path else 'memory',
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class MetricsRegistry:
+    """In-process latency and size aggregates, rendered for Prometheus at /metrics.
+
+    Stage durations are kept as summaries: running count/sum plus the last
+    ``window`` samples, from which p50/p95/p99 are computed at scrape time.
+    Sizes and point counts are fixed-bucket histograms.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+    HISTOGRAM_BUCKETS = {
+        'ft_toll_upstream_payload_bytes': (1e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 5e6, 1e7),
+        'ft_response_payload_bytes': (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6),
+        'ft_toll_route_points': (100, 1000, 5000, 10000, 25000, 50000, 100000, 250000),
+        'ft_toll_route_points_simplified': (100, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+    }
+    HELP = {
+        'ft_stage_duration_seconds': 'Time spent in each request processing stage',
+        'ft_request_duration_seconds': 'Total request handling time per endpoint',
+        'ft_toll_upstream_payload_bytes': 'Size of Lepton toll response bodies',
+        'ft_response_payload_bytes': 'Size of JSON response bodies before compression',
+        'ft_toll_route_points': 'Route points received from Lepton',
+        'ft_toll_route_points_simplified': 'Route points left after simplification',
+        'ft_upstream_queue_wait_seconds': 'Time upstream calls waited for a scheduler slot, by priority'
     }
-    
-    if processed_waypoints:
-        params['waypoints'] = '|'.join(processed_waypoints)
 
-    # If no API key, use sample data
-    if not API_KEY:
-        logger.warning("No API key found, using sample data")
-        sample_result = {
-            'toll_count': SAMPLE_TOLL_DATA['totalTollBooths'],
-            'total_toll_price': SAMPLE_TOLL_DATA['totalTollPrice'],
-            'toll_booths': [{
-                'name': booth['name'],
-                'price': float(booth['price']),
-                'address': booth['address'],
-                'coords': [float(booth['location']['coordinates'][1]), float(booth['location']['coordinates'][0])]
-            } for booth in SAMPLE_TOLL_DATA['booths']],
-            'route_coordinates': [[float(coord[1]), float(coord[0])] for coord in SAMPLE_TOLL_DATA['route']['geometry']['coordinates']],
-            'waypoint_coords': [],
-            'origin_coords': [float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][0][1]), 
-                            float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][0][0])],
-            'destination_coords': [float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][-1][1]), 
-                                 float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][-1][0])]
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._summaries = {}
+        self._histograms = {}
+
+    def observe(self, metric, label, value):
+        """Record a summary sample, e.g. observe('ft_stage_duration_seconds', 'toll.parse', 0.1)."""
+        with self._lock:
+            series = self._summaries.get((metric, label))
+            if series is None:
+                series = self._summaries[(metric, label)] = {
+                    'count': 0, 'sum': 0.0, 'samples': deque(maxlen=self.window)}
+            series['count'] += 1
+            series['sum'] += value
+            series['samples'].append(value)
+
+    def observe_histogram(self, metric, value):
+        buckets = self.HISTOGRAM_BUCKETS[metric]
+        with self._lock:
+            series = self._histograms.get(metric)
+            if series is None:
+                series = self._histograms[metric] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(buckets)}
+            series['count'] += 1
+            series['sum'] += value
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+
+    @staticmethod
+    def _quantile(sorted_samples, q):
+        if not sorted_samples:
+            return 0.0
+        index = min(len(sorted_samples) - 1, max(0, math.ceil(q * len(sorted_samples)) - 1))
+        return sorted_samples[index]
+
+    def snapshot(self):
+        """Return summaries with quantiles and histograms as plain dicts."""
+        with self._lock:
+            summaries = {key: (series['count'], series['sum'], sorted(series['samples']))
+                         for key, series in self._summaries.items()}
+            histograms = {metric: (series['count'], series['sum'], list(series['buckets']))
+                          for metric, series in self._histograms.items()}
+        return {
+            'summaries': {
+                key: {
+                    'count': count, 'sum': total,
+                    'quantiles': {q: self._quantile(samples, q) for q in self.QUANTILES}
+                }
+                for key, (count, total, samples) in summaries.items()
+            },
+            'histograms': {
+                metric: {'count': count, 'sum': total,
+                         'buckets': list(zip(self.HISTOGRAM_BUCKETS[metric], buckets))}
+                for metric, (count, total, buckets) in histograms.items()
+            }
         }
-        return jsonify(sample_result)
-    
-    # Build API URL
-    api_url = "https://api.leptonmaps.com/v1/toll"
-    
-    # 2. Log location formatting
-    logger.info("=== ORIGINAL LOCATIONS ===")
-    logger.info(f"Original Origin: {origin}")
-    logger.info(f"Original Destination: {destination}")
-    logger.info(f"Original Waypoints: {waypoints}")
-    
-    logger.info("=== API REQUEST DETAILS ===")
-    logger.info(f"API URL: {api_url}")
-    logger.info(f"Request Parameters: {json.dumps(params, indent=2)}")
-    
-    headers = {
-        'x-api-key': API_KEY,
-        'Content-Type': 'application/json'
+
+    def render_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        label_names = {'ft_stage_duration_seconds': 'stage', 'ft_request_duration_seconds': 'endpoint',
+                       'ft_upstream_queue_wait_seconds': 'priority'}
+        
+        by_metric = {}
+        for (metric, label), series in sorted(snapshot['summaries'].items()):
+            by_metric.setdefault(metric, []).append((label, series))
+        for metric, series_list in by_metric.items():
+            lines.append(f"# HELP {metric} {self.HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} summary")
+            label_name = label_names.get(metric, 'label')
+            for label, series in series_list:
+                for q, value in series['quantiles'].items():
+                    lines.append(f'{metric}{{{label_name}="{label}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'{metric}_sum{{{label_name}="{label}"}} {series["sum"]:.6f}')
+                lines.append(f'{metric}_count{{{label_name}="{label}"}} {series["count"]}')
+        
+        for metric, series in sorted(snapshot['histograms'].items()):
+            lines.append(f"# HELP {metric} {self.HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in series['buckets']:
+                lines.append(f'{metric}_bucket{{le="{bound:g}"}} {count}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {series["count"]}')
+            lines.append(f'{metric}_sum {series["sum"]:g}')
+            lines.append(f'{metric}_count {series["count"]}')
+        
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+def payload_logging_enabled():
+    """Whether full payload dumps should be logged for the current request."""
+    if logger.isEnabledFor(logging.DEBUG):
+        return True
+    return has_request_context() and g.get('log_payloads', False)
+
+def log_payload(label, payload):
+    """Log a full payload dump, building it only if payload logging is enabled.
+
+    ``payload`` may be a callable returning the value, so that expensive
+    serialisation is skipped entirely on the common path.
+    """
+    if not payload_logging_enabled():
+        return
+    if callable(payload):
+        payload = payload()
+    if not isinstance(payload, str):
+        payload = json.dumps(payload, indent=2, default=log_default)
+    level = logging.DEBUG if logger.isEnabledFor(logging.DEBUG) else logging.INFO
+    logger.log(level, f"{label}: {payload}")
+
+def log_default(value):
+    """JSON fallback for payload dumps: records expose to_dict, buffers become lists."""
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if isinstance(value, array):
+        return value.tolist()
+    return str(value)
+
+def truncate_for_log(text, limit=LOG_TRUNCATE_CHARS):
+    """Shorten large upstream bodies quoted in error logs."""
+    if text is None or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+def note_request(**fields):
+    """Attach fields to the current request's summary log record."""
+    if has_request_context():
+        g.setdefault('log_fields', {}).update(fields)
+
+def log_request_summary(response, total):
+    """Emit one compact record per request: status, sizes, counts and stage timings."""
+    record = {
+        'event': 'request',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(total * 1000, 1),
+        'request_bytes': request.content_length or 0,
+        'response_bytes': None if response.is_streamed else response.calculate_content_length()
     }
+    record.update(g.get('log_fields', {}))
+    stages = {}
+    for stage, elapsed in g.get('stage_timings', []):
+        stages[stage] = round(stages.get(stage, 0.0) + elapsed * 1000, 1)
     
+    if LOG_FORMAT == 'json':
+        record['stages_ms'] = stages
+        logger.info(json.dumps(record, separators=(',', ':'), default=str))
+    else:
+        fields = ' '.join(f"{key}={value}" for key, value in record.items() if key != 'event')
+        timings = ' '.join(f"{stage}={ms}ms" for stage, ms in stages.items())
+        logger.info(f"request {fields} {timings}".rstrip())
+
+@contextmanager
+def timed_stage(stage):
+    """Time a block as a named stage for /metrics and the Server-Timing header."""
+    start = time.perf_counter()
     try:
-        # Make API request using GET method with query parameters
-        response = requests.get(api_url, params=params, headers=headers)
-        
-        logger.info("=== API RESPONSE DETAILS ===")
-        logger.info(f"Response Status Code: {response.status_code}")
-        logger.info(f"Response Headers: {dict(response.headers)}")
-        logger.info(f"Response Content Type: {response.headers.get('content-type', 'Not specified')}")
-        
-        # Log raw response content for debugging
-        logger.info("=== RAW API RESPONSE ===")
-        raw_response = response.text
-        logger.info(f"Raw response content: {raw_response}")
-        logger.info(f"Response length: {len(raw_response)}")
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe('ft_stage_duration_seconds', stage, elapsed)
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((stage, elapsed))
+
+TOLL_CACHE = ResultCache('toll_quotes', max_entries=TOLL_CACHE_SIZE,
+                         ttl=TOLL_CACHE_TTL, db_path=TOLL_CACHE_DB)
+
+def normalise_cache_part(value):
+    """Case-fold and collapse whitespace so equivalent queries share a cache key."""
+    return ' '.join(str(value or '').split()).casefold()
+
+def toll_cache_key(origin, destination, waypoints, journey_type):
+    """Cache key for a toll quote, built from already processed locations."""
+    return [
+        normalise_cache_part(origin),
+        normalise_cache_part(destination),
+        [normalise_cache_part(wp) for wp in waypoints],
+        normalise_cache_part(journey_type)
+    ]
+
+class CircuitOpenError(ConnectionError):
+    """Raised without contacting the host while its circuit breaker is open.
+
+    Not a requests exception, so it can be defined before requests is
+    imported; the upstream drivers catch it next to RequestException.
+    """
+
+class UpstreamSaturatedError(CircuitOpenError):
+    """Raised without contacting the host when a call waited too long for a scheduler slot."""
+
+# Priority of upstream calls made in the current context; bulk work sets 'bulk'
+UPSTREAM_PRIORITY = contextvars.ContextVar('upstream_priority', default='interactive')
+
+class SchedulerWaiter:
+    """A call queued for an UpstreamScheduler slot, woken through an Event or an asyncio future."""
+    __slots__ = ('priority', 'granted', 'cancelled', 'event', 'future', 'loop')
+
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def notify(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+class UpstreamScheduler:
+    """Process-wide admission control for calls to one upstream API.
+
+    A call needs a token from a token bucket refilled at ``rate`` per second
+    (unlimited when 0) and a free slot under an adaptive concurrency limit.
+    The limit grows by about one per round trip while responses stay healthy
+    and is cut multiplicatively on 429, 5xx, connection errors or when the
+    smoothed latency rises past ``latency_tolerance`` times the fastest
+    recent responses (AIMD). A 429 with Retry-After also pauses admissions.
+    Waiting calls are admitted by priority, interactive before bulk, and
+    bulk calls may only fill ``bulk_share`` of the limit, so interactive
+    lookups find a slot even while a bulk run saturates the API.
+    """
+
+    PRIORITIES = {'interactive': 0, 'bulk': 1}
+
+    def __init__(self, name, rate=0.0, burst=0.0, initial_limit=16, min_limit=2, max_limit=64,
+                 latency_tolerance=2.0, bulk_share=0.75, queue_timeout=30.0):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.bulk_share = bulk_share
+        self.queue_timeout = queue_timeout
+        self.tokens = self.burst
+        self.in_flight = 0
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency_ewma = None
+        self._latency_floor = None
+        self._floor_updated = time.monotonic()
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.waiting = {priority: 0 for priority in self.PRIORITIES}
+        self.admitted = {priority: 0 for priority in self.PRIORITIES}
+        self.wait_total = {priority: 0.0 for priority in self.PRIORITIES}
+        self.wait_max = {priority: 0.0 for priority in self.PRIORITIES}
+        self.rejected = 0
+        self.throttled = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def _slots_for(self, priority):
+        limit = int(self.limit)
+        return max(1, int(limit * self.bulk_share)) if priority == 'bulk' else limit
+
+    def _can_start(self, priority, now):
+        """Whether a call of this priority may start now; caller holds the lock."""
+        if now < self._paused_until or self.in_flight >= self._slots_for(priority):
+            return False
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            return self.tokens >= 1
+        return True
+
+    def _start(self, priority, waited):
+        """Take a slot and a token; caller holds the lock."""
+        self.in_flight += 1
+        if self.rate > 0:
+            self.tokens -= 1
+        self.admitted[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    def _dispatch(self, now):
+        """Admit queued calls in priority order while slots and tokens allow; caller holds the lock."""
+        while self._queue:
+            _, _, enqueued, waiter = self._queue[0]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            if not self._can_start(waiter.priority, now):
+                return
+            heapq.heappop(self._queue)
+            self.waiting[waiter.priority] -= 1
+            self._start(waiter.priority, now - enqueued)
+            waiter.granted = True
+            waiter.notify()
+
+    def _next_check(self, now):
+        """Seconds until a queued call could be admitted without a release."""
+        delay = 0.5
+        if self._paused_until > now:
+            delay = min(delay, self._paused_until - now)
+        elif self.rate > 0 and self.tokens < 1:
+            delay = min(delay, (1 - self.tokens) / self.rate)
+        return max(0.001, delay)
+
+    def _enter(self, priority, loop=None):
+        """Start at once (returns None) or queue a waiter (returns it); caller has validated priority."""
+        now = time.monotonic()
+        with self._lock:
+            if not any(self.waiting.values()) and self._can_start(priority, now):
+                self._start(priority, 0.0)
+                return None
+            waiter = SchedulerWaiter(priority, loop)
+            heapq.heappush(self._queue, (self.PRIORITIES[priority], next(self._seq), now, waiter))
+            self.waiting[priority] += 1
+            return waiter
+
+    def _poll(self, waiter, deadline):
+        """Seconds to sleep before polling again, or None once the slot is granted."""
+        now = time.monotonic()
+        with self._lock:
+            if not waiter.granted:
+                self._dispatch(now)
+            if waiter.granted:
+                return None
+            if now >= deadline:
+                waiter.cancelled = True
+                self.waiting[waiter.priority] -= 1
+                self.rejected += 1
+                raise UpstreamSaturatedError(
+                    f"No {self.name} upstream slot within {self.queue_timeout:g}s, upstream saturated")
+            return min(deadline - now, self._next_check(now))
+
+    def acquire(self, priority='interactive'):
+        """Block until the call may start; raises UpstreamSaturatedError after ``queue_timeout``."""
+        priority = priority if priority in self.PRIORITIES else 'interactive'
+        started = time.monotonic()
+        waiter = self._enter(priority)
+        if waiter is not None:
+            delay = self._poll(waiter, started + self.queue_timeout)
+            while delay is not None:
+                waiter.event.wait(delay)
+                waiter.event.clear()
+                delay = self._poll(waiter, started + self.queue_timeout)
+        METRICS.observe('ft_upstream_queue_wait_seconds', priority, time.monotonic() - started)
+
+    async def aacquire(self, priority='interactive'):
+        """Non-blocking ``acquire`` for the event loop."""
+        import asyncio
         
-        # Handle non-200 responses first
-        if response.status_code != 200:
-            error_message = raw_response.strip()
-            content_type = response.headers.get('content-type', '')
-            
-            # Try to extract error message from JSON if possible
-            if 'application/json' in content_type:
-                try:
-                    error_data = response.json()
-                    error_message = error_data.get('message', error_data.get('error', error_message))
-                except json.JSONDecodeError:
-                    pass
-            
-            # If error message is empty, provide a default
-            if not error_message:
-                error_message = f"API request failed with status code {response.status_code}"
-            
-            logger.error(f"API Error: {error_message}")
-            return jsonify({
-                'error': error_message,
-                'status_code': response.status_code
-            }), response.status_code
-        
-        # Handle empty response
-        if not raw_response or raw_response.isspace():
-            logger.error("Empty response from API")
-            return jsonify({'error': 'Empty response received from API'}), 500
-        
-        # Parse JSON response for successful requests
-        try:
-            response_data = response.json()
-            logger.info("=== PARSED API RESPONSE ===")
-            logger.info(json.dumps(response_data, indent=2))
+        priority = priority if priority in self.PRIORITIES else 'interactive'
+        started = time.monotonic()
+        waiter = self._enter(priority, asyncio.get_running_loop())
+        if waiter is not None:
+            delay = self._poll(waiter, started + self.queue_timeout)
+            while delay is not None:
+                await asyncio.wait([waiter.future], timeout=delay)
+                if waiter.future.done():
+                    waiter.future = waiter.loop.create_future()
+                delay = self._poll(waiter, started + self.queue_timeout)
+        METRICS.observe('ft_upstream_queue_wait_seconds', priority, time.monotonic() - started)
 
-            # Process toll booths
-            toll_booths = []
-            total_toll = 0
-            
-            if 'toll_booths' in response_data:
-                toll_booths = response_data['toll_booths']
-                logger.info("=== TOLL BOOTH DATA ===")
-                logger.info(f"Raw toll booth data: {json.dumps(toll_booths[0] if toll_booths else 'No toll booths', indent=2)}")
-                
-                # Transform toll booth data
-                transformed_booths = []
-                for booth in toll_booths:
-                    logger.info(f"Processing booth: {json.dumps(booth, indent=2)}")
-                    
+    def _decrease(self, now, factor):
+        """Cut the limit, at most once per smoothed round trip; caller holds the lock."""
+        if now - self._last_decrease < max(self._latency_ewma or 0.0, 0.1):
+            return
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self._last_decrease = now
+        self.decreases += 1
+
+    def release(self, elapsed=None, status=None, failed=False, retry_after=None):
+        """Free a slot and adapt the limit to how the call went (no feedback when ``elapsed`` is None)."""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if elapsed is not None:
+                if status == 429:
+                    self.throttled += 1
                     try:
-                        # Extract direct latitude/longitude fields
-                        lat = booth.get('latitude')
-                        lng = booth.get('longitude')
-                        
-                        if lat is not None and lng is not None:
-                            transformed_booth = {
-                                'name': booth.get('name', 'Unknown Toll Booth'),
-                                'price': float(booth.get('price', 0)),
-                                'address': booth.get('route_name', ''),  # Use route_name as address
-                                'coords': [float(lat), float(lng)]  # [latitude, longitude] format
-                            }
-                            transformed_booths.append(transformed_booth)
-                            logger.info(f"Successfully transformed booth: {json.dumps(transformed_booth, indent=2)}")
-                        else:
-                            logger.warning(f"Missing latitude/longitude in booth: {booth}")
-                            
-                    except Exception as e:
-                        logger.error(f"Error processing booth {booth}: {str(e)}")
-                        continue
-                
-                # Calculate total toll
-                total_toll = sum(float(booth.get('price', 0)) for booth in toll_booths)
-                logger.info(f"Total toll calculated: {total_toll}")
-                logger.info(f"Transformed {len(transformed_booths)} out of {len(toll_booths)} toll booths")
-            
-            # Process route data
-            route_coordinates = []
-            if 'route' in response_data and isinstance(response_data['route'], list):
-                # Lepton returns coordinates as [longitude, latitude] pairs
-                # Convert to [latitude, longitude] for our frontend
-                route_coordinates = [[float(coord[1]), float(coord[0])] for coord in response_data['route']]
-                logger.info(f"Extracted {len(route_coordinates)} route coordinates from Lepton route array")
-            elif 'routes' in response_data and response_data['routes']:
-                # Fallback to Google Maps format if present
-                route = response_data['routes'][0]
-                logger.info("=== ROUTE DATA ===")
-                logger.info(f"Route data available: {bool(route)}")
-                
-                try:
-                    import polyline
-                    if 'overview_polyline' in route and 'points' in route['overview_polyline']:
-                        points = polyline.decode(route['overview_polyline']['points'])
-                        route_coordinates = points
-                        logger.info(f"Extracted {len(route_coordinates)} route coordinates from overview_polyline")
-                    else:
-                        if 'legs' in route:
-                            for leg in route['legs']:
-                                if 'steps' in leg:
-                                    for step in leg['steps']:
-                                        if 'polyline' in step and 'points' in step['polyline']:
-                                            points = polyline.decode(step['polyline']['points'])
-                                            route_coordinates.extend(points)
-                            logger.info(f"Extracted {len(route_coordinates)} route coordinates from step polylines")
-                except Exception as e:
-                    logger.error(f"Error processing route data: {str(e)}")
-            else:
-                logger.warning("No route data found in response")
-            
-            # If we have toll booth coordinates but no route, create a simple route through the toll booths
-            if not route_coordinates and transformed_booths:
-                logger.info("Creating route through toll booths")
-                # Sort toll booths by distance_to_origin
-                sorted_booths = sorted(toll_booths, key=lambda x: float(x.get('distance_to_origin', 0)))
-                route_coordinates = [booth['coords'] for booth in transformed_booths]
-                logger.info(f"Created route with {len(route_coordinates)} points through toll booths")
-            
-            # Simplify route coordinates
-            simplified_route_coordinates = simplify_coordinates(route_coordinates)
-            
-            # Prepare final response
-            result = {
-                'toll_count': len(transformed_booths),
-                'total_toll_price': total_toll,
-                'toll_booths': transformed_booths,
-                'route_coordinates': simplified_route_coordinates,
-                'waypoint_coords': [],  # We'll handle waypoints later if needed
-                'origin_coords': simplified_route_coordinates[0] if simplified_route_coordinates else None,
-                'destination_coords': simplified_route_coordinates[-1] if simplified_route_coordinates else None
+                        self._paused_until = max(self._paused_until, now + min(float(retry_after), 60.0))
+                    except (TypeError, ValueError):
+                        pass
+                if failed or status == 429 or (status or 0) >= 500:
+                    self._decrease(now, 0.5)
+                else:
+                    self._latency_ewma = elapsed if self._latency_ewma is None else (
+                        0.8 * self._latency_ewma + 0.2 * elapsed)
+                    # The floor drifts up by about 1% a second, so it follows a lasting change in baseline latency
+                    self._latency_floor = elapsed if self._latency_floor is None else min(
+                        elapsed, self._latency_floor * (1 + 0.01 * min(now - self._floor_updated, 60.0)))
+                    self._floor_updated = now
+                    if self.latency_tolerance and self._latency_ewma > self._latency_floor * self.latency_tolerance:
+                        self._decrease(now, 0.9)
+                    elif self.in_flight + 1 >= int(self.limit) or self.waiting['interactive'] or self.waiting['bulk']:
+                        # Only grow while the limit is actually what holds calls back
+                        self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                        self.increases += 1
+            self._dispatch(now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'queue_depth': dict(self.waiting),
+                'rate_limit': self.rate,
+                'tokens': round(self.tokens, 2) if self.rate > 0 else None,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 3),
+                'latency_ewma': round(self._latency_ewma, 4) if self._latency_ewma is not None else None,
+                'latency_floor': round(self._latency_floor, 4) if self._latency_floor is not None else None,
+                'admitted': dict(self.admitted),
+                'wait_avg': {priority: round(self.wait_total[priority] / count, 4) if count else 0.0
+                             for priority, count in self.admitted.items()},
+                'wait_max': {priority: round(wait, 4) for priority, wait in self.wait_max.items()},
+                'rejected': self.rejected,
+                'throttled': self.throttled,
+                'increases': self.increases,
+                'decreases': self.decreases
             }
-            
-            logger.info("=== FINAL RESPONSE ===")
-            logger.info(json.dumps(result, indent=2))
-            
-            return compress_response(result)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON Decode Error: {str(e)}")
-            logger.error(f"Response text: {raw_response}")
-            logger.error(f"Response status code: {response.status_code}")
-            return jsonify({
-                'error': 'Failed to parse API response',
-                'details': str(e),
-                'status_code': response.status_code
-            }), 500
-            
-        except (ValueError, TypeError, KeyError) as e:
-            logger.error(f"Data Processing Error: {str(e)}")
-            logger.error(f"Response text: {raw_response}")
-            return jsonify({'error': f'Failed to process API response: {str(e)}'}), 500
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request Error: {str(e)}")
-        return jsonify({'error': f'API request failed: {str(e)}'}), 500
 
-@app.route('/get_fuel_price', methods=['POST'])
-def get_fuel_price():
-    data = request.json
-    logger.info("=== INCOMING FUEL PRICE REQUEST ===")
-    logger.info(json.dumps(data, indent=2))
-    
-    location = data.get('location', '').strip()
-    fuel_type = data.get('fuel_type', 'petrol').strip()
-    is_coordinates = data.get('is_coordinates', False)
-    date = datetime.now().strftime('%Y-%m-%d')
-    
-    if not location:
-        return jsonify({'error': 'Location is required'}), 400
+
+class AsyncUpstreamResponse:
+    """A fully read httpx response with the parts of the requests API the step code uses."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.encoding = response.encoding
+        self._response = response
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+class UpstreamClient:
+    """Shared HTTP client for the Lepton and Google APIs.
+
+    One ``requests.Session`` keeps a keep-alive connection pool per host.
+    Calls get separate connect and read timeouts, are retried on connection
+    errors, 429 and 5xx with jittered exponential backoff, and go through a
+    per-host circuit breaker that fails fast after repeated failures.
+
+    ``aget`` is the non-blocking counterpart used by the ASGI entry point
+    (asgi.py). It goes through an httpx.AsyncClient but shares the retry
+    policy, breaker state and stats.
+
+    Hosts listed in ``schedulers`` also need a slot from their
+    UpstreamScheduler for every attempt, at the priority in UPSTREAM_PRIORITY.
+    """
+
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUT,
+                 max_retries=UPSTREAM_MAX_RETRIES, backoff_base=UPSTREAM_BACKOFF_BASE,
+                 backoff_max=UPSTREAM_BACKOFF_MAX, pool_size=UPSTREAM_POOL_SIZE,
+                 failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 schedulers=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._hosts = {}
         
-    # If no API key, use sample data
-    if not API_KEY:
-        logger.warning("No API key found, using sample fuel data")
-        return compress_response({location.lower(): {
-            f'{fuel_type}_price': 102.50,
-            'diesel_price': None if fuel_type == 'petrol' else 95.20,
-            'petrol_price': None if fuel_type == 'diesel' else 102.50
-        }})
-    
-    try:
-        # If not using coordinates, geocode the location first
-        if not is_coordinates:
-            if not GOOGLE_MAPS_API_KEY:
-                logger.error("Google Maps API key not found")
-                return jsonify({'error': 'Geocoding service unavailable'}), 503
-                
+        self.adapter = None
+        self._session = None
+        self.pool_size = pool_size
+        self._async_session = None
+        self.schedulers = schedulers or {}
+
+    @property
+    def session(self):
+        """The pooled requests.Session, created on first use."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self.adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=8, pool_maxsize=self.pool_size, max_retries=0)
+                    session = requests.Session()
+                    session.mount('https://', self.adapter)
+                    session.mount('http://', self.adapter)
+                    self._session = session
+        return self._session
+
+    def _host_state(self, host):
+        """Return the stats/breaker record for a host; caller holds the lock."""
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {
+                'requests': 0, 'retries': 0, 'failures': 0, 'circuit_rejections': 0,
+                'statuses': {}, 'latency_total': 0.0, 'latency_max': 0.0,
+                'consecutive_failures': 0, 'open_until': 0.0, 'half_open': False
+            }
+        return state
+
+    def _before_call(self, host):
+        with self._lock:
+            state = self._host_state(host)
+            now = time.time()
+            if state['open_until'] > now or state['half_open']:
+                state['circuit_rejections'] += 1
+                raise CircuitOpenError(f"Circuit open for {host}, upstream marked unavailable")
+            if state['open_until']:
+                # Reset window elapsed: let a single trial request through
+                state['half_open'] = True
+
+    def _admit(self, host):
+        """Wait for a scheduler slot (if the host has a scheduler), then check the circuit breaker."""
+        scheduler = self.schedulers.get(host)
+        if scheduler is not None:
+            scheduler.acquire(UPSTREAM_PRIORITY.get())
+        try:
+            self._before_call(host)
+        except CircuitOpenError:
+            if scheduler is not None:
+                scheduler.release()
+            raise
+
+    async def _aadmit(self, host):
+        scheduler = self.schedulers.get(host)
+        if scheduler is not None:
+            await scheduler.aacquire(UPSTREAM_PRIORITY.get())
+        try:
+            self._before_call(host)
+        except CircuitOpenError:
+            if scheduler is not None:
+                scheduler.release()
+            raise
+
+    def _after_call(self, host, elapsed, status=None, failed=False, retry_after=None):
+        scheduler = self.schedulers.get(host)
+        if scheduler is not None:
+            scheduler.release(elapsed, status, failed, retry_after)
+        with self._lock:
+            state = self._host_state(host)
+            state['requests'] += 1
+            state['latency_total'] += elapsed
+            state['latency_max'] = max(state['latency_max'], elapsed)
+            if status is not None:
+                state['statuses'][status] = state['statuses'].get(status, 0) + 1
+            if failed:
+                state['failures'] += 1
+                state['consecutive_failures'] += 1
+                if state['half_open'] or state['consecutive_failures'] >= self.failure_threshold:
+                    state['open_until'] = time.time() + self.reset_timeout
+                    logger.warning(f"Circuit opened for {host} after {state['consecutive_failures']} failures")
+            else:
+                state['consecutive_failures'] = 0
+                state['open_until'] = 0.0
+            state['half_open'] = False
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
             try:
-                # Add region bias for India
-                geocode_url = (
-                    "https://maps.googleapis.com/maps/api/geocode/json"
-                    f"?address={location}"
-                    "&region=in"  # Bias results to India
-                    "&components=country:IN"  # Restrict to India
-                    f"&key={GOOGLE_MAPS_API_KEY}"
-                )
-                
-                logger.info(f"Geocoding request URL: {geocode_url}")
-                geocode_response = requests.get(geocode_url)
-                geocode_data = geocode_response.json()
-                
-                logger.info(f"Geocoding response: {json.dumps(geocode_data, indent=2)}")
-                
-                if geocode_data['status'] == 'OK' and geocode_data['results']:
-                    lat = geocode_data['results'][0]['geometry']['location']['lat']
-                    lng = geocode_data['results'][0]['geometry']['location']['lng']
-                    location = f"{lat},{lng}"
-                    logger.info(f"Successfully geocoded to coordinates: {location}")
-                else:
-                    error_msg = geocode_data.get('error_message', 'Could not find coordinates for this location')
-                    logger.error(f"Geocoding failed: {error_msg}")
-                    return jsonify({'error': error_msg}), 400
-            except Exception as e:
-                logger.error(f"Geocoding error: {str(e)}")
-                return jsonify({'error': 'Failed to geocode location'}), 500
-        
-        # Make request to the Lepton Fuel API
-        fuel_api_url = 'https://api.leptonmaps.com/v1/fuel/prices'
-        fuel_params = {
-            'query': location,
-            'date': date,
-            'fuel_type': fuel_type
-        }
-        
-        logger.info(f"Fuel API request - URL: {fuel_api_url}, Params: {json.dumps(fuel_params, indent=2)}")
+                delay = max(delay, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return delay
+
+    def _backoff(self, attempt, retry_after=None):
+        time.sleep(self._backoff_delay(attempt, retry_after))
+
+    def get(self, url, params=None, headers=None, read_timeout=None, stream=False):
+        """GET ``url`` with pooling, retries and the circuit breaker applied.
+
+        Returns the final ``requests.Response`` (which may still be an error
+        status once retries are exhausted) or raises a RequestException.
+        """
+        host = urlsplit(url).netloc
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
         
-        response = requests.get(
-            fuel_api_url,
-            params=fuel_params,
-            headers={'x-api-key': API_KEY},
-            timeout=10
-        )
+        for attempt in range(self.max_retries + 1):
+            self._admit(host)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, headers=headers,
+                                            timeout=timeout, stream=stream)
+            except requests.exceptions.RequestException as e:
+                self._after_call(host, time.perf_counter() - start, failed=True)
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Upstream {host} request failed ({str(e)}), retry {attempt + 1}/{self.max_retries}")
+                self._count_retry(host)
+                self._backoff(attempt)
+                continue
+            
+            retryable = response.status_code in self.RETRY_STATUSES
+            self._after_call(host, time.perf_counter() - start, response.status_code,
+                             failed=response.status_code >= 500, retry_after=response.headers.get('Retry-After'))
+            if retryable and attempt < self.max_retries:
+                logger.warning(f"Upstream {host} returned {response.status_code}, retry {attempt + 1}/{self.max_retries}")
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+                self._count_retry(host)
+                self._backoff(attempt, retry_after)
+                continue
+            return response
+
+    def _async_client(self):
+        if self._async_session is None:
+            import httpx
+            self._async_session = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=ASYNC_UPSTREAM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=self.pool_size))
+        return self._async_session
+
+    async def aget(self, url, params=None, headers=None, read_timeout=None, stream=False):
+        """Non-blocking ``get``: same retries and breaker, returns an AsyncUpstreamResponse.
+
+        httpx errors are re-raised as the matching requests exceptions so
+        callers handle both clients the same way. ``stream`` is accepted for
+        symmetry; the body is always read in full.
+        """
+        import asyncio
+        import httpx
         
-        logger.info(f"Fuel API Response Status: {response.status_code}")
-        logger.info(f"Response Content: {response.text}")
+        host = urlsplit(url).netloc
+        client = self._async_client()
+        timeout = httpx.Timeout(read_timeout or self.read_timeout, connect=self.connect_timeout)
         
-        if response.status_code == 200:
+        for attempt in range(self.max_retries + 1):
+            await self._aadmit(host)
+            start = time.perf_counter()
             try:
-                response_data = response.json()
-                # Use the location as key for the response
-                key = location.lower()
-                
-                # Ensure the response uses the correct key
-                if response_data and isinstance(response_data, dict):
-                    first_key = next(iter(response_data))
-                    if first_key != key:
-                        response_data = {key: response_data[first_key]}
-                        
-                return compress_response(response_data)
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON in successful response: {response.text}")
-                return jsonify({'error': 'Invalid response from fuel price API'}), 500
-        else:
-            error_msg = 'No fuel price data available for this location'
-            if response.status_code == 422:
-                error_msg = 'Invalid location. Please check the coordinates or city name.'
-            logger.error(f"Fuel API error: {error_msg}")
-            return jsonify({'error': error_msg}), response.status_code
+                try:
+                    response = await client.get(url, params=params, headers=headers, timeout=timeout)
+                except httpx.TimeoutException as e:
+                    raise requests.exceptions.Timeout(str(e)) from e
+                except httpx.TransportError as e:
+                    raise requests.exceptions.ConnectionError(str(e)) from e
+                except (httpx.HTTPError, httpx.InvalidURL) as e:
+                    raise requests.exceptions.RequestException(str(e)) from e
+            except requests.exceptions.RequestException as e:
+                self._after_call(host, time.perf_counter() - start, failed=True)
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Upstream {host} request failed ({str(e)}), retry {attempt + 1}/{self.max_retries}")
+                self._count_retry(host)
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
             
-    except requests.exceptions.Timeout:
-        logger.error("Timeout while calling Lepton Fuel API")
-        return jsonify({'error': 'Request timed out'}), 504
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request failed: {str(e)}")
-        return jsonify({'error': 'Failed to fetch fuel price'}), 500
+            retryable = response.status_code in self.RETRY_STATUSES
+            self._after_call(host, time.perf_counter() - start, response.status_code,
+                             failed=response.status_code >= 500, retry_after=response.headers.get('Retry-After'))
+            if retryable and attempt < self.max_retries:
+                logger.warning(f"Upstream {host} returned {response.status_code}, retry {attempt + 1}/{self.max_retries}")
+                self._count_retry(host)
+                await asyncio.sleep(self._backoff_delay(attempt, response.headers.get('Retry-After')))
+                continue
+            return AsyncUpstreamResponse(response)
 
-@app.route('/verify_bulk_password', methods=['POST'])
-def verify_bulk_password():
-    data = request.get_json()
-    password = data.get('password')
-    
-    if not password:
-        return jsonify({'success': False, 'message': 'Password is required'}), 400
-    
-    if password == BULK_PASSWORD:
-        # Create response object
-        response = make_response(jsonify({'success': True, 'message': 'Password verified'}))
+    async def aclose(self):
+        if self._async_session is not None:
+            await self._async_session.aclose()
+            self._async_session = None
+
+    def _count_retry(self, host):
+        with self._lock:
+            self._host_state(host)['retries'] += 1
+
+    def stats(self):
+        with self._lock:
+            hosts = {}
+            for host, state in self._hosts.items():
+                hosts[host] = {
+                    'requests': state['requests'],
+                    'retries': state['retries'],
+                    'failures': state['failures'],
+                    'circuit_rejections': state['circuit_rejections'],
+                    'circuit_open': state['open_until'] > time.time(),
+                    'statuses': dict(state['statuses']),
+                    'latency_avg': round(state['latency_total'] / state['requests'], 4) if state['requests'] else 0.0,
+                    'latency_max': round(state['latency_max'], 4)
+                }
+        
+        pools = {}
+        try:
+            for key in list(self.adapter.poolmanager.pools.keys() if self.adapter else ()):
+                pool = self.adapter.poolmanager.pools.get(key)
+                if pool is not None:
+                    pools[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                        'connections_opened': pool.num_connections,
+                        'requests': pool.num_requests,
+                        'idle_connections': pool.pool.qsize() if pool.pool else 0,
+                        'max_size': pool.pool.maxsize if pool.pool else 0
+                    }
+        except AttributeError:
+            pass
+        
+        return {
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'max_retries': self.max_retries,
+            'hosts': hosts,
+            'pools': pools
+        }
+
+LEPTON_SCHEDULER = UpstreamScheduler(
+    'lepton', LEPTON_RATE_LIMIT, LEPTON_RATE_BURST, LEPTON_CONCURRENCY_INITIAL, LEPTON_CONCURRENCY_MIN,
+    LEPTON_CONCURRENCY_MAX, LEPTON_LATENCY_TOLERANCE, LEPTON_BULK_SHARE, LEPTON_QUEUE_TIMEOUT)
+UPSTREAM = UpstreamClient(schedulers={urlsplit(LEPTON_API_BASE).netloc: LEPTON_SCHEDULER})
+
+class UpstreamCall:
+    """One upstream GET requested by a step generator.
+
+    Lookups that call Lepton or Google are written as generators that
+    ``yield`` an UpstreamCall and get the response (or the requests
+    exception, thrown in) back. run_upstream drives them with the blocking
+    client; asgi.py drives the same generators with ``UPSTREAM.aget``.
+    Their return value is the lookup result.
+    """
+    __slots__ = ('url', 'params', 'headers', 'read_timeout', 'stream')
+
+    def __init__(self, url, params=None, headers=None, read_timeout=None, stream=False):
+        self.url = url
+        self.params = params
+        self.headers = headers
+        self.read_timeout = read_timeout
+        self.stream = stream
+
+    def kwargs(self):
+        return {'params': self.params, 'headers': self.headers,
+                'read_timeout': self.read_timeout, 'stream': self.stream}
+
+class Concurrently:
+    """Yielded by a step generator to run several step generators at once.
+
+    The driver sends back their results in order; a step that raised is
+    returned as its exception instance instead.
+    """
+    __slots__ = ('steps', 'max_workers')
+
+    def __init__(self, steps, max_workers):
+        self.steps = list(steps)
+        self.max_workers = max_workers
+
+def advance_steps(steps, value=None, error=None):
+    """Resume a step generator; returns (done, UpstreamCall/Concurrently/Future or result)."""
+    try:
+        if error is not None:
+            return False, steps.throw(error)
+        return False, steps.send(value)
+    except StopIteration as done:
+        return True, done.value
+
+def run_upstream(steps):
+    """Drive a step generator to completion with the blocking upstream client."""
+    value, error = None, None
+    while True:
+        done, request = advance_steps(steps, value, error)
+        if done:
+            return request
+        value, error = None, None
+        if isinstance(request, Future):
+            try:
+                value = request.result()
+            except Exception as e:
+                error = e
+            continue
+        if isinstance(request, Concurrently):
+            with ThreadPoolExecutor(max_workers=max(1, min(len(request.steps), request.max_workers))) as executor:
+                # Each step runs in a copy of this context, so it keeps the caller's upstream priority
+                futures = [executor.submit(contextvars.copy_context().run, run_upstream, sub_steps)
+                           for sub_steps in request.steps]
+            value = [future.exception() or future.result() for future in futures]
+            continue
+        try:
+            value = UPSTREAM.get(request.url, **request.kwargs())
+        except (requests.exceptions.RequestException, CircuitOpenError) as e:
+            error = e
+
+async def run_upstream_async(steps):
+    """Drive a step generator on the event loop with the non-blocking client.
+
+    Upstream calls are awaited on the loop. The code between them (parsing,
+    simplification, serialisation) is resumed in a worker thread, so it
+    never blocks other requests. The current context is copied, so Flask's
+    request and ``g`` stay available.
+    """
+    import asyncio
+    
+    value, error = None, None
+    while True:
+        done, request = await asyncio.to_thread(advance_steps, steps, value, error)
+        if done:
+            return request
+        value, error = None, None
+        if isinstance(request, Future):
+            try:
+                value = await asyncio.wrap_future(request)
+            except Exception as e:
+                error = e
+            continue
+        if isinstance(request, Concurrently):
+            # Same bound as the thread pool of the sync driver
+            slots = asyncio.Semaphore(max(1, request.max_workers))
+            
+            async def run_bounded(sub_steps):
+                async with slots:
+                    return await run_upstream_async(sub_steps)
+            
+            value = list(await asyncio.gather(*(run_bounded(sub_steps) for sub_steps in request.steps),
+                                              return_exceptions=True))
+            continue
+        try:
+            value = await UPSTREAM.aget(request.url, **request.kwargs())
+        except (requests.exceptions.RequestException, CircuitOpenError) as e:
+            error = e
+
+class SingleFlight:
+    """Coalesces concurrent identical lookups into one upstream round trip.
+
+    The first caller for a key runs the lookup; callers arriving while it is
+    in flight yield its concurrent.futures.Future to their driver and get the
+    same result, or the same exception. Nothing is kept once the lookup
+    finishes, so this works with the caches disabled and never serves stale
+    data.
+    """
+    registry = {}
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+        SingleFlight.registry[name] = self
+
+    def run(self, key, steps):
+        """Step generator: run ``steps`` unless the same key is already in flight."""
+        key = ResultCache.make_key(key)
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        
+        if not leader:
+            logger.debug(f"Coalesced {self.name} lookup for {key}")
+            note_request(coalesced=self.name)
+            steps.close()
+            return (yield future)
+        
+        try:
+            result = yield from steps
+        except Exception as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            self._finish(key)
+            future.set_exception(RuntimeError(f"{self.name} lookup was abandoned"))
+            raise
+        self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'leaders': self.leaders, 'coalesced': self.followers, 'in_flight': len(self._calls)}
+
+# Toll lookups coalesce twice: whole quotes (sharing simplification too) and
+# raw Lepton responses (so multi-vehicle quotes join single ones in flight)
+TOLL_FLIGHTS = SingleFlight('toll_quotes')
+TOLL_RESPONSE_FLIGHTS = SingleFlight('toll_responses')
+FUEL_FLIGHTS = SingleFlight('fuel_prices')
+# Batch lookups also share geocodes by name and fuel prices by fuel cache cell
+GEOCODE_FLIGHTS = SingleFlight('geocodes')
+FUEL_CELL_FLIGHTS = SingleFlight('fuel_cells')
+ESTIMATE_FLIGHTS = SingleFlight('toll_estimates')
+
+GEOCODE_CACHE = ResultCache('geocodes', max_entries=GEOCODE_CACHE_SIZE,
+                            ttl=GEOCODE_CACHE_TTL, db_path=GEOCODE_CACHE_DB or None)
+
+# Google statuses that mean the place does not exist, as opposed to quota or
+# transient errors; only these are negatively cached
+GEOCODE_NOT_FOUND_STATUSES = ('ZERO_RESULTS', 'INVALID_REQUEST')
+
+_city_centroids = None
+_city_points = []
+_city_centroids_lock = threading.Lock()
+
+def load_city_centroids():
+    """Return the bundled city centroids keyed by normalised name, loading them once."""
+    global _city_centroids, _city_points
+    if _city_centroids is None:
+        with _city_centroids_lock:
+            if _city_centroids is None:
+                centroids = {}
+                points = []
+                try:
+                    with open(CITY_CENTROIDS_FILE, newline='', encoding='utf-8') as f:
+                        for row in csv.DictReader(f):
+                            lat, lng = float(row['lat']), float(row['lng'])
+                            coords = f"{lat},{lng}"
+                            name = geocode_cache_key(row['name'])
+                            centroids.setdefault(name, coords)
+                            centroids.setdefault(f"{name}, {geocode_cache_key(row['state'])}", coords)
+                            points.append((name, lat, lng))
+                except (OSError, KeyError, ValueError) as e:
+                    logger.error(f"Failed to load city centroids: {str(e)}")
+                logger.info(f"Loaded {len(centroids)} city centroid keys")
+                _city_points = points
+                _city_centroids = centroids
+    return _city_centroids
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 6371.0088 * 2 * math.asin(math.sqrt(min(1.0, a)))
+
+def nearest_city(lat, lng, max_km):
+    """Name of the closest bundled city within ``max_km``, or None."""
+    load_city_centroids()
+    best_name, best_km = None, max_km
+    for name, city_lat, city_lng in _city_points:
+        # Cheap bounding check before the trigonometry
+        if abs(city_lat - lat) * 111.0 > best_km:
+            continue
+        km = haversine_km(lat, lng, city_lat, city_lng)
+        if km <= best_km:
+            best_name, best_km = name, km
+    return best_name
+
+def geocode_cache_key(location):
+    """Normalise a place name for geocode lookups (case, spacing, aliases from the place index)."""
+    key = normalise_cache_part(location)
+    if key.endswith(', india'):
+        key = key[:-len(', india')].rstrip()
+    name = load_place_index().resolve(key)
+    return normalise_cache_part(name) if name else key
+
+def normalise_place_name(text):
+    """Fold a place name to the form the place index is keyed by: lowercase ASCII words."""
+    text = unicodedata.normalize('NFKD', str(text or '')).casefold()
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text).split())
+
+class PlaceIndex:
+    """Prefix trie over the bundled gazetteer, for autocomplete and place-name correction.
+
+    The trie is flattened into arrays in breadth-first order. Node ``i`` has
+    ``child_count[i]`` children from ``first_child[i]`` on, sorted by the
+    character on the edge into them (``label``). ``terminal[i]`` is the best
+    place whose name or alias ends at the node (-1 if none), and
+    ``top_ids[top_start[i]:top_start[i + 1]]`` are the best places anywhere
+    below it. Place ids are assigned by popularity, so a lower id ranks
+    higher and a prefix lookup is one walk down the trie with no subtree
+    scan. The arrays are written to and loaded from a binary file as is.
+    """
+
+    MAGIC = b'FTPLIDX1'
+    ARRAYS = (('first_child', 'I'), ('child_count', 'I'), ('label', 'I'), ('terminal', 'i'),
+              ('top_start', 'I'), ('top_ids', 'I'), ('lat', 'd'), ('lng', 'd'), ('population', 'Q'), ('kind', 'B'))
+    KINDS = ('city', 'toll_plaza')
+
+    def __init__(self, arrays, strings, source_digest):
+        for name, _ in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        # Name and region of place i are strings[2 * i] and strings[2 * i + 1]
+        self.strings = strings
+        self.source_digest = source_digest
+
+    @classmethod
+    def build(cls, places, aliases, source_digest=b'', top_k=PLACE_INDEX_TOP_K):
+        """Build the index from place dicts (name, region, lat, lng, population, kind) and (alias, name) pairs."""
+        places = sorted(places, key=lambda place: (-place['population'], place['name']))
+        best_by_name = {}
+        for place_id, place in enumerate(places):
+            best_by_name.setdefault(normalise_place_name(place['name']), place_id)
+        keys = [(normalise_place_name(place['name']), place_id) for place_id, place in enumerate(places)]
+        for alias, name in aliases:
+            if normalise_place_name(name) not in best_by_name:
+                raise ValueError(f"Alias {alias!r} points at unknown place {name!r}")
+            keys.append((normalise_place_name(alias), best_by_name[normalise_place_name(name)]))
+
+        # Nested [children, place ids ending here] nodes, then laid out breadth first
+        root = [{}, []]
+        for key, place_id in keys:
+            if not key:
+                continue
+            node = root
+            for char in key:
+                node = node[0].setdefault(char, [{}, []])
+            node[1].append(place_id)
+
+        order, labels = [root], [0]
+        first_child, child_count, terminal = array('I'), array('I'), array('i')
+        for node in order:
+            first_child.append(len(order))
+            child_count.append(len(node[0]))
+            terminal.append(min(node[1]) if node[1] else -1)
+            for char in sorted(node[0]):
+                order.append(node[0][char])
+                labels.append(ord(char))
+
+        # Children come after their parent, so a reverse pass sees them first
+        tops = [None] * len(order)
+        for i in range(len(order) - 1, -1, -1):
+            ids = set(order[i][1])
+            for child in range(first_child[i], first_child[i] + child_count[i]):
+                ids.update(tops[child])
+            tops[i] = sorted(ids)[:top_k]
+        top_start, top_ids = array('I', [0]), array('I')
+        for ids in tops:
+            top_ids.extend(ids)
+            top_start.append(len(top_ids))
+
+        arrays = {
+            'first_child': first_child, 'child_count': child_count, 'label': array('I', labels),
+            'terminal': terminal, 'top_start': top_start, 'top_ids': top_ids,
+            'lat': array('d', (place['lat'] for place in places)),
+            'lng': array('d', (place['lng'] for place in places)),
+            'population': array('Q', (place['population'] for place in places)),
+            'kind': array('B', (cls.KINDS.index(place['kind']) for place in places))
+        }
+        strings = [value for place in places for value in (place['name'], place['region'])]
+        return cls(arrays, strings, source_digest)
+
+    def save(self, path):
+        parts = [self.MAGIC, self.source_digest.ljust(16, b'\0')[:16]]
+        for name, typecode in self.ARRAYS:
+            values = array(typecode, getattr(self, name))
+            if sys.byteorder == 'big':
+                values.byteswap()
+            parts.append(struct.pack('<I', len(values)))
+            parts.append(values.tobytes())
+        text = '\n'.join(self.strings).encode('utf-8')
+        parts.append(struct.pack('<I', len(text)))
+        parts.append(text)
+        with open(path, 'wb') as f:
+            f.write(b''.join(parts))
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save; raises ValueError if the file is not one."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:8] != cls.MAGIC:
+            raise ValueError(f"{path} is not a place index")
+        source_digest, offset = data[8:24], 24
+        arrays = {}
+        try:
+            for name, typecode in cls.ARRAYS:
+                values = array(typecode)
+                (count,), offset = struct.unpack_from('<I', data, offset), offset + 4
+                end = offset + count * values.itemsize
+                values.frombytes(data[offset:end])
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                arrays[name], offset = values, end
+            (length,), offset = struct.unpack_from('<I', data, offset), offset + 4
+            strings = data[offset:offset + length].decode('utf-8').split('\n')
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            raise ValueError(f"{path} is truncated or corrupt: {str(e)}")
+        return cls(arrays, strings, source_digest)
+
+    def _child(self, node, code):
+        lo = self.first_child[node]
+        end = hi = lo + self.child_count[node]
+        label = self.label
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if label[mid] < code:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < end and label[lo] == code else -1
+
+    def _walk(self, key):
+        node = 0
+        for char in key:
+            node = self._child(node, ord(char))
+            if node < 0:
+                break
+        return node
+
+    def _tops(self, node):
+        return self.top_ids[self.top_start[node]:self.top_start[node + 1]]
+
+    def _fuzzy(self, key, max_edits):
+        """Yield (node, edits) for trie paths within ``max_edits`` of ``key``.
+
+        Edits are insertions, deletions, substitutions and swaps of adjacent
+        characters (optimal string alignment). The path may go on past the
+        key, so every node yielded is a prefix match. Branches are dropped as
+        soon as no alignment can stay within the bound.
+        """
+        codes = [ord(char) for char in key]
+        n = len(codes)
+        stack = [(0, list(range(n + 1)), None, 0)]
+        while stack:
+            node, row, prev_row, prev_code = stack.pop()
+            for child in range(self.first_child[node], self.first_child[node] + self.child_count[node]):
+                code = self.label[child]
+                new_row = [row[0] + 1]
+                for i in range(1, n + 1):
+                    cost = min(new_row[i - 1] + 1, row[i] + 1, row[i - 1] + (codes[i - 1] != code))
+                    if prev_row is not None and i > 1 and codes[i - 1] == prev_code and codes[i - 2] == code:
+                        cost = min(cost, prev_row[i - 2] + 1)
+                    new_row.append(cost)
+                if new_row[n] <= max_edits:
+                    yield child, new_row[n]
+                if min(new_row) <= max_edits:
+                    stack.append((child, new_row, row, code))
+
+    @staticmethod
+    def typo_budget(key):
+        """Edits a query of this length may contain: none below 4 characters, one up to 7, then two."""
+        return 0 if len(key) < 4 else 1 if len(key) < 8 else 2
+
+    def complete(self, text, limit=8, max_edits=None):
+        """Best places whose name or an alias starts with ``text``, allowing typos.
+
+        Returns (place id, edits) pairs: exact prefix matches first, then
+        matches with one or more edits, each ordered by popularity.
+        """
+        key = normalise_place_name(text)
+        if not key:
+            return []
+        matches = {}
+        node = self._walk(key)
+        if node >= 0:
+            matches.update((place_id, 0) for place_id in self._tops(node))
+        max_edits = self.typo_budget(key) if max_edits is None else max_edits
+        if len(matches) < limit and max_edits > 0:
+            for node, edits in self._fuzzy(key, max_edits):
+                for place_id in self._tops(node):
+                    if edits < matches.get(place_id, max_edits + 1):
+                        matches[place_id] = edits
+        return sorted(matches.items(), key=lambda match: (match[1], match[0]))[:limit]
+
+    def resolve(self, text, kinds=None):
+        """The gazetteer name for an exact place name or alias (of one of ``kinds``), or None.
+
+        Misspellings are deliberately not corrected: a town missing from the
+        gazetteer would be rewritten to a different one. Typo tolerance is
+        only for suggestions (complete).
+        """
+        key = normalise_place_name(text)
+        if not key:
+            return None
+        node = self._walk(key)
+        if node >= 0 and self.terminal[node] >= 0 and (kinds is None or self.kind_of(self.terminal[node]) in kinds):
+            return self.name(self.terminal[node])
+        return None
+
+    def name(self, place_id):
+        return self.strings[2 * place_id]
+
+    def kind_of(self, place_id):
+        return self.KINDS[self.kind[place_id]]
+
+    def describe(self, place_id, edits=0):
+        name, region = self.strings[2 * place_id], self.strings[2 * place_id + 1]
+        return {
+            'name': name,
+            'region': region,
+            'description': f"{name}, {region}" if region else name,
+            'kind': self.kind_of(place_id),
+            'coords': [self.lat[place_id], self.lng[place_id]],
+            'population': self.population[place_id] or None,
+            'edits': edits
+        }
+
+    def stats(self):
+        return {
+            'places': len(self.lat),
+            'trie_nodes': len(self.first_child),
+            'source_digest': self.source_digest.hex()
+        }
+
+def read_gazetteer():
+    """Places, aliases and a digest of the source files, as PlaceIndex.build takes them."""
+    places, aliases, digest = [], [], hashlib.sha256()
+    with open(CITY_CENTROIDS_FILE, newline='', encoding='utf-8') as f:
+        text = f.read()
+        digest.update(text.encode('utf-8'))
+        for row in csv.DictReader(io.StringIO(text)):
+            places.append({'name': row['name'], 'region': row['state'], 'lat': float(row['lat']),
+                           'lng': float(row['lng']), 'population': int(row['population'] or 0), 'kind': 'city'})
+    with open(TOLL_PLAZAS_FILE, newline='', encoding='utf-8') as f:
+        text = f.read()
+        digest.update(text.encode('utf-8'))
+        for row in csv.DictReader(io.StringIO(text)):
+            places.append({'name': row['name'], 'region': row['route'], 'lat': float(row['lat']),
+                           'lng': float(row['lng']), 'population': 0, 'kind': 'toll_plaza'})
+    with open(PLACE_ALIASES_FILE, newline='', encoding='utf-8') as f:
+        text = f.read()
+        digest.update(text.encode('utf-8'))
+        aliases = [(row['alias'], row['name']) for row in csv.DictReader(io.StringIO(text))]
+    return places, aliases, digest.digest()[:16]
+
+_place_index = None
+_place_index_lock = threading.Lock()
+
+def load_place_index():
+    """Return the place index, loading PLACE_INDEX_FILE once (built from the CSVs if it is missing)."""
+    global _place_index
+    if _place_index is None:
+        with _place_index_lock:
+            if _place_index is None:
+                try:
+                    _place_index = PlaceIndex.load(PLACE_INDEX_FILE)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Place index unavailable ({str(e)}), building it from the gazetteer")
+                    try:
+                        _place_index = PlaceIndex.build(*read_gazetteer())
+                    except (OSError, KeyError, ValueError) as e:
+                        logger.error(f"Failed to build the place index: {str(e)}")
+                        _place_index = PlaceIndex.build([], [])
+    return _place_index
+
+def geocode_location(location):
+    """Resolve a place name to a 'lat,lng' string.
+
+    Bundled city centroids are checked first, then the geocode cache, and
+    only then the Google Geocoding API. Raises FuelApiError on failure.
+    """
+    return run_upstream(geocode_location_steps(location))
+
+def geocode_location_steps(location):
+    """Step generator behind geocode_location (see UpstreamCall)."""
+    key = geocode_cache_key(location)
+    
+    seeded = load_city_centroids().get(key)
+    if seeded:
+        logger.debug(f"Geocoded {location} from bundled city centroids: {seeded}")
+        note_request(geocode='seed')
+        return seeded
+    
+    cached = GEOCODE_CACHE.get(key)
+    if cached is not None:
+        if cached.get('error'):
+            logger.debug(f"Geocode negative cache hit for {location}")
+            note_request(geocode='negative_cache')
+            raise FuelApiError(cached['error'], 400)
+        logger.debug(f"Geocode cache hit for {location}: {cached['location']}")
+        note_request(geocode='cache')
+        return cached['location']
+    
+    if not GOOGLE_MAPS_API_KEY:
+        logger.error("Google Maps API key not found")
+        raise FuelApiError('Geocoding service unavailable', 503)
+    
+    try:
+        geocode_url = f"{GOOGLE_MAPS_API_BASE}/maps/api/geocode/json"
+        geocode_params = {
+            'address': location,
+            'region': 'in',  # Bias results to India
+            'components': 'country:IN',  # Restrict to India
+            'key': GOOGLE_MAPS_API_KEY
+        }
+        
+        logger.debug(f"Geocoding request URL: {geocode_url}, address: {location}")
+        note_request(geocode='google')
+        with timed_stage('fuel.geocode'):
+            geocode_response = yield UpstreamCall(geocode_url, params=geocode_params)
+            geocode_data = geocode_response.json()
+        
+        log_payload("Geocoding response", geocode_data)
+        
+        if geocode_data['status'] == 'OK' and geocode_data['results']:
+            lat = geocode_data['results'][0]['geometry']['location']['lat']
+            lng = geocode_data['results'][0]['geometry']['location']['lng']
+            coords = f"{lat},{lng}"
+            logger.debug(f"Successfully geocoded to coordinates: {coords}")
+            GEOCODE_CACHE.set(key, {'location': coords})
+            return coords
+        
+        error_msg = geocode_data.get('error_message', 'Could not find coordinates for this location')
+        logger.error(f"Geocoding failed: {error_msg}")
+        if geocode_data['status'] in GEOCODE_NOT_FOUND_STATUSES:
+            GEOCODE_CACHE.set(key, {'error': error_msg}, ttl=GEOCODE_NEGATIVE_TTL)
+    except Exception as e:
+        logger.error(f"Geocoding error: {str(e)}")
+        raise FuelApiError('Failed to geocode location', 500)
+    
+    raise FuelApiError(error_msg, 400)
+
+FUEL_CACHE = ResultCache('fuel_prices', max_entries=FUEL_CACHE_SIZE,
+                         ttl=24 * 60 * 60, db_path=FUEL_CACHE_DB)
+
+def fuel_cache_cell(coords):
+    """Snap a 'lat,lng' string to the spatial cell its fuel price is cached under."""
+    try:
+        lat, lng = map(float, coords.split(','))
+    except (ValueError, AttributeError):
+        return None
+    if FUEL_SNAP_MODE == 'city':
+        city = nearest_city(lat, lng, FUEL_CITY_SNAP_KM)
+        if city:
+            return f"city:{city}"
+    return f"grid:{math.floor(lat / FUEL_GRID_DEG)}:{math.floor(lng / FUEL_GRID_DEG)}"
+
+def seconds_until_midnight(now=None):
+    """Seconds left in the current local day (at least one minute)."""
+    now = now or datetime.now()
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(60, int((midnight - now).total_seconds()))
+
+def lookup_fuel_price(location, fuel_type='petrol', coordinates_given=False, date=None):
+    """Return the fuel price response for a place name or 'lat,lng' string.
+
+    The result is keyed by the (geocoded) location, as /get_fuel_price
+    returns it. Raises FuelApiError when geocoding or the Lepton call fails.
+    """
+    return run_upstream(lookup_fuel_price_steps(location, fuel_type, coordinates_given, date))
+
+def lookup_fuel_price_steps(location, fuel_type='petrol', coordinates_given=False, date=None):
+    """Step generator behind lookup_fuel_price (see UpstreamCall)."""
+    date = date or datetime.now().strftime('%Y-%m-%d')
+    
+    # If no API key, use sample data
+    if not API_KEY:
+        logger.warning("No API key found, using sample fuel data")
+        return {location.lower(): {
+            f'{fuel_type}_price': 102.50,
+            'diesel_price': None if fuel_type == 'petrol' else 95.20,
+            'petrol_price': None if fuel_type == 'diesel' else 102.50
+        }}
+    
+    flight_key = [normalise_cache_part(location), fuel_type, date, bool(coordinates_given)]
+    return (yield from FUEL_FLIGHTS.run(
+        flight_key, fetch_fuel_price_steps(location, fuel_type, coordinates_given, date)))
+
+def fetch_fuel_price_steps(location, fuel_type, coordinates_given, date):
+    """Geocode if needed, then look the price up in the fuel cache or the Lepton API."""
+    # If not using coordinates, geocode the location first
+    if not coordinates_given:
+        location = yield from geocode_location_steps(location)
+    
+    # Use the location as key for the response
+    key = location.lower()
+    cell = fuel_cache_cell(location)
+    cache_key = [fuel_type, date, cell] if cell else None
+    if cache_key:
+        cached = FUEL_CACHE.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Fuel price cache hit for {fuel_type} at {cell} on {date}")
+            note_request(fuel_cache='hit')
+            return {key: cached}
+    
+    # Make request to the Lepton Fuel API
+    fuel_api_url = f'{LEPTON_API_BASE}/v1/fuel/prices'
+    fuel_params = {
+        'query': location,
+        'date': date,
+        'fuel_type': fuel_type
+    }
+    
+    logger.debug(f"Fuel API request - URL: {fuel_api_url}, Params: {fuel_params}")
+    note_request(fuel_cache='miss' if cache_key else 'uncached')
+    
+    try:
+        with timed_stage('fuel.upstream'):
+            response = yield UpstreamCall(
+                fuel_api_url,
+                params=fuel_params,
+                headers={'x-api-key': API_KEY},
+                read_timeout=10
+            )
+    except CircuitOpenError as e:
+        logger.error(f"Request failed: {str(e)}")
+        raise FuelApiError('Fuel price service temporarily unavailable', 503)
+    except requests.exceptions.Timeout:
+        logger.error("Timeout while calling Lepton Fuel API")
+        raise FuelApiError('Request timed out', 504)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request failed: {str(e)}")
+        raise FuelApiError('Failed to fetch fuel price', 500)
+    
+    note_request(upstream_status=response.status_code, upstream_bytes=len(response.content))
+    log_payload("Fuel API response", lambda: response.text)
+    
+    if response.status_code != 200:
+        error_msg = 'No fuel price data available for this location'
+        if response.status_code == 422:
+            error_msg = 'Invalid location. Please check the coordinates or city name.'
+        logger.error(f"Fuel API error: {error_msg}")
+        raise FuelApiError(error_msg, response.status_code)
+    
+    try:
+        with timed_stage('fuel.parse'):
+            response_data = response.json()
+    except json.JSONDecodeError:
+        logger.error(f"Invalid JSON in successful response: {truncate_for_log(response.text)}")
+        raise FuelApiError('Invalid response from fuel price API', 500)
+    
+    # Ensure the response uses the correct key
+    if response_data and isinstance(response_data, dict):
+        first_key = next(iter(response_data))
+        if first_key != key:
+            response_data = {key: response_data[first_key]}
+        if cache_key:
+            # The date is part of the key, so entries roll over at midnight anyway
+            FUEL_CACHE.set(cache_key, response_data[key], ttl=seconds_until_midnight())
+    
+    return response_data
+
+def fuel_batch_item_steps(location, coordinates_given, fuel_type, date):
+    """Coordinates and price of one fuel type at one location, for fuel_prices_batch_steps."""
+    coords = location
+    if not coordinates_given and API_KEY:
+        coords = yield from GEOCODE_FLIGHTS.run(geocode_cache_key(location), geocode_location_steps(location))
+    cell = fuel_cache_cell(coords) if API_KEY else None
+    value = yield from FUEL_CELL_FLIGHTS.run([fuel_type, date, cell or coords.lower()],
+                                             lookup_fuel_price_steps(coords, fuel_type, True, date))
+    price = next(iter(value.values()), None) if isinstance(value, dict) and value else None
+    price = price.get(f'{fuel_type}_price') if isinstance(price, dict) else None
+    if price is None:
+        raise FuelApiError(f'No {fuel_type} price data available for this location', 404)
+    return coords, float(price)
+
+def fuel_prices_batch_steps(locations, fuel_types, date):
+    """Fuel prices for many locations and fuel types in one pass (see UpstreamCall).
+
+    Locations are normalised with process_location and deduplicated, then
+    every location and fuel type is looked up concurrently, at most
+    FUEL_BATCH_MAX_WORKERS at a time. Geocodes are shared by name and prices
+    by fuel cache cell, so nearby locations cost one Lepton call. Failures
+    are reported per location and fuel type instead of failing the batch.
+    """
+    # Requested key -> normalised location, then one lookup per normalised location
+    keys = OrderedDict()
+    unique = OrderedDict()
+    for location in locations:
+        key = location.strip() if isinstance(location, str) else parse_coordinates(location) or json.dumps(location)
+        processed = process_location(location.strip() if isinstance(location, str) else location)
+        keys[key] = geocode_cache_key(processed) if processed else None
+        if processed:
+            unique.setdefault(keys[key], processed)
+    
+    lookups = [(normalised, fuel_type) for normalised in unique for fuel_type in fuel_types]
+    values = yield Concurrently(
+        (fuel_batch_item_steps(unique[normalised], is_coordinates(unique[normalised]), fuel_type, date)
+         for normalised, fuel_type in lookups),
+        FUEL_BATCH_MAX_WORKERS)
+    
+    entries = {normalised: {'location': processed, 'coordinates': None} for normalised, processed in unique.items()}
+    for (normalised, fuel_type), value in zip(lookups, values):
+        entry = entries[normalised]
+        if isinstance(value, FuelApiError):
+            entry[f'{fuel_type}_price'] = None
+            entry.setdefault('errors', {})[fuel_type] = {**value.payload, 'status_code': value.status_code}
+            continue
+        if isinstance(value, Exception):
+            raise value
+        entry['coordinates'], entry[f'{fuel_type}_price'] = value
+    
+    # A location where every fuel type failed for the same reason gets a single error
+    for entry in entries.values():
+        errors = entry.get('errors')
+        if errors and len(errors) == len(fuel_types) and len({error['error'] for error in errors.values()}) == 1:
+            first = next(iter(errors.values()))
+            entry.update(error=first['error'], status_code=first['status_code'])
+            del entry['errors']
+            for fuel_type in fuel_types:
+                entry.pop(f'{fuel_type}_price', None)
+    
+    invalid = {'location': None, 'coordinates': None, 'error': 'Invalid location', 'status_code': 400}
+    results = OrderedDict((key, entries[normalised] if normalised else invalid) for key, normalised in keys.items())
+    failed = sum(1 for entry in results.values() if 'error' in entry or 'errors' in entry)
+    note_request(fuel_locations=len(unique), fuel_lookups=len(lookups), fuel_failed=failed)
+    return {
+        'date': date,
+        'fuel_types': fuel_types,
+        'results': results,
+        'summary': {
+            'requested': len(locations),
+            'locations': len(unique),
+            'lookups': len(lookups),
+            'failed': failed
+        }
+    }
+
+def serialize_json(response_data):
+    """JSON response body bytes, formatted as jsonify would."""
+    # Same output as jsonify: compact separators outside debug mode
+    if app.debug:
+        body = app.json.dumps(response_data, indent=2)
+    else:
+        body = app.json.dumps(response_data, separators=(',', ':'))
+    return (body + '\n').encode('utf-8')
+
+def compress_response(response_data, etag_key=None):
+    """Serialise response data once, gzip it if the client accepts it and attach an ETag.
+
+    The strong ETag hashes ``etag_key`` (the normalised query, defaulting to
+    the request path) together with the JSON body; gzipped bodies get a
+    ``-gzip`` suffix so each representation has its own validator. A matching
+    If-None-Match gets a bodiless 304. ``response_data`` may also be a body
+    already produced by serialize_json.
+    """
+    body = response_data if isinstance(response_data, bytes) else serialize_json(response_data)
+    METRICS.observe_histogram('ft_response_payload_bytes', len(body))
+    
+    digest = hashlib.sha256()
+    digest.update((etag_key or request.path).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(body)
+    etag = digest.hexdigest()[:32]
+    use_gzip = len(body) > COMPRESSION_THRESHOLD and request.accept_encodings['gzip'] > 0
+    if use_gzip:
+        etag += '-gzip'
+    
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=COMPRESSION_LEVEL)
+        response = make_response(body)
+        response.headers['Content-Type'] = 'application/json'
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def douglas_peucker_indices(coords, tolerance=0.00001):
+    """Return the indices of the points Douglas-Peucker keeps, in route order.
+
+    Segments still to be examined live on an explicit stack instead of the
+    call stack, and no sub-lists are sliced off. When numpy is installed the
+    distances for long segments are computed in one vectorised pass; short
+    segments (the bulk of the work near the leaves) use a plain loop, where
+    numpy's per-call overhead would outweigh the saving.
+
+    ``coords`` is a list of pairs or a flat array('d') of x, y values, which
+    numpy reads in place without building per-point objects.
+    """
+    flat = isinstance(coords, array)
+    count = len(coords) // 2 if flat else len(coords)
+    if count <= 2:
+        return list(range(count))
+    
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    
+    if np is not None:
+        if flat:
+            points = np.frombuffer(coords, dtype=float, count=count * 2).reshape(count, 2)
+        else:
+            points = np.asarray(coords, dtype=float).reshape(count, 2)
+        xs_array, ys_array = points[:, 0], points[:, 1]
+        xs, ys = xs_array.tolist(), ys_array.tolist()
+    elif flat:
+        xs, ys = coords[0::2], coords[1::2]
+    else:
+        xs = [float(point[0]) for point in coords]
+        ys = [float(point[1]) for point in coords]
+    
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        
+        sx, sy = xs[first], ys[first]
+        ex, ey = xs[last], ys[last]
+        dy, dx = ey - sy, ex - sx
+        vectorised = np is not None and last - first > DOUGLAS_PEUCKER_VECTOR_MIN
+        
+        # Same operation order as the original point_line_distance, so the
+        # chosen split points (and therefore the output) are bit-for-bit equal
+        if sx == ex and sy == ey:
+            if vectorised:
+                dists = ((xs_array[first + 1:last] - sx) ** 2 + (ys_array[first + 1:last] - sy) ** 2) ** 0.5
+            else:
+                dists = [((xs[i] - sx) ** 2 + (ys[i] - sy) ** 2) ** 0.5 for i in range(first + 1, last)]
+        else:
+            d = (dy ** 2 + dx ** 2) ** 0.5
+            if d <= 0:
+                continue
+            if vectorised:
+                dists = np.abs(dy * xs_array[first + 1:last] - dx * ys_array[first + 1:last] + ex * sy - ey * sx) / d
+            else:
+                dists = [abs(dy * xs[i] - dx * ys[i] + ex * sy - ey * sx) / d for i in range(first + 1, last)]
+        
+        if vectorised:
+            offset = int(np.argmax(dists))
+            dmax = float(dists[offset])
+        else:
+            dmax = max(dists)
+            offset = dists.index(dmax)
+        
+        if dmax > tolerance:
+            index = first + 1 + offset
+            keep[index] = True
+            stack.append((index, last))
+            stack.append((first, index))
+    
+    return [i for i in range(count) if keep[i]]
+
+def simplify_coordinates(coords, tolerance=0.00001):
+    """Simplify route coordinates using Douglas-Peucker algorithm
+
+    Accepts [lat, lng] pairs or a flat lat, lng array('d'); returns pairs.
+    """
+    if isinstance(coords, array):
+        return [[coords[2 * i], coords[2 * i + 1]] for i in douglas_peucker_indices(coords, tolerance)]
+    if len(coords) <= 2:
+        return coords
+    return [coords[i] for i in douglas_peucker_indices(coords, tolerance)]
+
+def quantise_route(coords, precision=ROUTE_PRECISION):
+    """Return [lat, lng] pairs (or a flat lat, lng array('d')) as a flat list of integer deltas at 10^precision.
+
+    The first pair is absolute, every following pair is the difference from
+    the previous point. Rounding is half away from zero, as in Google's
+    encoded polyline algorithm.
+    """
+    if not coords:
+        return []
+    factor = 10 ** precision
+    np = None
+    if len(coords) >= ROUTE_VECTOR_MIN_POINTS:
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+    
+    if np is not None:
+        scaled = np.asarray(coords, dtype=float).reshape(-1) * factor
+        fixed = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+        deltas = np.empty_like(fixed)
+        deltas[:2] = fixed[:2]
+        deltas[2:] = fixed[2:] - fixed[:-2]
+        return deltas.tolist()
+    
+    if isinstance(coords, array):
+        coords = zip(coords[0::2], coords[1::2])
+    deltas = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coords:
+        lat = int(math.copysign(math.floor(abs(lat) * factor + 0.5), lat))
+        lng = int(math.copysign(math.floor(abs(lng) * factor + 0.5), lng))
+        deltas.append(lat - prev_lat)
+        deltas.append(lng - prev_lng)
+        prev_lat, prev_lng = lat, lng
+    return deltas
+
+def encode_polyline(deltas):
+    """Encode a flat delta list from quantise_route as a Google encoded polyline."""
+    chunks = []
+    for value in deltas:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+def decode_polyline(encoded, precision=ROUTE_PRECISION):
+    """Decode a Google encoded polyline into a flat lat, lng array('d')."""
+    factor = 10 ** precision
+    np = None
+    # At least two characters per point
+    if len(encoded) >= 2 * ROUTE_VECTOR_MIN_POINTS:
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+    
+    if np is not None:
+        data = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+        if ((data < 0) | (data > 63)).any():
+            raise ValueError('Encoded polyline contains invalid characters')
+        ends = np.flatnonzero(data < 0x20)
+        if (len(data) and (not len(ends) or ends[-1] != len(data) - 1)) or len(ends) % 2:
+            raise ValueError('Encoded polyline is truncated')
+        points = array('d')
+        if not len(ends):
+            return points
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        position = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+        if position.max() > 6:
+            raise ValueError('Encoded polyline value out of range')
+        values = np.add.reduceat((data & 0x1f) << (5 * position), starts)
+        values = np.where(values & 1, ~(values >> 1), values >> 1)
+        points.frombytes((np.cumsum(values.reshape(-1, 2), axis=0) / factor).tobytes())
+        return points
+    
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        if not 0 <= byte < 64:
+            raise ValueError('Encoded polyline contains invalid characters')
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    if shift or len(values) % 2:
+        raise ValueError('Encoded polyline is truncated')
+    
+    points = array('d')
+    lat = lng = 0
+    for i in range(0, len(values), 2):
+        lat += values[i]
+        lng += values[i + 1]
+        points.append(lat / factor)
+        points.append(lng / factor)
+    return points
+
+def requested_route_format(data):
+    """Pick the route encoding from the request body, falling back to the Accept header."""
+    route_format = data.get('route_format') if isinstance(data, dict) else None
+    if not route_format:
+        for part in request.headers.get('Accept', '').split(','):
+            for param in part.split(';')[1:]:
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'route':
+                    route_format = value.strip().strip('"')
+    route_format = str(route_format or 'coordinates').lower()
+    if route_format not in ROUTE_FORMATS:
+        raise TollApiError(f"route_format must be one of: {', '.join(ROUTE_FORMATS)}", 400)
+    return route_format
+
+def encode_route(result, route_format):
+    """Return a copy of a toll result with route_coordinates in the requested encoding.
+
+    Results may come straight from the toll cache, so the input is never modified.
+    """
+    if route_format == 'coordinates' or 'route_coordinates' not in result:
+        return result
+    encoded = {key: value for key, value in result.items() if key != 'route_coordinates'}
+    deltas = quantise_route(result['route_coordinates'])
+    encoded['route_format'] = route_format
+    encoded['route_precision'] = ROUTE_PRECISION
+    if route_format == 'polyline':
+        encoded['route_polyline'] = encode_polyline(deltas)
+    else:
+        encoded['route_delta'] = deltas
+    return encoded
+
+def degrees_per_pixel(zoom):
+    """Width of one pixel in degrees of longitude at a web-map zoom level (256 px tiles)."""
+    return 360.0 / (256 * 2 ** zoom)
+
+class RoutePyramid:
+    """A route simplified once per zoom band, with a grid index of segments per level.
+
+    ``points`` is the route at full detail as a flat lat, lng array('d'); it
+    is the level of the deepest band. Every coarser level is simplified from
+    the next finer one with a tolerance of ROUTE_PIXEL_TOLERANCE pixels at the
+    band's deepest zoom, so each level's points are a subset of the finer
+    ones. A level's segment buckets are built on its first viewport query, in
+    grid cells one tile wide at the band's shallowest zoom.
+    """
+
+    def __init__(self, points, bands=ROUTE_ZOOM_BANDS, pixel_tolerance=ROUTE_PIXEL_TOLERANCE):
+        self.bands = bands
+        lats, lngs = points[0::2], points[1::2]
+        self.bbox = [min(lats), min(lngs), max(lats), max(lngs)]
+        # A pixel spans fewer degrees of latitude than of longitude (by cos(latitude) in web Mercator)
+        scale = math.cos(math.radians((self.bbox[0] + self.bbox[2]) / 2))
+        self.levels = [None] * len(bands)
+        self.levels[-1] = points
+        for index in range(len(bands) - 2, -1, -1):
+            finer = self.levels[index + 1]
+            tolerance = pixel_tolerance * degrees_per_pixel(bands[index][1]) * scale
+            self.levels[index] = array('d', (finer[j] for i in douglas_peucker_indices(finer, tolerance)
+                                             for j in (2 * i, 2 * i + 1)))
+        self._buckets = [None] * len(bands)
+        self._lock = threading.Lock()
+
+    def level_index(self, zoom):
+        for index, (_, max_zoom) in enumerate(self.bands):
+            if zoom <= max_zoom:
+                return index
+        return len(self.bands) - 1
+
+    def fit_zoom(self, pixels=ROUTE_OVERVIEW_PIXELS):
+        """Deepest zoom at which the whole route fits in ``pixels`` across."""
+        south, west, north, east = self.bbox
+        scale = math.cos(math.radians((south + north) / 2))
+        span = max(east - west, (north - south) / scale, 1e-9)
+        return max(0, min(self.bands[-1][1], int(math.log2(pixels / 256 * 360.0 / span))))
+
+    def _level_buckets(self, index):
+        with self._lock:
+            buckets = self._buckets[index]
+            if buckets is None:
+                points = self.levels[index]
+                cell = 360.0 / 2 ** self.bands[index][0]
+                buckets = {}
+                # Segment i joins points i and i + 1 and goes in every cell its bounding box touches
+                for i in range(len(points) // 2 - 1):
+                    lat1, lng1, lat2, lng2 = points[2 * i:2 * i + 4]
+                    for x in range(math.floor(min(lng1, lng2) / cell), math.floor(max(lng1, lng2) / cell) + 1):
+                        for y in range(math.floor(min(lat1, lat2) / cell), math.floor(max(lat1, lat2) / cell) + 1):
+                            buckets.setdefault((x, y), []).append(i)
+                self._buckets[index] = buckets
+        return buckets
+
+    def query(self, south, west, north, east, zoom):
+        """The parts of the route inside a bounding box at a zoom level.
+
+        Returns the level index and a list of flat lat, lng arrays, one per
+        run of consecutive segments that touch the box.
+        """
+        index = self.level_index(zoom)
+        points = self.levels[index]
+        buckets = self._level_buckets(index)
+        cell = 360.0 / 2 ** self.bands[index][0]
+        xs = range(math.floor(west / cell), math.floor(east / cell) + 1)
+        ys = range(math.floor(south / cell), math.floor(north / cell) + 1)
+        if len(xs) * len(ys) > len(buckets):
+            candidates = {i for bucket in buckets.values() for i in bucket}
+        else:
+            candidates = {i for x in xs for y in ys for i in buckets.get((x, y), ())}
+
+        runs = []
+        for i in sorted(candidates):
+            lat1, lng1, lat2, lng2 = points[2 * i:2 * i + 4]
+            if max(lat1, lat2) < south or min(lat1, lat2) > north or max(lng1, lng2) < west or min(lng1, lng2) > east:
+                continue
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        return index, [points[2 * start:2 * end + 2] for start, end in runs]
+
+    def levels_info(self):
+        return [{'min_zoom': min_zoom, 'max_zoom': max_zoom, 'points': len(points) // 2}
+                for (min_zoom, max_zoom), points in zip(self.bands, self.levels)]
+
+class RouteStore:
+    """Full-detail routes under a content-derived route_id, for viewport queries.
+
+    Toll quotes store their route as parsed from the upstream response,
+    before simplification, so the deepest level has full detail. Routes are
+    kept as encoded polylines in a ResultCache, so with ``db_path`` set any
+    worker process can answer for any route_id. Pyramids are built from the
+    decoded polyline on first use, so every process derives the same levels,
+    and the most recently used ones are kept in memory.
+    """
+
+    def __init__(self, name, max_entries, ttl, db_path=None, max_pyramids=ROUTE_PYRAMID_CACHE_SIZE):
+        self.routes = ResultCache(name, max_entries=max_entries, ttl=ttl, db_path=db_path)
+        self.max_pyramids = max(1, max_pyramids)
+        self._pyramids = OrderedDict()
+        # id() of route lists already stored -> (route, route_id, recheck_at), so
+        # cached toll results are not re-encoded and hashed on every request
+        self._registered = OrderedDict()
+        # Leg route_ids -> (joined route_id, recheck_at), for leg-by-leg quotes
+        self._joined = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    @property
+    def enabled(self):
+        return self.routes.enabled
+
+    def store(self, coords):
+        """Store a route of [lat, lng] pairs or a flat lat, lng array('d'); returns its route_id.
+
+        Returns None when the store is disabled or the route is too short.
+        """
+        points = len(coords) // 2 if isinstance(coords, array) else len(coords)
+        if not self.enabled or points < 2:
+            return None
+        encoded = encode_polyline(quantise_route(coords))
+        route_id = hashlib.sha256(encoded.encode('ascii')).hexdigest()[:24]
+        self.routes.set(route_id, encoded)
+        return route_id
+
+    def register(self, coords):
+        """Like store, but remembers the route list, so a cached result is not re-encoded on every request."""
+        if not self.enabled or len(coords) < 2:
+            return None
+        now = time.time()
+        with self._lock:
+            known = self._registered.get(id(coords))
+            if known is not None and known[0] is coords and known[2] > now:
+                self._registered.move_to_end(id(coords))
+                return known[1]
+
+        route_id = self.store(coords)
+        with self._lock:
+            # Re-store the route after half its TTL, so a route_id handed out is good for at least that long
+            self._registered[id(coords)] = (coords, route_id, now + self.routes.ttl / 2)
+            self._registered.move_to_end(id(coords))
+            while len(self._registered) > self.max_pyramids:
+                self._registered.popitem(last=False)
+        return route_id
+
+    def join(self, route_ids):
+        """Store the routes of consecutive legs as one route and return its route_id.
+
+        Returns None when a leg has no stored route or it has expired.
+        """
+        if not self.enabled or not route_ids or None in route_ids:
+            return None
+        key = tuple(route_ids)
+        now = time.time()
+        with self._lock:
+            known = self._joined.get(key)
+            if known is not None and known[1] > now:
+                self._joined.move_to_end(key)
+                return known[0]
+
+        points = array('d')
+        for leg_route_id in route_ids:
+            encoded = self.routes.get(leg_route_id)
+            if encoded is None:
+                return None
+            leg = decode_polyline(encoded)
+            # Each leg starts where the previous one ended
+            if points and leg[:2] == points[-2:]:
+                leg = leg[2:]
+            points.extend(leg)
+        route_id = self.store(points)
+        with self._lock:
+            self._joined[key] = (route_id, now + self.routes.ttl / 2)
+            self._joined.move_to_end(key)
+            while len(self._joined) > self.max_pyramids:
+                self._joined.popitem(last=False)
+        return route_id
+
+    def pyramid(self, route_id):
+        """The RoutePyramid for a route_id, or None if the route is unknown or expired."""
+        with self._lock:
+            pyramid = self._pyramids.get(route_id)
+            if pyramid is not None:
+                self._pyramids.move_to_end(route_id)
+                return pyramid
+
+        encoded = self.routes.get(route_id)
+        if encoded is None:
+            return None
+        pyramid = RoutePyramid(decode_polyline(encoded))
+        with self._lock:
+            self._pyramids[route_id] = pyramid
+            while len(self._pyramids) > self.max_pyramids:
+                self._pyramids.popitem(last=False)
+            self.builds += 1
+        return pyramid
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pyramids': len(self._pyramids),
+                'max_pyramids': self.max_pyramids,
+                'pyramid_builds': self.builds
+            }
+
+ROUTE_STORE = RouteStore('routes', ROUTE_STORE_SIZE, ROUTE_STORE_TTL, TOLL_CACHE_DB)
+
+def route_overview(result, zoom=None):
+    """Return a copy of a toll result carrying the overview level of its route and a route_id.
+
+    The overview is the pyramid level for ``zoom``, by default the zoom at
+    which the whole route fits ROUTE_OVERVIEW_PIXELS across. Clients fetch
+    more detail from GET /route/<route_id> as they zoom in. The result is
+    returned unchanged when the route store is disabled.
+    """
+    route_id = result.get('route_id')
+    if route_id is None and result.get('legs'):
+        route_id = ROUTE_STORE.join([leg.get('route_id') for leg in result['legs']])
+    pyramid = ROUTE_STORE.pyramid(route_id) if route_id else None
+    if pyramid is None:
+        # Sample data, or a quote whose full-detail route has expired: store the route it serves
+        route = result.get('route_coordinates')
+        route_id = ROUTE_STORE.register(route) if route else None
+        pyramid = ROUTE_STORE.pyramid(route_id) if route_id else None
+    if pyramid is None:
+        return result
+
+    if zoom is None:
+        zoom = pyramid.fit_zoom()
+    level = pyramid.level_index(zoom)
+    points = pyramid.levels[level]
+    overview = dict(result)
+    overview['route_coordinates'] = [[points[i], points[i + 1]] for i in range(0, len(points), 2)]
+    overview.update(route_id=route_id, route_zoom=zoom, route_level=level, route_levels=pyramid.levels_info(),
+                    route_bbox=pyramid.bbox)
+    return overview
+
+def requested_route_detail(data):
+    """Read `route_detail` ('full' or 'overview') and the optional `route_zoom` from a request body."""
+    route_detail = str(data.get('route_detail') or 'full').lower()
+    if route_detail not in ('full', 'overview'):
+        raise TollApiError('route_detail must be one of: full, overview', 400)
+    route_zoom = data.get('route_zoom')
+    if route_zoom is not None:
+        try:
+            route_zoom = int(route_zoom)
+        except (TypeError, ValueError):
+            raise TollApiError('route_zoom must be an integer', 400)
+        if not 0 <= route_zoom <= ROUTE_ZOOM_BANDS[-1][1]:
+            raise TollApiError(f'route_zoom must be between 0 and {ROUTE_ZOOM_BANDS[-1][1]}', 400)
+    return route_detail, route_zoom
+
+class TollApiError(Exception):
+    """Raised when a toll lookup cannot produce a result.
+
+    ``payload`` is the JSON error body returned to the client and
+    ``status_code`` the HTTP status that goes with it.
+    """
+
+    def __init__(self, message, http_status=500, **extra):
+        super().__init__(message)
+        self.status_code = http_status
+        self.payload = {'error': message, **extra}
+
+
+
+class FuelApiError(TollApiError):
+    """Raised when a geocode or fuel price lookup cannot produce a result."""
+
+
+_sample_toll_result = None
+_sample_toll_bodies = {}
+
+def build_sample_toll_result():
+    """The toll result served when no Lepton API key is configured, built once per process.
+
+    Every caller gets the same dict, so treat it as read-only like cached results.
+    """
+    global _sample_toll_result
+    if _sample_toll_result is None:
+        _sample_toll_result = sample_toll_result()
+    return _sample_toll_result
+
+def sample_toll_body(route_format):
+    """The sample toll result serialised for compress_response, once per route format."""
+    key = (route_format, app.debug)
+    body = _sample_toll_bodies.get(key)
+    if body is None:
+        body = _sample_toll_bodies[key] = serialize_json(encode_route(build_sample_toll_result(), route_format))
+    return body
+
+def sample_toll_result():
+    """Convert SAMPLE_TOLL_DATA to the /get_toll_data response shape."""
+    return {
+        'toll_count': SAMPLE_TOLL_DATA['totalTollBooths'],
+        'total_toll_price': SAMPLE_TOLL_DATA['totalTollPrice'],
+        'toll_booths': [{
+            'name': booth['name'],
+            'price': float(booth['price']),
+            'address': booth['address'],
+            'coords': [float(booth['location']['coordinates'][1]), float(booth['location']['coordinates'][0])]
+        } for booth in SAMPLE_TOLL_DATA['booths']],
+        'route_distance_km': None,
+        'route_coordinates': [[float(coord[1]), float(coord[0])] for coord in SAMPLE_TOLL_DATA['route']['geometry']['coordinates']],
+        'waypoint_coords': [],
+        'origin_coords': [float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][0][1]), 
+                        float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][0][0])],
+        'destination_coords': [float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][-1][1]), 
+                             float(SAMPLE_TOLL_DATA['route']['geometry']['coordinates'][-1][0])]
+    }
+
+
+def prepare_toll_locations(origin, destination, waypoints):
+    """Normalise origin, destination and waypoints, raising TollApiError if invalid."""
+    # Process locations
+    processed_origin = process_location(origin)
+    processed_destination = process_location(destination)
+    processed_waypoints = process_waypoints(waypoints)
+    
+    if not processed_origin or not processed_destination:
+        raise TollApiError('Invalid origin or destination format', 400)
+    
+    logger.debug("=== PROCESSED LOCATIONS ===")
+    logger.debug(f"Processed Origin: {processed_origin}")
+    logger.debug(f"Processed Destination: {processed_destination}")
+    logger.debug(f"Processed Waypoints: {processed_waypoints}")
+    
+    return processed_origin, processed_destination, processed_waypoints
+
+class TollBooth:
+    """One booth from a Lepton toll response, without a per-booth dict.
+
+    Fields missing from the response are left unset, and ``get`` mirrors
+    dict.get so booth handling code works on records and plain dicts alike.
+    """
+    __slots__ = ('name', 'route_name', 'latitude', 'longitude', 'price',
+                 'dynamic_entry', 'dynamic_exit', 'distance_to_origin')
+    
+    def __init__(self, raw):
+        for field in self.__slots__:
+            if field in raw:
+                setattr(self, field, raw[field])
+    
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self.__slots__ else default
+    
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__ if hasattr(self, field)}
+    
+    def __repr__(self):
+        return f"TollBooth({self.to_dict()})"
+
+class TollResponseParser:
+    """Incremental parser for the Lepton toll response body.
+
+    Reads the body chunk by chunk, keeping only the unconsumed tail in memory.
+    ``route`` ([lng, lat] pairs) is read straight into a flat array('d') of
+    lat, lng values under ``route_points``; ``toll_booths`` become TollBooth
+    records; every other top-level key is captured as raw text and decoded
+    with json.loads. Malformed input raises ValueError.
+    """
+    STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+    SCALAR = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null')
+    STRUCTURE = re.compile(r'[{}\[\]"]')
+    ROUTE_END = re.compile(r'\][ \t\r\n]*\]')
+    WHITESPACE = re.compile(r'[ \t\r\n]*')
+    DELIMITER = re.compile(r'[ \t\r\n,:\]}]')
+    ROUTE_SEPARATORS = str.maketrans('[],', '   ')
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+    
+    def _more(self):
+        """Drop the consumed prefix and append the next chunk; False at end of body."""
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self._chunks:
+            self.bytes_read += len(chunk)
+            text = self._decoder.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self._decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+    
+    def _skip_whitespace(self):
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._more():
+                return
+    
+    def _peek(self):
+        self._skip_whitespace()
+        if self.pos >= len(self.buf):
+            raise ValueError('Unexpected end of toll response')
+        return self.buf[self.pos]
+    
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Malformed toll response: expected '{char}' but found '{self.buf[self.pos]}'")
+        self.pos += 1
+    
+    def _match(self, pattern):
+        """Consume a token matching pattern, reading on while it may continue past the buffer."""
+        self._skip_whitespace()
+        while True:
+            match = pattern.match(self.buf, self.pos)
+            # A closed string is complete; a number or literal only once a delimiter follows
+            if match and (pattern is self.STRING or self.DELIMITER.match(self.buf, match.end())):
+                break
+            if not self._more():
+                if match:
+                    break
+                raise ValueError('Malformed toll response: unexpected token')
+        self.pos = match.end()
+        return match.group()
+    
+    def _raw_value(self):
+        """Return the source text of the next JSON value."""
+        first = self._peek()
+        if first == '"':
+            return self._match(self.STRING)
+        if first not in '{[':
+            return self._match(self.SCALAR)
+        
+        depth = 0
+        scan = 0  # offset from self.pos, which _more() rebases to the buffer start
+        while True:
+            token = self.STRUCTURE.search(self.buf, self.pos + scan)
+            if token is None:
+                scan = len(self.buf) - self.pos
+                if not self._more():
+                    raise ValueError('Unexpected end of toll response')
+                continue
+            
+            char = token.group()
+            if char == '"':
+                string = self.STRING.match(self.buf, token.start())
+                if string is None:
+                    # The string runs past the buffer, rescan it once more has arrived
+                    scan = token.start() - self.pos
+                    if not self._more():
+                        raise ValueError('Unexpected end of toll response')
+                    continue
+                scan = string.end() - self.pos
+                continue
+            
+            depth += 1 if char in '{[' else -1
+            scan = token.end() - self.pos
+            if depth == 0:
+                end = self.pos + scan
+                text = self.buf[self.pos:end]
+                self.pos = end
+                return text
+    
+    def _read_route(self):
+        points = array('d')
+        self._expect('[')
+        while True:
+            if self._peek() == ']':
+                self.pos += 1
+                return points
+            # Take every complete element in the buffer, up to the end of the array if it is here
+            end = self.ROUTE_END.search(self.buf, self.pos)
+            stop = end.start() + 1 if end else self.buf.rfind(']', self.pos) + 1
+            if stop > self.pos:
+                self._add_route_section(points, self.buf[self.pos:stop])
+                self.pos = stop
+            elif not self._more():
+                raise ValueError('Unexpected end of toll response')
+    
+    def _add_route_section(self, points, text):
+        """Append a run of complete [lng, lat] elements to points as lat, lng."""
+        values = text.translate(self.ROUTE_SEPARATORS).split()
+        if len(values) != 2 * text.count('['):
+            # Not plain pairs (e.g. an altitude component), decode element by element
+            elements = json.loads('[' + text.strip().lstrip(',') + ']')
+            values = [value for element in elements for value in element[:2]]
+        section = array('d', map(float, values))
+        section[0::2], section[1::2] = section[1::2], section[0::2]
+        points.extend(section)
+    
+    def _read_booths(self):
+        booths = []
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return booths
+        
+        while True:
+            booths.append(TollBooth(json.loads(self._raw_value())))
+            if self._peek() != ',':
+                self._expect(']')
+                return booths
+            self.pos += 1
+    
+    def parse(self):
+        """Consume the whole body; returns the parsed response, or None if it is empty."""
+        self._skip_whitespace()
+        if self.pos >= len(self.buf):
+            return None
+        
+        result = {}
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return result
+        
+        while True:
+            key = json.loads(self._match(self.STRING))
+            self._expect(':')
+            if key == 'route' and self._peek() == '[':
+                result['route_points'] = self._read_route()
+            elif key == 'toll_booths' and self._peek() == '[':
+                result['toll_booths'] = self._read_booths()
+            else:
+                result[key] = json.loads(self._raw_value())
+            if self._peek() != ',':
+                self._expect('}')
+                break
+            self.pos += 1
+        
+        self._skip_whitespace()
+        if self.pos < len(self.buf):
+            raise ValueError('Malformed toll response: unexpected data after the response object')
+        return result
+
+def fetch_toll_response(origin, destination, waypoints, journey_type):
+    """Call the Lepton toll API for processed locations and return the parsed body.
+
+    Successful bodies are parsed as they stream in (see TollResponseParser),
+    so the route arrives as a flat ``route_points`` buffer.
+    """
+    return run_upstream(fetch_toll_response_steps(origin, destination, waypoints, journey_type))
+
+def fetch_toll_response_steps(origin, destination, waypoints, journey_type, encoded_polyline=None):
+    """Step generator behind fetch_toll_response (see UpstreamCall).
+
+    With ``encoded_polyline`` Lepton prices that exact route geometry.
+    """
+    flight_key = toll_cache_key(origin, destination, waypoints, journey_type)
+    if encoded_polyline:
+        flight_key.append(hashlib.sha256(encoded_polyline.encode('ascii')).hexdigest())
+    return (yield from TOLL_RESPONSE_FLIGHTS.run(
+        flight_key, request_toll_response_steps(origin, destination, waypoints, journey_type, encoded_polyline)))
+
+def request_toll_response_steps(origin, destination, waypoints, journey_type, encoded_polyline=None):
+    """Call the Lepton toll API and parse the streamed body."""
+    # Format locations for API
+    params = {
+        'origin': origin,
+        'destination': destination,
+        'journey_type': journey_type,
+        'include_route': True,
+        'include_route_metadata': True,
+        'include_booths': True,
+        'include_booths_locations': True
+    }
+    
+    if waypoints:
+        params['waypoints'] = '|'.join(waypoints)
+    if encoded_polyline:
+        params['encoded_polyline'] = encoded_polyline
+    
+    # Build API URL
+    api_url = f"{LEPTON_API_BASE}/v1/toll"
+    
+    logger.debug("=== API REQUEST DETAILS ===")
+    logger.debug(f"API URL: {api_url}")
+    logger.debug(f"Request Parameters: {params}")
+    
+    headers = {
+        'x-api-key': API_KEY,
+        'Content-Type': 'application/json'
+    }
+    
+    try:
+        # Make API request using GET method with query parameters
+        with timed_stage('toll.upstream'):
+            response = yield UpstreamCall(api_url, params=params, headers=headers, stream=True)
+    except CircuitOpenError as e:
+        logger.error(f"Request Error: {str(e)}")
+        raise TollApiError('Toll service temporarily unavailable, please retry shortly', 503)
+    except requests.exceptions.Timeout as e:
+        logger.error(f"Request Error: {str(e)}")
+        raise TollApiError('Toll API request timed out', 504)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request Error: {str(e)}")
+        raise TollApiError(f'API request failed: {str(e)}', 500)
+        
+    logger.debug("=== API RESPONSE DETAILS ===")
+    logger.debug(f"Response Status Code: {response.status_code}")
+    logger.debug(f"Response Headers: {dict(response.headers)}")
+    
+    # Handle non-200 responses first
+    if response.status_code != 200:
+        raw_response = response.text
+        METRICS.observe_histogram('ft_toll_upstream_payload_bytes', len(response.content))
+        note_request(upstream_status=response.status_code, upstream_bytes=len(response.content))
+        log_payload("Raw API response", raw_response)
+        error_message = raw_response.strip()
+        content_type = response.headers.get('content-type', '')
+        
+        # Try to extract error message from JSON if possible
+        if 'application/json' in content_type:
+            try:
+                error_data = response.json()
+                error_message = error_data.get('message', error_data.get('error', error_message))
+            except json.JSONDecodeError:
+                pass
+        
+        # If error message is empty, provide a default
+        if not error_message:
+            error_message = f"API request failed with status code {response.status_code}"
+        
+        logger.error(f"API Error: {error_message}")
+        raise TollApiError(error_message, response.status_code, status_code=response.status_code)
+    
+    # Parse JSON response for successful requests as it streams in
+    chunks = response.iter_content(chunk_size=TOLL_STREAM_CHUNK_SIZE)
+    raw_chunks = [] if payload_logging_enabled() else None
+    if raw_chunks is not None:
+        chunks = (raw_chunks.append(chunk) or chunk for chunk in chunks)
+    parser = TollResponseParser(chunks)
+    try:
+        with timed_stage('toll.parse'):
+            response_data = parser.parse()
+    except (ValueError, TypeError) as e:
+        logger.error(f"JSON Decode Error: {str(e)}")
+        logger.error(f"Unparsed response text: {truncate_for_log(parser.buf[parser.pos:])}")
+        logger.error(f"Response status code: {response.status_code}")
+        raise TollApiError('Failed to parse API response', 500,
+                           details=str(e), status_code=response.status_code)
+    except requests.exceptions.Timeout as e:
+        logger.error(f"Request Error: {str(e)}")
+        raise TollApiError('Toll API request timed out', 504)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request Error: {str(e)}")
+        raise TollApiError(f'API request failed: {str(e)}', 500)
+    finally:
+        response.close()
+    
+    METRICS.observe_histogram('ft_toll_upstream_payload_bytes', parser.bytes_read)
+    note_request(upstream_status=response.status_code, upstream_bytes=parser.bytes_read)
+    if raw_chunks is not None:
+        log_payload("Raw API response", lambda: b''.join(raw_chunks).decode('utf-8', 'replace'))
+    
+    # Handle empty response
+    if response_data is None:
+        logger.error("Empty response from API")
+        raise TollApiError('Empty response received from API', 500)
+    
+    log_payload("Parsed API response", response_data)
+    return response_data
+
+def transform_toll_booths(response_data):
+    """Return (transformed_booths, total_toll) from a parsed Lepton toll response."""
+    toll_booths = []
+    transformed_booths = []
+    total_toll = 0
+    
+    if 'toll_booths' in response_data:
+        toll_booths = response_data['toll_booths']
+        log_payload("Raw toll booth data", toll_booths)
+        # Journey order, which composed quotes rely on; Lepton normally sends booths this way
+        if all(isinstance(booth.get('distance_to_origin'), (int, float)) for booth in toll_booths):
+            toll_booths = sorted(toll_booths, key=lambda booth: booth.get('distance_to_origin'))
+        
+        # Transform toll booth data
+        for booth in toll_booths:
+            try:
+                # Extract direct latitude/longitude fields
+                lat = booth.get('latitude')
+                lng = booth.get('longitude')
+                
+                if lat is not None and lng is not None:
+                    transformed_booth = {
+                        'name': booth.get('name', 'Unknown Toll Booth'),
+                        'price': float(booth.get('price', 0)),
+                        'address': booth.get('route_name', ''),  # Use route_name as address
+                        'coords': [float(lat), float(lng)]  # [latitude, longitude] format
+                    }
+                    transformed_booths.append(transformed_booth)
+                else:
+                    logger.warning(f"Missing latitude/longitude in booth: {booth}")
+                    
+            except Exception as e:
+                logger.error(f"Error processing booth {booth}: {str(e)}")
+                continue
+        
+        # Calculate total toll
+        total_toll = sum(float(booth.get('price', 0)) for booth in toll_booths)
+        logger.debug(f"Total toll calculated: {total_toll}")
+        logger.debug(f"Transformed {len(transformed_booths)} out of {len(toll_booths)} toll booths")
+    
+    return transformed_booths, total_toll
+
+def extract_route_coordinates(response_data, transformed_booths):
+    """Return the route from a parsed Lepton toll response.
+
+    Streamed responses give a flat lat, lng array('d'); the other sources
+    give [lat, lng] pairs. simplify_coordinates accepts either.
+    """
+    route_coordinates = []
+    if 'route_points' in response_data:
+        route_coordinates = response_data['route_points']
+        logger.debug(f"Extracted {len(route_coordinates) // 2} route coordinates from the Lepton route stream")
+    elif 'route' in response_data and isinstance(response_data['route'], list):
+        # Lepton returns coordinates as [longitude, latitude] pairs
+        # Convert to [latitude, longitude] for our frontend
+        route_coordinates = [[float(coord[1]), float(coord[0])] for coord in response_data['route']]
+        logger.debug(f"Extracted {len(route_coordinates)} route coordinates from Lepton route array")
+    elif 'routes' in response_data and response_data['routes']:
+        # Fallback to Google Maps format if present
+        route = response_data['routes'][0]
+        logger.debug("=== ROUTE DATA ===")
+        logger.debug(f"Route data available: {bool(route)}")
+        
+        try:
+            import polyline
+            if 'overview_polyline' in route and 'points' in route['overview_polyline']:
+                points = polyline.decode(route['overview_polyline']['points'])
+                route_coordinates = points
+                logger.debug(f"Extracted {len(route_coordinates)} route coordinates from overview_polyline")
+            else:
+                if 'legs' in route:
+                    for leg in route['legs']:
+                        if 'steps' in leg:
+                            for step in leg['steps']:
+                                if 'polyline' in step and 'points' in step['polyline']:
+                                    points = polyline.decode(step['polyline']['points'])
+                                    route_coordinates.extend(points)
+                    logger.debug(f"Extracted {len(route_coordinates)} route coordinates from step polylines")
+        except Exception as e:
+            logger.error(f"Error processing route data: {str(e)}")
+    else:
+        logger.warning("No route data found in response")
+    
+    # If we have toll booth coordinates but no route, create a simple route through the toll booths
+    if not route_coordinates and transformed_booths:
+        logger.debug("Creating route through toll booths")
+        route_coordinates = [booth['coords'] for booth in transformed_booths]
+        logger.debug(f"Created route with {len(route_coordinates)} points through toll booths")
+    
+    return route_coordinates
+
+def route_distance_km(response_data):
+    """Road distance of a Lepton route in km, summed over the legs in route_metadata (None if absent)."""
+    legs = (response_data.get('route_metadata') or {}).get('legs')
+    try:
+        return round(sum(leg['distance']['value'] for leg in legs) / 1000, 3) if legs else None
+    except (KeyError, TypeError):
+        return None
+
+def build_toll_result(transformed_booths, total_toll, simplified_route_coordinates, distance_km=None,
+                      route_id=None):
+    """Assemble the /get_toll_data response body.
+
+    ``route_id`` names the full-detail route in ROUTE_STORE, when it was stored.
+    """
+    result = {
+        'toll_count': len(transformed_booths),
+        'total_toll_price': total_toll,
+        'toll_booths': transformed_booths,
+        'route_distance_km': distance_km,
+        'route_coordinates': simplified_route_coordinates,
+        'waypoint_coords': [],  # We'll handle waypoints later if needed
+        'origin_coords': simplified_route_coordinates[0] if simplified_route_coordinates else None,
+        'destination_coords': simplified_route_coordinates[-1] if simplified_route_coordinates else None
+    }
+    if route_id:
+        result['route_id'] = route_id
+    return result
+
+def flat_route_points(response_data):
+    """The route of a parsed Lepton toll response as a flat lat, lng array('d'), or None."""
+    if 'route_points' in response_data:
+        return response_data['route_points']
+    if isinstance(response_data.get('route'), list):
+        # Lepton returns coordinates as [longitude, latitude] pairs
+        return array('d', (float(value) for coord in response_data['route'] for value in (coord[1], coord[0])))
+    return None
+
+def point_segment_distance_m(lat, lng, lat1, lng1, lat2, lng2):
+    """Metres from a point to a segment, and how far along the segment (0-1) the closest point is.
+
+    Uses a local equirectangular projection, which is accurate to well under
+    a metre at corridor distances.
+    """
+    kx = 111320.0 * math.cos(math.radians(lat))
+    ky = 110540.0
+    ax, ay = (lng1 - lng) * kx, (lat1 - lat) * ky
+    dx, dy = (lng2 - lng1) * kx, (lat2 - lat1) * ky
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length))
+    return math.hypot(ax + t * dx, ay + t * dy), t
+
+class RouteProfile:
+    """Segments of a flat lat, lng route, for corridor searches and coverage.
+
+    Segment ``i`` runs from point ``i`` to point ``i + 1``. ``cell_km`` holds
+    the kilometres of route in each grid cell. With numpy, searches are
+    vectorised over all segments; without it segments are bucketed by cell.
+    """
+
+    def __init__(self, points, cell_deg):
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        self.np = np
+        self.points = points
+        self.cell_deg = cell_deg
+        self.cell_km = {}
+        count = len(points) // 2
+        
+        if np is not None:
+            coords = np.frombuffer(points, dtype=float, count=count * 2).reshape(count, 2)
+            self.start, self.end = coords[:-1], coords[1:]
+            delta = self.end - self.start
+            self.km = np.hypot(delta[:, 0] * 110.54,
+                               delta[:, 1] * 111.32 * np.cos(np.radians((self.start[:, 0] + self.end[:, 0]) / 2)))
+            self.start_km = np.cumsum(self.km) - self.km
+            self.low = np.minimum(self.start, self.end)
+            self.high = np.maximum(self.start, self.end)
+            
+            # Segments within half a cell are credited to the cell of their midpoint
+            pieces = np.maximum(1, np.ceil(np.abs(delta).max(axis=1, initial=0) / (cell_deg / 2))).astype(np.int64)
+            short = pieces == 1
+            cells = np.floor((self.start[short] + self.end[short]) / 2 / cell_deg).astype(np.int64)
+            if len(cells):
+                # One int64 per cell (lat index in the high half) keeps np.unique one-dimensional
+                keys, inverse = np.unique((cells[:, 0] << 32) + (cells[:, 1] & 0xffffffff), return_inverse=True)
+                weights = np.bincount(inverse, weights=self.km[short], minlength=len(keys))
+                self.cell_km = {
+                    (key >> 32, (key & 0xffffffff) - (1 << 32) if key & 0x80000000 else key & 0xffffffff): float(km)
+                    for key, km in zip(keys.tolist(), weights.tolist())
+                }
+            for i in np.flatnonzero(~short).tolist():
+                self._add_pieces(i, float(self.km[i]), int(pieces[i]))
+            return
+        
+        self.km = []
+        self.start_km = []
+        self.buckets = {}
+        travelled = 0.0
+        for i in range(count - 1):
+            lat1, lng1, lat2, lng2 = points[2 * i:2 * i + 4]
+            km = math.hypot((lat2 - lat1) * 110.54, (lng2 - lng1) * 111.32 * math.cos(math.radians((lat1 + lat2) / 2)))
+            self.km.append(km)
+            self.start_km.append(travelled)
+            travelled += km
+            for cell in self._box_cells(min(lat1, lat2), min(lng1, lng2), max(lat1, lat2), max(lng1, lng2)):
+                self.buckets.setdefault(cell, []).append(i)
+            self._add_pieces(i, km, max(1, math.ceil(max(abs(lat2 - lat1), abs(lng2 - lng1)) / (self.cell_deg / 2))))
+
+    def cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def _box_cells(self, lat1, lng1, lat2, lng2):
+        (low_lat, low_lng), (high_lat, high_lng) = self.cell(lat1, lng1), self.cell(lat2, lng2)
+        for cell_lat in range(low_lat, high_lat + 1):
+            for cell_lng in range(low_lng, high_lng + 1):
+                yield cell_lat, cell_lng
+
+    def _add_pieces(self, i, km, pieces):
+        """Credit segment ``i`` to the cells of its midpoint, split into ``pieces`` equal parts."""
+        lat1, lng1, lat2, lng2 = self.points[2 * i:2 * i + 4]
+        for k in range(pieces):
+            t = (k + 0.5) / pieces
+            cell = self.cell(lat1 + (lat2 - lat1) * t, lng1 + (lng2 - lng1) * t)
+            self.cell_km[cell] = self.cell_km.get(cell, 0.0) + km / pieces
+
+    def nearest(self, lat, lng, corridor_m):
+        """(metres off the route, km along it) of the closest route point within ``corridor_m``, or None."""
+        dlat = corridor_m / 110540.0
+        dlng = corridor_m / (111320.0 * math.cos(math.radians(lat)))
+        np = self.np
+        
+        if np is not None:
+            hits = np.flatnonzero((self.low[:, 0] <= lat + dlat) & (self.high[:, 0] >= lat - dlat) &
+                                  (self.low[:, 1] <= lng + dlng) & (self.high[:, 1] >= lng - dlng))
+            if not len(hits):
+                return None
+            kx = 111320.0 * math.cos(math.radians(lat))
+            start = self.start[hits]
+            delta = self.end[hits] - start
+            ax, ay = (start[:, 1] - lng) * kx, (start[:, 0] - lat) * 110540.0
+            dx, dy = delta[:, 1] * kx, delta[:, 0] * 110540.0
+            length = dx * dx + dy * dy
+            t = np.clip(-(ax * dx + ay * dy) / np.where(length > 0, length, 1.0), 0.0, 1.0)
+            distance = np.hypot(ax + t * dx, ay + t * dy)
+            best = int(np.argmin(distance))
+            if distance[best] > corridor_m:
+                return None
+            i = hits[best]
+            return float(distance[best]), float(self.start_km[i] + t[best] * self.km[i])
+        
+        best = None
+        segments = {i for cell in self._box_cells(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+                    for i in self.buckets.get(cell, ())}
+        for i in segments:
+            distance, t = point_segment_distance_m(lat, lng, *self.points[2 * i:2 * i + 4])
+            if distance <= corridor_m and (best is None or distance < best[0]):
+                best = (distance, self.start_km[i] + t * self.km[i])
+        return best
+
+class TollPlazaCatalogue:
+    """Toll plazas and per-vehicle prices learned from live Lepton responses.
+
+    Every live toll response adds its booths (merged by name and position)
+    and marks the grid cells its route crosses as surveyed for that journey
+    type. ``estimate`` prices a route geometry from the plazas within a
+    corridor of the line, or reports why it cannot: the route leaves
+    surveyed cells, the data is older than ``max_age``, or it exits a
+    closed-system expressway through an entry/exit pair never quoted live.
+    Plazas are held in an in-memory grid index; with ``db_path`` set they
+    are also written to SQLite and reloaded on start, so the catalogue
+    survives restarts.
+    """
+
+    def __init__(self, db_path=None, cell_deg=0.05, max_age=7 * 24 * 60 * 60, min_coverage=0.95):
+        self.db_path = db_path
+        self.cell_deg = cell_deg
+        self.max_age = max_age
+        self.min_coverage = min_coverage
+        self._plazas = {}
+        self._grid = {}
+        self._coverage = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.ingested = 0
+        self.estimates = 0
+        self.fallbacks = {}
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS toll_plazas ('
+                'id TEXT PRIMARY KEY, name TEXT NOT NULL, route_name TEXT NOT NULL, '
+                'latitude REAL NOT NULL, longitude REAL NOT NULL, dynamic_entry INTEGER NOT NULL, '
+                'dynamic_exit INTEGER NOT NULL, updated_at REAL NOT NULL)'
+            )
+            # entry_plaza_id is set for exits of closed-system roads, priced per entry
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS toll_plaza_prices ('
+                'plaza_id TEXT NOT NULL, journey_type TEXT NOT NULL, entry_plaza_id TEXT NOT NULL, '
+                'price REAL NOT NULL, updated_at REAL NOT NULL, '
+                'PRIMARY KEY (plaza_id, journey_type, entry_plaza_id))'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS toll_coverage ('
+                'journey_type TEXT NOT NULL, cell_deg REAL NOT NULL, cell_lat INTEGER NOT NULL, '
+                'cell_lng INTEGER NOT NULL, surveyed_at REAL NOT NULL, '
+                'PRIMARY KEY (journey_type, cell_deg, cell_lat, cell_lng))'
+            )
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _load(self):
+        """Read the SQLite catalogue into memory once."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if self.db_path:
+                try:
+                    conn = self._db()
+                    for plaza_id, name, route_name, lat, lng, dynamic_entry, dynamic_exit in conn.execute(
+                            'SELECT id, name, route_name, latitude, longitude, dynamic_entry, dynamic_exit '
+                            'FROM toll_plazas'):
+                        self._add_plaza({'id': plaza_id, 'name': name, 'route_name': route_name,
+                                         'latitude': lat, 'longitude': lng, 'dynamic_entry': bool(dynamic_entry),
+                                         'dynamic_exit': bool(dynamic_exit), 'prices': {}})
+                    for plaza_id, journey_type, entry_plaza_id, price, updated_at in conn.execute(
+                            'SELECT plaza_id, journey_type, entry_plaza_id, price, updated_at FROM toll_plaza_prices'):
+                        if plaza_id in self._plazas:
+                            self._plazas[plaza_id]['prices'][(journey_type, entry_plaza_id)] = (price, updated_at)
+                    for journey_type, cell_lat, cell_lng, surveyed_at in conn.execute(
+                            'SELECT journey_type, cell_lat, cell_lng, surveyed_at FROM toll_coverage '
+                            'WHERE cell_deg = ?', (self.cell_deg,)):
+                        self._coverage.setdefault(journey_type, {})[(cell_lat, cell_lng)] = surveyed_at
+                except sqlite3.Error as e:
+                    logger.error(f"Toll catalogue read failed: {str(e)}")
+                logger.info(f"Loaded {len(self._plazas)} toll plazas from the catalogue")
+            self._loaded = True
+
+    def cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    @staticmethod
+    def _around(cell, ring):
+        for dlat in range(-ring, ring + 1):
+            for dlng in range(-ring, ring + 1):
+                yield cell[0] + dlat, cell[1] + dlng
+
+    def _add_plaza(self, plaza):
+        """Index a plaza; caller holds the lock."""
+        self._plazas[plaza['id']] = plaza
+        self._grid.setdefault(self.cell(plaza['latitude'], plaza['longitude']), []).append(plaza['id'])
+
+    def _find_plaza(self, name, lat, lng):
+        """An indexed plaza with the same name within TOLL_PLAZA_MERGE_M; caller holds the lock."""
+        key = normalise_cache_part(name)
+        for cell in self._around(self.cell(lat, lng), 1):
+            for plaza_id in self._grid.get(cell, ()):
+                plaza = self._plazas[plaza_id]
+                if (normalise_cache_part(plaza['name']) == key and
+                        haversine_km(lat, lng, plaza['latitude'], plaza['longitude']) * 1000 <= TOLL_PLAZA_MERGE_M):
+                    return plaza
+        return None
+
+    def ingest(self, response_data, journey_type):
+        """Add the booths, prices and surveyed route cells of a live toll response."""
+        journey_type = normalise_cache_part(journey_type)
+        if not journey_type:
+            return
+        points = flat_route_points(response_data)
+        cells = RouteProfile(points, self.cell_deg).cell_km if points else {}
+        booths = sorted(response_data.get('toll_booths') or [],
+                        key=lambda booth: booth.get('distance_to_origin') or 0)
+        self._load()
+        now = time.time()
+        plaza_rows = []
+        price_rows = []
+        with self._lock:
+            entry_plaza_id = ''
+            for booth in booths:
+                try:
+                    lat, lng = float(booth.get('latitude')), float(booth.get('longitude'))
+                    price = float(booth.get('price', 0))
+                except (TypeError, ValueError):
+                    continue
+                name = str(booth.get('name') or 'Unknown Toll Booth')
+                plaza = self._find_plaza(name, lat, lng)
+                if plaza is None:
+                    plaza = {'id': f"{normalise_cache_part(name)}@{lat:.5f},{lng:.5f}", 'name': name,
+                             'route_name': '', 'latitude': lat, 'longitude': lng,
+                             'dynamic_entry': False, 'dynamic_exit': False, 'prices': {}}
+                    self._add_plaza(plaza)
+                plaza['route_name'] = str(booth.get('route_name') or plaza['route_name'])
+                plaza['dynamic_entry'] = plaza['dynamic_entry'] or bool(booth.get('dynamic_entry'))
+                plaza['dynamic_exit'] = plaza['dynamic_exit'] or bool(booth.get('dynamic_exit'))
+
+                # An exit of a closed-system road charges for the stretch since its entry
+                price_key = (journey_type, entry_plaza_id if booth.get('dynamic_exit') else '')
+                plaza['prices'][price_key] = (price, now)
+                if booth.get('dynamic_exit'):
+                    entry_plaza_id = ''
+                if booth.get('dynamic_entry'):
+                    entry_plaza_id = plaza['id']
+
+                plaza_rows.append((plaza['id'], plaza['name'], plaza['route_name'], plaza['latitude'],
+                                   plaza['longitude'], int(plaza['dynamic_entry']), int(plaza['dynamic_exit']), now))
+                price_rows.append((plaza['id'], *price_key, price, now))
+
+            surveyed = self._coverage.setdefault(journey_type, {})
+            for cell in cells:
+                surveyed[cell] = now
+            self.ingested += 1
+
+        if self.db_path:
+            try:
+                conn = self._db()
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO toll_plazas (id, name, route_name, latitude, longitude, '
+                        'dynamic_entry, dynamic_exit, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', plaza_rows)
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO toll_plaza_prices '
+                        '(plaza_id, journey_type, entry_plaza_id, price, updated_at) VALUES (?, ?, ?, ?, ?)',
+                        price_rows)
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO toll_coverage '
+                        '(journey_type, cell_deg, cell_lat, cell_lng, surveyed_at) VALUES (?, ?, ?, ?, ?)',
+                        ((journey_type, self.cell_deg, cell[0], cell[1], now) for cell in cells))
+            except sqlite3.Error as e:
+                logger.error(f"Toll catalogue write failed: {str(e)}")
+
+    def estimate(self, points, journey_type, corridor_m=TOLL_CATALOGUE_CORRIDOR_M):
+        """Price a flat lat, lng route from the catalogue.
+
+        Returns (result, None), or ({'coverage': ...}, reason) when the
+        catalogue cannot answer, with reason one of 'no_coverage', 'stale'
+        or 'dynamic_pricing'. Coverage is the share of the route's length
+        in grid cells surveyed within ``max_age``.
+        """
+        journey_type = normalise_cache_part(journey_type)
+        profile = RouteProfile(points, self.cell_deg)
+        total_km = sum(profile.cell_km.values())
+        self._load()
+        fresh_after = time.time() - self.max_age
+        # Cells to search around each route cell so the whole corridor is covered
+        ring = 1 + int(corridor_m / (self.cell_deg * 90000))
+
+        with self._lock:
+            self.estimates += 1
+            surveyed = self._coverage.get(journey_type, {})
+            seen_km = sum(km for cell, km in profile.cell_km.items() if cell in surveyed)
+            fresh_km = sum(km for cell, km in profile.cell_km.items() if surveyed.get(cell, 0) > fresh_after)
+            coverage = fresh_km / total_km if total_km else 0.0
+
+            reason = None
+            if not total_km or seen_km / total_km < self.min_coverage:
+                reason = 'no_coverage'
+            elif coverage < self.min_coverage:
+                reason = 'stale'
+
+            matches = []
+            if reason is None:
+                candidates = {plaza_id for cell in profile.cell_km for nearby in self._around(cell, ring)
+                              for plaza_id in self._grid.get(nearby, ())}
+                for plaza_id in candidates:
+                    plaza = self._plazas[plaza_id]
+                    nearest = profile.nearest(plaza['latitude'], plaza['longitude'], corridor_m)
+                    if nearest is not None:
+                        matches.append((nearest[1], plaza))
+                matches.sort(key=lambda match: match[0])
+
+            booths = []
+            oldest = None
+            entry_plaza_id = ''
+            for distance_km, plaza in matches:
+                if plaza['dynamic_exit']:
+                    price = plaza['prices'].get((journey_type, entry_plaza_id))
+                    entry_plaza_id = ''
+                else:
+                    price = plaza['prices'].get((journey_type, ''))
+                if plaza['dynamic_entry']:
+                    entry_plaza_id = plaza['id']
+
+                if price is None:
+                    reason = 'dynamic_pricing' if plaza['dynamic_exit'] else 'no_coverage'
+                elif price[1] <= fresh_after:
+                    reason = 'stale'
+                if reason is not None:
+                    break
+                oldest = price[1] if oldest is None else min(oldest, price[1])
+                booths.append({
+                    'name': plaza['name'],
+                    'price': price[0],
+                    'address': plaza['route_name'],
+                    'coords': [plaza['latitude'], plaza['longitude']],
+                    'distance_to_origin': round(distance_km, 3)
+                })
+
+            if reason is not None:
+                self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+                return {'coverage': round(coverage, 4)}, reason
+
+        return {
+            'toll_count': len(booths),
+            'total_toll_price': sum(booth['price'] for booth in booths),
+            'toll_booths': booths,
+            'coverage': round(coverage, 4),
+            'prices_as_of': datetime.fromtimestamp(oldest).isoformat(timespec='seconds') if oldest else None
+        }, None
+
+    def stats(self):
+        self._load()
+        with self._lock:
+            return {
+                'backend': 'sqlite' if self.db_path else 'memory',
+                'plazas': len(self._plazas),
+                'surveyed_cells': {journey_type: len(cells) for journey_type, cells in self._coverage.items()},
+                'ingested_responses': self.ingested,
+                'estimates': self.estimates,
+                'fallbacks': dict(self.fallbacks)
+            }
+
+TOLL_PLAZAS = TollPlazaCatalogue(TOLL_CATALOGUE_DB or None, TOLL_CATALOGUE_CELL_DEG,
+                                 TOLL_CATALOGUE_MAX_AGE, TOLL_CATALOGUE_MIN_COVERAGE)
+
+def compute_toll_data(origin, destination, waypoints, journey_type, split_legs=None):
+    """Look up tolls for a journey and return the result served by /get_toll_data.
+
+    Raises TollApiError when the locations are invalid or the upstream
+    request fails, so callers outside a request (bulk workers) can use it too.
+    ``split_legs`` quotes a waypoint journey leg by leg (see
+    composed_toll_quote_steps); None follows TOLL_SPLIT_LEGS.
+    """
+    return run_upstream(compute_toll_data_steps(origin, destination, waypoints, journey_type, split_legs))
+
+def compute_toll_data_steps(origin, destination, waypoints, journey_type, split_legs=None, locations=None):
+    """Step generator behind compute_toll_data (see UpstreamCall).
+
+    ``locations`` is the (origin, destination, waypoints) tuple from
+    prepare_toll_locations, for callers that have already processed them.
+    """
+    processed_origin, processed_destination, processed_waypoints = locations or prepare_toll_locations(
+        origin, destination, waypoints)
+
+    # If no API key, use sample data
+    if not API_KEY:
+        logger.warning("No API key found, using sample data")
+        return build_sample_toll_result()
+    
+    cache_key = toll_cache_key(processed_origin, processed_destination, processed_waypoints, journey_type)
+    cached_result = TOLL_CACHE.get(cache_key)
+    if cached_result is not None:
+        logger.debug("=== TOLL CACHE HIT ===")
+        note_request(toll_cache='hit', toll_count=cached_result['toll_count'],
+                     route_points_simplified=len(cached_result['route_coordinates']))
+        return cached_result
+    
+    # 2. Log location formatting
+    logger.debug("=== ORIGINAL LOCATIONS ===")
+    logger.debug(f"Original Origin: {origin}")
+    logger.debug(f"Original Destination: {destination}")
+    logger.debug(f"Original Waypoints: {waypoints}")
+    note_request(toll_cache='miss' if TOLL_CACHE.enabled else 'disabled')
+    
+    if processed_waypoints and (TOLL_SPLIT_LEGS if split_legs is None else split_legs):
+        legs = journey_legs([processed_origin, *processed_waypoints, processed_destination])
+        # A journey that never leaves its starting point has no legs; quote it whole, as unsplit
+        if legs:
+            return (yield from composed_toll_quote_steps(legs, journey_type))
+    
+    return (yield from TOLL_FLIGHTS.run(cache_key, toll_quote_steps(
+        processed_origin, processed_destination, processed_waypoints, journey_type, cache_key)))
+
+def toll_quote_steps(processed_origin, processed_destination, processed_waypoints, journey_type, cache_key):
+    """Fetch, process and cache a toll quote for processed locations."""
+    response_data = yield from fetch_toll_response_steps(processed_origin, processed_destination,
+                                                          processed_waypoints, journey_type)
+    
+    try:
+        with timed_stage('toll.booths'):
+            transformed_booths, total_toll = transform_toll_booths(response_data)
+        with timed_stage('toll.route'):
+            route_coordinates = extract_route_coordinates(response_data, transformed_booths)
+            # Stored before simplifying, so /route/<route_id> can serve every parsed point
+            route_id = ROUTE_STORE.store(route_coordinates)
+        
+        # Simplify route coordinates
+        with timed_stage('toll.simplify'):
+            simplified_route_coordinates = simplify_coordinates(route_coordinates)
+        route_points = len(route_coordinates) // 2 if isinstance(route_coordinates, array) else len(route_coordinates)
+        METRICS.observe_histogram('ft_toll_route_points', route_points)
+        METRICS.observe_histogram('ft_toll_route_points_simplified', len(simplified_route_coordinates))
+        note_request(toll_count=len(transformed_booths), route_points=route_points,
+                     route_points_simplified=len(simplified_route_coordinates))
+        
+        # Prepare final response
+        result = build_toll_result(transformed_booths, total_toll, simplified_route_coordinates,
+                                   route_distance_km(response_data), route_id)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Data Processing Error: {str(e)}")
+        raise TollApiError(f'Failed to process API response: {str(e)}', 500)
+    
+    log_payload("Final response", result)
+    
+    TOLL_CACHE.set(cache_key, result)
+    with timed_stage('toll.catalogue'):
+        TOLL_PLAZAS.ingest(response_data, journey_type)
+    return result
+
+def leg_toll_quote_steps(origin, destination, journey_type):
+    """Toll quote for one leg, cached and coalesced exactly like a direct origin-destination quote."""
+    cache_key = toll_cache_key(origin, destination, [], journey_type)
+    cached_result = TOLL_CACHE.get(cache_key)
+    if cached_result is not None:
+        return cached_result, True
+    result = yield from TOLL_FLIGHTS.run(cache_key, toll_quote_steps(origin, destination, [], journey_type, cache_key))
+    return result, False
+
+def journey_legs(stops):
+    """Consecutive (origin, destination) legs through processed ``stops``, without empty legs at repeats."""
+    stops = [stop for i, stop in enumerate(stops)
+             if i == 0 or normalise_cache_part(stop) != normalise_cache_part(stops[i - 1])]
+    return list(zip(stops, stops[1:]))
+
+def composed_toll_quote_steps(legs, journey_type):
+    """Quote a journey as consecutive ``legs`` (see journey_legs).
+
+    A leg is stored under the same key as a direct quote between its two
+    stops, so legs are shared between journeys and with plain
+    origin-destination lookups. Adding, removing or moving one waypoint only
+    fetches the legs next to it; the missing legs are fetched concurrently.
+    The legs are stitched into the usual result shape: booths in journey
+    order (each leg's booths by distance_to_origin), totals summed, routes
+    joined, and the stops between legs as ``waypoint_coords``.
+
+    The stitched quote is not cached itself; rebuilding it from the cached
+    legs is only list concatenation. Any leg failing fails the quote, with the
+    leg number in the error.
+    """
+    quotes = yield Concurrently((leg_toll_quote_steps(leg_origin, leg_destination, journey_type)
+                                 for leg_origin, leg_destination in legs), TOLL_LEG_MAX_WORKERS)
+    for leg, quote in enumerate(quotes):
+        if isinstance(quote, TollApiError):
+            details = {key: value for key, value in quote.payload.items() if key != 'error'}
+            raise TollApiError(quote.payload['error'], quote.status_code, **details,
+                               leg=leg, leg_origin=legs[leg][0], leg_destination=legs[leg][1])
+        if isinstance(quote, Exception):
+            raise quote
+    cached_legs = sum(1 for _, cached in quotes if cached)
+    note_request(toll_legs=len(legs), toll_legs_cached=cached_legs)
+    logger.debug(f"Composed toll quote: {len(legs)} legs, {cached_legs} cached")
+    
+    with timed_stage('toll.compose'):
+        toll_booths, route_coordinates, waypoint_coords = [], [], []
+        for leg, (result, _) in enumerate(quotes):
+            toll_booths.extend(result['toll_booths'])
+            route = result['route_coordinates']
+            # Each leg starts where the previous one ended
+            if route_coordinates and route and route_coordinates[-1] == route[0]:
+                route = route[1:]
+            route_coordinates.extend(route)
+            if leg < len(legs) - 1 and result.get('destination_coords'):
+                waypoint_coords.append(result['destination_coords'])
+        distances = [result.get('route_distance_km') for result, _ in quotes]
+        distance_km = round(sum(distances), 3) if None not in distances else None
+        result = build_toll_result(toll_booths, sum(result['total_toll_price'] for result, _ in quotes),
+                                   route_coordinates, distance_km)
+        result['waypoint_coords'] = waypoint_coords
+        result['legs'] = [{
+            'origin': leg_origin,
+            'destination': leg_destination,
+            'toll_count': leg_result['toll_count'],
+            'total_toll_price': leg_result['total_toll_price'],
+            'route_distance_km': leg_result.get('route_distance_km'),
+            'route_id': leg_result.get('route_id'),
+            'cached': cached
+        } for (leg_origin, leg_destination), (leg_result, cached) in zip(legs, quotes)]
+    note_request(toll_count=result['toll_count'], route_points_simplified=len(route_coordinates))
+    return result
+
+def compute_multi_toll_data(origin, destination, waypoints, journey_types):
+    """Quote several vehicle classes for one journey in a single pass.
+
+    Upstream calls for classes missing from the cache run concurrently. The
+    route is identical for every class, so it is extracted and simplified once
+    and shared; each class keeps its own booth list and total.
+    """
+    return run_upstream(compute_multi_toll_data_steps(origin, destination, waypoints, journey_types))
+
+def compute_multi_toll_data_steps(origin, destination, waypoints, journey_types, locations=None):
+    """Step generator behind compute_multi_toll_data (see UpstreamCall and compute_toll_data_steps)."""
+    processed_origin, processed_destination, processed_waypoints = locations or prepare_toll_locations(
+        origin, destination, waypoints)
+    
+    quotes = {}
+    errors = {}
+    shared_route = shared_route_id = None
+    
+    if not API_KEY:
+        logger.warning("No API key found, using sample data")
+        sample_result = build_sample_toll_result()
+        quotes = {journey_type: sample_result for journey_type in journey_types}
+    else:
+        cache_keys = {
+            journey_type: toll_cache_key(processed_origin, processed_destination, processed_waypoints, journey_type)
+            for journey_type in journey_types
+        }
+        missing = []
+        for journey_type in journey_types:
+            cached_result = TOLL_CACHE.get(cache_keys[journey_type])
+            if cached_result is not None:
+                quotes[journey_type] = cached_result
+            else:
+                missing.append(journey_type)
+        logger.debug(f"Multi-vehicle quote: {len(quotes)} cached, {len(missing)} to fetch")
+        
+        if missing:
+            responses = yield Concurrently(
+                (fetch_toll_response_steps(processed_origin, processed_destination, processed_waypoints, journey_type)
+                 for journey_type in missing),
+                MULTI_VEHICLE_MAX_WORKERS)
+            
+            for journey_type, response_data in zip(missing, responses):
+                try:
+                    if isinstance(response_data, Exception):
+                        raise response_data
+                    with timed_stage('toll.booths'):
+                        transformed_booths, total_toll = transform_toll_booths(response_data)
+                    if shared_route is None:
+                        cached_quote = next(iter(quotes.values()), {})
+                        cached_route = cached_quote.get('route_coordinates')
+                        if cached_route is None:
+                            with timed_stage('toll.route'):
+                                route_coordinates = extract_route_coordinates(response_data, transformed_booths)
+                                shared_route_id = ROUTE_STORE.store(route_coordinates)
+                            with timed_stage('toll.simplify'):
+                                cached_route = simplify_coordinates(route_coordinates)
+                        else:
+                            shared_route_id = cached_quote.get('route_id')
+                        shared_route = cached_route
+                    result = build_toll_result(transformed_booths, total_toll, shared_route,
+                                               route_distance_km(response_data), shared_route_id)
+                except TollApiError as e:
+                    errors[journey_type] = {**e.payload, 'status_code': e.status_code}
+                    continue
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.error(f"Data Processing Error for {journey_type}: {str(e)}")
+                    errors[journey_type] = {'error': f'Failed to process API response: {str(e)}', 'status_code': 500}
+                    continue
+                
+                TOLL_CACHE.set(cache_keys[journey_type], result)
+                with timed_stage('toll.catalogue'):
+                    TOLL_PLAZAS.ingest(response_data, journey_type)
+                quotes[journey_type] = result
+    
+    if not quotes:
+        first_error = errors[journey_types[0]]
+        raise TollApiError(first_error['error'], first_error.get('status_code', 500), errors=errors)
+    
+    if shared_route is None:
+        first_quote = next(iter(quotes.values()))
+        shared_route, shared_route_id = first_quote['route_coordinates'], first_quote.get('route_id')
+    
+    result = {
+        'journey_types': [journey_type for journey_type in journey_types if journey_type in quotes],
+        'route_distance_km': next((quote.get('route_distance_km') for quote in quotes.values()
+                                   if quote.get('route_distance_km') is not None), None),
+        'route_coordinates': shared_route,
+        'waypoint_coords': [],
+        'origin_coords': shared_route[0] if shared_route else None,
+        'destination_coords': shared_route[-1] if shared_route else None,
+        'tolls': {
+            journey_type: {
+                'toll_count': quotes[journey_type]['toll_count'],
+                'total_toll_price': quotes[journey_type]['total_toll_price'],
+                'toll_booths': quotes[journey_type]['toll_booths']
+            }
+            for journey_type in journey_types if journey_type in quotes
+        },
+        'errors': errors
+    }
+    if shared_route_id:
+        result['route_id'] = shared_route_id
+    return result
+
+def route_geometry(data):
+    """Flat lat, lng array('d') from a request's `encoded_polyline` (plus `precision`) or `route` pairs."""
+    try:
+        if data.get('encoded_polyline') is not None:
+            encoded = data['encoded_polyline']
+            precision = int(data.get('precision', ROUTE_PRECISION))
+            if not isinstance(encoded, str):
+                raise ValueError('encoded_polyline must be a string')
+            if not 1 <= precision <= 7:
+                raise ValueError('precision must be between 1 and 7')
+            points = decode_polyline(encoded, precision)
+        elif isinstance(data.get('route'), list):
+            points = array('d')
+            for point in data['route']:
+                points.append(float(point[0]))
+                points.append(float(point[1]))
+        else:
+            raise TollApiError('encoded_polyline or route is required', 400)
+    except (TypeError, ValueError, KeyError, IndexError) as e:
+        raise TollApiError(f'Invalid route geometry: {str(e)}', 400)
+
+    if len(points) < 4:
+        raise TollApiError('Route geometry needs at least two points', 400)
+    if any(abs(points[i]) > 90 or abs(points[i + 1]) > 180 for i in range(0, len(points), 2)):
+        raise TollApiError('Route geometry must be [lat, lng] points', 400)
+    return points
+
+def live_estimate_steps(points, journey_type, reason):
+    """Price a route geometry with the live Lepton API, coalescing identical geometries in flight."""
+    if not API_KEY:
+        raise TollApiError('The toll catalogue has no data for this route and no Lepton API key is configured',
+                           503, reason=reason)
+    flight_key = [hashlib.sha256(points.tobytes()).hexdigest(), normalise_cache_part(journey_type)]
+    result = yield from ESTIMATE_FLIGHTS.run(flight_key, live_route_quote_steps(points, journey_type))
+    return {'source': 'live', 'fallback_reason': reason, **result}
+
+def live_route_quote_steps(points, journey_type):
+    """Quote a route geometry with Lepton and add the answer to the toll-plaza catalogue."""
+    pairs = [[points[i], points[i + 1]] for i in range(0, len(points), 2)]
+    encoded = encode_polyline(quantise_route(pairs))
+    tolerance = 0.00001
+    while len(encoded) > LEPTON_POLYLINE_MAX_CHARS and len(pairs) > 2:
+        pairs = simplify_coordinates(pairs, tolerance)
+        encoded = encode_polyline(quantise_route(pairs))
+        tolerance *= 2
+    response_data = yield from fetch_toll_response_steps(
+        parse_coordinates(f"{pairs[0][0]},{pairs[0][1]}"), parse_coordinates(f"{pairs[-1][0]},{pairs[-1][1]}"),
+        [], journey_type, encoded)
+
+    try:
+        with timed_stage('toll.booths'):
+            transformed_booths, total_toll = transform_toll_booths(response_data)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.error(f"Data Processing Error: {str(e)}")
+        raise TollApiError(f'Failed to process API response: {str(e)}', 500)
+
+    if flat_route_points(response_data) is None:
+        response_data = {**response_data, 'route_points': points}
+    with timed_stage('toll.catalogue'):
+        TOLL_PLAZAS.ingest(response_data, journey_type)
+    return {
+        'toll_count': len(transformed_booths),
+        'total_toll_price': total_toll,
+        'toll_booths': transformed_booths
+    }
+
+def route_segments(route, sample_km, distance_km=None):
+    """Split a [lat, lng] route into equal stretches of about ``sample_km`` road km.
+
+    Lengths come from the geometry, scaled to ``distance_km`` (the road
+    distance Lepton reported) when it is known. Each segment carries its
+    midpoint, where the fuel price is sampled.
+    """
+    cumulative = [0.0]
+    for (lat1, lng1), (lat2, lng2) in zip(route, route[1:]):
+        cumulative.append(cumulative[-1] + haversine_km(lat1, lng1, lat2, lng2))
+    geometry_km = cumulative[-1]
+    total_km = distance_km if distance_km else geometry_km
+    scale = total_km / geometry_km if geometry_km else 0.0
+    count = min(TRIP_MAX_FUEL_SAMPLES, max(1, math.ceil(total_km / sample_km)))
+    
+    segments = []
+    for i in range(count):
+        target = (i + 0.5) * geometry_km / count
+        index = min(max(bisect.bisect_left(cumulative, target), 1), len(route) - 1)
+        span = cumulative[index] - cumulative[index - 1] if len(route) > 1 else 0.0
+        fraction = (target - cumulative[index - 1]) / span if span else 0.0
+        (lat1, lng1), (lat2, lng2) = route[index - 1], route[index]
+        segments.append({
+            'start_km': round(i * total_km / count, 3),
+            'end_km': round((i + 1) * total_km / count, 3),
+            'distance_km': round(total_km / count, 3),
+            'coords': [round(lat1 + (lat2 - lat1) * fraction, 5), round(lng1 + (lng2 - lng1) * fraction, 5)]
+        })
+    return total_km, ('route_metadata' if distance_km else 'geometry'), segments
+
+def trip_cost_steps(origin, destination, waypoints, journey_type, fuel_type, mileage_kmpl, sample_km):
+    """Toll quote plus fuel priced along the route for a journey (see UpstreamCall)."""
+    toll = yield from compute_toll_data_steps(origin, destination, waypoints, journey_type)
+    route = toll.get('route_coordinates') or []
+    if not route:
+        raise TollApiError('The toll quote has no route geometry to sample fuel prices along', 502)
+    
+    with timed_stage('trip.sample'):
+        distance_km, distance_source, segments = route_segments(route, sample_km, toll.get('route_distance_km'))
+        # One lookup per fuel cache cell: neighbouring samples share a price
+        locations = OrderedDict()
+        for segment in segments:
+            location = f"{segment['coords'][0]:.5f},{segment['coords'][1]:.5f}"
+            segment['cell'] = fuel_cache_cell(location) or location
+            locations.setdefault(segment['cell'], location)
+    
+    date = datetime.now().strftime('%Y-%m-%d')
+    lookups = yield Concurrently(
+        (lookup_fuel_price_steps(location, fuel_type, True, date) for location in locations.values()),
+        TRIP_FUEL_MAX_WORKERS)
+    
+    prices = {}
+    first_error = None
+    for cell, value in zip(locations, lookups):
+        if isinstance(value, FuelApiError):
+            first_error = first_error or value
+            continue
+        if isinstance(value, Exception):
+            raise value
+        price = next(iter(value.values()), {}).get(f'{fuel_type}_price')
+        if price is not None:
+            prices[cell] = float(price)
+    note_request(fuel_samples=len(segments), fuel_lookups=len(locations))
+    
+    sampled = [prices.get(segment.pop('cell')) for segment in segments]
+    priced = [i for i, price in enumerate(sampled) if price is not None]
+    if not priced:
+        if first_error is not None:
+            raise first_error
+        raise FuelApiError(f'No {fuel_type} price found along the route', 502)
+    
+    fuel_litres = fuel_cost = 0.0
+    for i, segment in enumerate(segments):
+        if sampled[i] is not None:
+            segment['fuel_price'], segment['price_from'] = sampled[i], 'sample'
+        else:
+            # Borrow the price of the closest segment that has one
+            segment['fuel_price'] = sampled[min(priced, key=lambda j: abs(j - i))]
+            segment['price_from'] = 'nearest'
+        segment['litres'] = round(segment['distance_km'] / mileage_kmpl, 3)
+        segment['fuel_cost'] = round(segment['litres'] * segment['fuel_price'], 2)
+        fuel_litres += segment['distance_km'] / mileage_kmpl
+        fuel_cost += segment['distance_km'] / mileage_kmpl * segment['fuel_price']
+    
+    return {
+        'distance_km': round(distance_km, 3),
+        'distance_source': distance_source,
+        'fuel_type': fuel_type,
+        'mileage_kmpl': mileage_kmpl,
+        'sample_km': sample_km,
+        'toll': {'toll_count': toll['toll_count'], 'total_toll_price': toll['total_toll_price']},
+        'fuel': {
+            'litres': round(fuel_litres, 3),
+            'cost': round(fuel_cost, 2),
+            'average_price': round(fuel_cost / fuel_litres, 2) if fuel_litres else None
+        },
+        'total_cost': round(toll['total_toll_price'] + fuel_cost, 2),
+        'segments': segments
+    }
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.log_payloads = LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+@app.after_request
+def record_request_timing(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    if request.endpoint and request.endpoint not in ('metrics', 'static'):
+        METRICS.observe('ft_request_duration_seconds', request.endpoint, total)
+        log_request_summary(response, total)
+    
+    if SERVER_TIMING_ENABLED:
+        # Merge repeated stages (e.g. one upstream call per vehicle class)
+        durations = OrderedDict()
+        for stage, elapsed in g.get('stage_timings', []):
+            durations[stage] = durations.get(stage, 0.0) + elapsed
+        entries = [f"{stage.replace('.', '-')};dur={elapsed * 1000:.1f}" for stage, elapsed in durations.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    rendered = METRICS.render_prometheus().rstrip('\n')
+    lines = [rendered] if rendered else []
+    
+    lines.append("# HELP ft_cache_lookups_total Cache lookups by cache and result")
+    lines.append("# TYPE ft_cache_lookups_total counter")
+    for name, cache in ResultCache.registry.items():
+        stats = cache.stats()
+        lines.append(f'ft_cache_lookups_total{{cache="{name}",result="hit"}} {stats["hits"]}')
+        lines.append(f'ft_cache_lookups_total{{cache="{name}",result="miss"}} {stats["misses"]}')
+    
+    lines.append("# HELP ft_coalesced_lookups_total Lookups that joined an identical one already in flight")
+    lines.append("# TYPE ft_coalesced_lookups_total counter")
+    for name, flight in SingleFlight.registry.items():
+        lines.append(f'ft_coalesced_lookups_total{{lookup="{name}"}} {flight.stats()["coalesced"]}')
+    
+    upstream = UPSTREAM.stats()['hosts']
+    lines.append("# HELP ft_upstream_requests_total Upstream HTTP attempts by host")
+    lines.append("# TYPE ft_upstream_requests_total counter")
+    for host, stats in upstream.items():
+        lines.append(f'ft_upstream_requests_total{{host="{host}"}} {stats["requests"]}')
+    lines.append("# HELP ft_upstream_retries_total Upstream retries by host")
+    lines.append("# TYPE ft_upstream_retries_total counter")
+    for host, stats in upstream.items():
+        lines.append(f'ft_upstream_retries_total{{host="{host}"}} {stats["retries"]}')
+    lines.append("# HELP ft_upstream_circuit_open Whether the host's circuit breaker is open")
+    lines.append("# TYPE ft_upstream_circuit_open gauge")
+    for host, stats in upstream.items():
+        lines.append(f'ft_upstream_circuit_open{{host="{host}"}} {int(stats["circuit_open"])}')
+    
+    schedulers = {host: scheduler.stats() for host, scheduler in UPSTREAM.schedulers.items()}
+    lines.append("# HELP ft_upstream_concurrency_limit Current adaptive concurrency limit by host")
+    lines.append("# TYPE ft_upstream_concurrency_limit gauge")
+    for host, stats in schedulers.items():
+        lines.append(f'ft_upstream_concurrency_limit{{host="{host}"}} {stats["limit"]}')
+    lines.append("# HELP ft_upstream_in_flight Upstream calls holding a scheduler slot by host")
+    lines.append("# TYPE ft_upstream_in_flight gauge")
+    for host, stats in schedulers.items():
+        lines.append(f'ft_upstream_in_flight{{host="{host}"}} {stats["in_flight"]}')
+    lines.append("# HELP ft_upstream_queue_depth Upstream calls waiting for a scheduler slot by host and priority")
+    lines.append("# TYPE ft_upstream_queue_depth gauge")
+    for host, stats in schedulers.items():
+        for priority, depth in stats['queue_depth'].items():
+            lines.append(f'ft_upstream_queue_depth{{host="{host}",priority="{priority}"}} {depth}')
+    lines.append("# HELP ft_upstream_throttled_total Upstream 429 responses by host")
+    lines.append("# TYPE ft_upstream_throttled_total counter")
+    for host, stats in schedulers.items():
+        lines.append(f'ft_upstream_throttled_total{{host="{host}"}} {stats["throttled"]}')
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/')
+def index():
+    # Rendered per request: url_for gives static URLs under the request's SCRIPT_NAME
+    return render_template('index.html', google_maps_api_key=GOOGLE_MAPS_API_KEY)
+
+@app.route('/get_toll_data', methods=['POST'])
+def get_toll_data():
+    return run_upstream(toll_data_view_steps())
+
+def toll_data_view_steps():
+    """Step generator for /get_toll_data, shared by the WSGI view and asgi.py."""
+    # 1. Log incoming request data
+    data = request.json
+    log_payload("Incoming request data", data)
+    
+    # Extract and validate data
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request data format'}), 400
+        
+    origin = str(data.get('origin', '')).strip()
+    destination = str(data.get('destination', '')).strip()
+    waypoints = data.get('waypoints', [])
+    journey_type = data.get('journey_type')
+    journey_types = data.get('journey_types')
+    if journey_types is None and isinstance(journey_type, list):
+        journey_types = journey_type
+    split_legs = data.get('split_legs')
+    if split_legs is not None and not isinstance(split_legs, bool):
+        return jsonify({'error': 'split_legs must be true or false'}), 400
+    
+    try:
+        route_format = requested_route_format(data)
+        route_detail, route_zoom = requested_route_detail(data)
+        if journey_types is not None:
+            if not isinstance(journey_types, list):
+                return jsonify({'error': 'journey_types must be a non-empty list'}), 400
+            if any(jt is not None and not isinstance(jt, str) for jt in journey_types):
+                return jsonify({'error': 'journey_types must be a list of vehicle type names'}), 400
+            # Drop blanks and duplicates but keep the requested order
+            journey_types = list(dict.fromkeys(jt.strip() for jt in journey_types if jt and jt.strip()))
+            if not journey_types:
+                return jsonify({'error': 'journey_types must be a non-empty list'}), 400
+        locations = prepare_toll_locations(origin, destination, waypoints)
+        if journey_types is not None:
+            result = yield from compute_multi_toll_data_steps(origin, destination, waypoints, journey_types,
+                                                              locations=locations)
+        else:
+            result = yield from compute_toll_data_steps(origin, destination, waypoints, journey_type, split_legs,
+                                                        locations=locations)
+    except TollApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    if route_detail == 'overview':
+        with timed_stage('toll.overview'):
+            result = route_overview(result, route_zoom)
+    
+    with timed_stage('toll.serialize'):
+        # Keyed on the processed query, so Bombay and mumbai share a validator
+        etag_key = ResultCache.make_key(toll_cache_key(*locations, journey_types or journey_type)
+                                        + [route_format, route_detail, route_zoom])
+        if result is build_sample_toll_result():
+            return compress_response(sample_toll_body(route_format), etag_key)
+        return compress_response(encode_route(result, route_format), etag_key)
+
+@app.route('/route/<route_id>')
+def route_viewport(route_id):
+    """The part of a stored route inside ?bbox=south,west,north,east, simplified for ?zoom."""
+    try:
+        route_format = requested_route_format(request.args)
+        try:
+            south, west, north, east = (float(value) for value in request.args.get('bbox', '').split(','))
+            zoom = int(request.args.get('zoom', ''))
+        except ValueError:
+            raise TollApiError('bbox (south,west,north,east) and zoom are required', 400)
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            raise TollApiError('bbox must be south,west,north,east with south <= north and west <= east', 400)
+        if not 0 <= zoom <= ROUTE_ZOOM_BANDS[-1][1]:
+            raise TollApiError(f'zoom must be between 0 and {ROUTE_ZOOM_BANDS[-1][1]}', 400)
+        pyramid = ROUTE_STORE.pyramid(route_id)
+        if pyramid is None:
+            raise TollApiError('Unknown or expired route_id', 404)
+    except TollApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    with timed_stage('route.query'):
+        level, parts = pyramid.query(south, west, north, east, zoom)
+    points = sum(len(part) for part in parts) // 2
+    note_request(route_level=level, route_points=points)
+    
+    with timed_stage('route.serialize'):
+        result = {
+            'route_id': route_id,
+            'zoom': zoom,
+            'min_zoom': pyramid.bands[level][0],
+            'max_zoom': pyramid.bands[level][1],
+            'bbox': [south, west, north, east],
+            'points': points,
+            'route_format': route_format
+        }
+        if route_format == 'coordinates':
+            result['parts'] = [[[part[i], part[i + 1]] for i in range(0, len(part), 2)] for part in parts]
+        else:
+            deltas = [quantise_route([[part[i], part[i + 1]] for i in range(0, len(part), 2)]) for part in parts]
+            result['route_precision'] = ROUTE_PRECISION
+            result['parts'] = [encode_polyline(part) for part in deltas] if route_format == 'polyline' else deltas
+        response = compress_response(result, request.full_path)
+    # A route_id names fixed content, so the answer for a viewport never changes
+    response.headers['Cache-Control'] = f'public, max-age={ROUTE_STORE_TTL}'
+    return response
+
+@app.route('/autocomplete')
+def autocomplete():
+    """Place suggestions for ?input=, from the bundled gazetteer, typo tolerant."""
+    text = request.args.get('input', '')[:AUTOCOMPLETE_MAX_INPUT]
+    try:
+        limit = min(max(int(request.args.get('limit', 8)), 1), AUTOCOMPLETE_MAX_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    with timed_stage('autocomplete.lookup'):
+        index = load_place_index()
+        predictions = [index.describe(place_id, edits) for place_id, edits in index.complete(text, limit)]
+    note_request(autocomplete_results=len(predictions))
+    response = compress_response({'input': text, 'predictions': predictions}, request.full_path)
+    # Suggestions only change when the gazetteer is redeployed
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@app.route('/get_fuel_price', methods=['POST'])
+def get_fuel_price():
+    return run_upstream(fuel_price_view_steps())
+
+def fuel_price_view_steps():
+    """Step generator for /get_fuel_price, shared by the WSGI view and asgi.py."""
+    data = request.json
+    log_payload("Incoming fuel price request", data)
+    
+    location = data.get('location', '').strip()
+    fuel_type = data.get('fuel_type', 'petrol').strip()
+    is_coordinates = data.get('is_coordinates', False)
+    date = datetime.now().strftime('%Y-%m-%d')
+    
+    if not location:
+        return jsonify({'error': 'Location is required'}), 400
+    
+    try:
+        result = yield from lookup_fuel_price_steps(location, fuel_type, is_coordinates, date)
+    except FuelApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    with timed_stage('fuel.serialize'):
+        return compress_response(result)
+
+@app.route('/get_fuel_prices', methods=['POST'])
+def get_fuel_prices():
+    return run_upstream(fuel_prices_view_steps())
+
+def fuel_prices_view_steps():
+    """Step generator for /get_fuel_prices, shared by the WSGI view and asgi.py."""
+    data = request.get_json(silent=True)
+    log_payload("Incoming batch fuel price request", data)
+    
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request data format'}), 400
+    locations = data.get('locations')
+    fuel_types = data.get('fuel_types') or [data.get('fuel_type') or 'petrol']
+    if not isinstance(locations, list) or not locations:
+        return jsonify({'error': 'locations must be a non-empty list'}), 400
+    if len(locations) > FUEL_BATCH_MAX_LOCATIONS:
+        return jsonify({'error': f'At most {FUEL_BATCH_MAX_LOCATIONS} locations per request'}), 400
+    if not isinstance(fuel_types, list) or not all(isinstance(fuel_type, str) and fuel_type.strip()
+                                                   for fuel_type in fuel_types):
+        return jsonify({'error': 'fuel_types must be a list of fuel type names'}), 400
+    # Drop duplicates but keep the requested order
+    fuel_types = list(dict.fromkeys(fuel_type.strip().lower() for fuel_type in fuel_types))
+    if len(fuel_types) > FUEL_BATCH_MAX_FUEL_TYPES:
+        return jsonify({'error': f'At most {FUEL_BATCH_MAX_FUEL_TYPES} fuel types per request'}), 400
+    
+    try:
+        result = yield from fuel_prices_batch_steps(locations, fuel_types, datetime.now().strftime('%Y-%m-%d'))
+    except FuelApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    with timed_stage('fuel.serialize'):
+        return compress_response(result)
+
+@app.route('/estimate_toll', methods=['POST'])
+def estimate_toll():
+    return run_upstream(estimate_toll_view_steps())
+
+def estimate_toll_view_steps():
+    """Step generator for /estimate_toll, shared by the WSGI view and asgi.py.
+
+    Prices a route geometry from the toll-plaza catalogue, calling Lepton
+    only when the catalogue cannot (unless the body sets `fallback: false`).
+    """
+    data = request.get_json(silent=True)
+    log_payload("Incoming toll estimate request", data)
+    
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request data format'}), 400
+    journey_type = str(data.get('journey_type') or '').strip()
+    if not journey_type:
+        return jsonify({'error': 'journey_type is required'}), 400
+    
+    try:
+        points = route_geometry(data)
+        try:
+            corridor_m = float(data.get('corridor_m', TOLL_CATALOGUE_CORRIDOR_M))
+        except (TypeError, ValueError):
+            corridor_m = -1
+        if not 0 < corridor_m <= 1000:
+            raise TollApiError('corridor_m must be a number of metres between 0 and 1000', 400)
+        
+        with timed_stage('toll.estimate'):
+            result, reason = TOLL_PLAZAS.estimate(points, journey_type, corridor_m)
+        if reason is None:
+            result = {'source': 'catalogue', 'fallback_reason': None, **result}
+        elif data.get('fallback', True) is False:
+            raise TollApiError('The toll catalogue cannot price this route', 422, reason=reason, **result)
+        else:
+            result = yield from live_estimate_steps(points, journey_type, reason)
+    except TollApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    note_request(toll_source=result['source'], toll_count=result['toll_count'])
+    with timed_stage('toll.serialize'):
+        return compress_response(result)
+
+@app.route('/trip_cost', methods=['POST'])
+def trip_cost():
+    return run_upstream(trip_cost_view_steps())
+
+def trip_cost_view_steps():
+    """Step generator for /trip_cost, shared by the WSGI view and asgi.py.
+
+    Quotes tolls for the journey, then prices fuel every `sample_km` along
+    the returned route with concurrent, deduplicated fuel lookups.
+    """
+    data = request.get_json(silent=True)
+    log_payload("Incoming trip cost request", data)
+    
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid request data format'}), 400
+    origin = str(data.get('origin', '')).strip()
+    destination = str(data.get('destination', '')).strip()
+    waypoints = data.get('waypoints', [])
+    journey_type = data.get('journey_type')
+    fuel_type = str(data.get('fuel_type') or 'petrol').strip().lower()
+    if data.get('mileage_kmpl') is None:
+        return jsonify({'error': 'mileage_kmpl is required'}), 400
+    try:
+        mileage_kmpl = float(data.get('mileage_kmpl'))
+        sample_km = float(data.get('sample_km', TRIP_FUEL_SAMPLE_KM))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'mileage_kmpl and sample_km must be numbers'}), 400
+    if not 0 < mileage_kmpl <= 100:
+        return jsonify({'error': 'mileage_kmpl must be between 0 and 100 km per litre'}), 400
+    if not 5 <= sample_km <= 1000:
+        return jsonify({'error': 'sample_km must be between 5 and 1000'}), 400
+    
+    try:
+        result = yield from trip_cost_steps(origin, destination, waypoints, journey_type,
+                                            fuel_type, mileage_kmpl, sample_km)
+    except TollApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    note_request(toll_count=result['toll']['toll_count'])
+    with timed_stage('trip.serialize'):
+        return compress_response(result)
+
+@app.route('/verify_bulk_password', methods=['POST'])
+def verify_bulk_password():
+    data = request.get_json()
+    password = data.get('password')
+    
+    if not password:
+        return jsonify({'success': False, 'message': 'Password is required'}), 400
+    
+    if password == BULK_PASSWORD:
+        # Create response object
+        response = make_response(jsonify({'success': True, 'message': 'Password verified'}))
         
         # Set secure cookie with 24-hour expiry
         expires = datetime.now() + timedelta(days=1)
@@ -611,5 +4314,446 @@ def check_bulk_access():
     bulk_access = request.cookies.get('bulk_access')
     return jsonify({'verified': bulk_access == 'verified'})
 
+@app.route('/cache_stats')
+def cache_stats():
+    stats = {name: cache.stats() for name, cache in ResultCache.registry.items()}
+    stats['toll_plazas'] = TOLL_PLAZAS.stats()
+    stats['bulk_jobs'] = BULK_JOBS.stats()
+    stats['route_pyramids'] = ROUTE_STORE.stats()
+    return jsonify(stats)
+
+@app.route('/upstream_stats')
+def upstream_stats():
+    stats = UPSTREAM.stats()
+    stats['schedulers'] = {host: scheduler.stats() for host, scheduler in UPSTREAM.schedulers.items()}
+    stats['coalescing'] = {name: flight.stats() for name, flight in SingleFlight.registry.items()}
+    return jsonify(stats)
+
+def parse_bulk_csv(text):
+    """Parse an uploaded bulk CSV into a header list and a list of row dicts."""
+    reader = csv.reader(io.StringIO(text.lstrip('\ufeff')))
+    rows = [row for row in reader if any(cell.strip() for cell in row)]
+    if not rows:
+        raise ValueError('CSV file is empty')
+    
+    header = [column.strip() for column in rows[0]]
+    missing = [column for column in BULK_CSV_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    
+    records = []
+    for row in rows[1:]:
+        row = row + [''] * (len(header) - len(row))
+        records.append(dict(zip(header, row)))
+    return header, records
+
+def read_bulk_upload():
+    """Parse the bulk CSV in the request, sent as a `file` upload or the raw body."""
+    upload = request.files.get('file')
+    raw = upload.read() if upload else request.get_data()
+    try:
+        return parse_bulk_csv(raw.decode('utf-8'))
+    except UnicodeDecodeError:
+        raise TollApiError('CSV file must be UTF-8 encoded', 400)
+    except (ValueError, csv.Error) as e:
+        raise TollApiError(f'Invalid CSV file: {str(e)}', 400)
+
+def process_bulk_row(record):
+    """Look up tolls for one bulk CSV row and return its result columns."""
+    UPSTREAM_PRIORITY.set('bulk')
+    try:
+        result = compute_toll_data(
+            record.get('origin', '').strip(),
+            record.get('destination', '').strip(),
+            record.get('way_points', ''),
+            record.get('journey_type', '').strip()
+        )
+        return {
+            'number_of_tolls': result.get('toll_count', 0),
+            'total_toll_price': result.get('total_toll_price', 0),
+            'status': 'SUCCESS',
+            'error_message': ''
+        }
+    except TollApiError as e:
+        message = e.payload['error']
+    except Exception as e:
+        logger.error(f"Unexpected error processing bulk row {record}: {str(e)}")
+        message = str(e) or 'Unknown error'
+    return {
+        'number_of_tolls': 0,
+        'total_toll_price': 0,
+        'status': 'ERROR',
+        'error_message': message
+    }
+
+def iter_bulk_results(records, max_workers=BULK_MAX_WORKERS):
+    """Yield (row_number, record, result) in input order using a bounded worker pool.
+
+    At most ``2 * max_workers`` rows are queued at once, so large uploads do
+    not build a future for every row up front.
+    """
+    window = max(1, max_workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        pending = []
+        for row_number, record in enumerate(records, start=1):
+            pending.append((row_number, record, executor.submit(process_bulk_row, record)))
+            if len(pending) >= window:
+                row_number, record, future = pending.pop(0)
+                yield row_number, record, future.result()
+        for row_number, record, future in pending:
+            yield row_number, record, future.result()
+
+class BulkJobStore:
+    """Bulk toll jobs persisted to SQLite with per-row checkpoints.
+
+    A submitted CSV is stored row by row, each tagged with a dedupe key built
+    from its normalised (origin, way_points, destination, journey_type). A
+    background worker computes every distinct key once through the bulk
+    worker pool and commits results every ``checkpoint_rows`` rows; the
+    download fans each result back out to all matching rows. Jobs are
+    claimed with a lease renewed at every checkpoint, so after a restart,
+    or in another worker process once the lease runs out, a job resumes
+    from its last checkpoint.
+    """
+
+    def __init__(self, db_path, checkpoint_rows=50, lease=120, retention=7 * 24 * 60 * 60):
+        self.db_path = db_path
+        self.checkpoint_rows = max(1, checkpoint_rows)
+        self.lease = lease
+        self.retention = retention
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.rows_computed = 0
+        self.jobs_resumed = 0
+
+    @property
+    def enabled(self):
+        return bool(self.db_path)
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bulk_jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, header TEXT NOT NULL, '
+                'total_rows INTEGER NOT NULL, unique_rows INTEGER NOT NULL, completed_rows INTEGER NOT NULL, '
+                'error TEXT, lease_owner TEXT, lease_until REAL NOT NULL, '
+                'created_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bulk_job_rows ('
+                'job_id TEXT NOT NULL, row_number INTEGER NOT NULL, dedupe_key TEXT NOT NULL, '
+                'record TEXT NOT NULL, PRIMARY KEY (job_id, row_number))'
+            )
+            # One result per distinct row; the checkpoint a resumed job continues from
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bulk_job_results ('
+                'job_id TEXT NOT NULL, dedupe_key TEXT NOT NULL, result TEXT NOT NULL, '
+                'PRIMARY KEY (job_id, dedupe_key))'
+            )
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def dedupe_key(record):
+        return json.dumps([normalise_cache_part(record.get(column, '')) for column in BULK_CSV_COLUMNS],
+                          separators=(',', ':'))
+
+    def submit(self, header, records):
+        """Store a parsed CSV as a queued job and wake the worker; returns the job."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        keys = [self.dedupe_key(record) for record in records]
+        conn = self._db()
+        with conn:
+            self._purge(conn, now)
+            conn.execute(
+                'INSERT INTO bulk_jobs (id, status, header, total_rows, unique_rows, completed_rows, '
+                'lease_until, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, 0, ?, ?)',
+                (job_id, 'queued', json.dumps(header), len(records), len(set(keys)), now, now))
+            conn.executemany(
+                'INSERT INTO bulk_job_rows (job_id, row_number, dedupe_key, record) VALUES (?, ?, ?, ?)',
+                ((job_id, row_number, key, json.dumps(record))
+                 for row_number, (key, record) in enumerate(zip(keys, records), start=1)))
+        logger.info(f"Bulk job {job_id} queued: {len(records)} rows, {len(set(keys))} distinct")
+        self.start()
+        self._wake.set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self._db().execute(
+            'SELECT id, status, header, total_rows, unique_rows, completed_rows, error, '
+            'created_at, updated_at, finished_at FROM bulk_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job_id, status, header, total_rows, unique_rows, completed_rows, error, created, updated, finished = row
+        return {
+            'job_id': job_id,
+            'status': status,
+            'header': json.loads(header),
+            'total_rows': total_rows,
+            'unique_rows': unique_rows,
+            'completed_rows': completed_rows,
+            'progress': round(completed_rows / unique_rows, 4) if unique_rows else 1.0,
+            'error': error,
+            'created_at': datetime.fromtimestamp(created).isoformat(timespec='seconds'),
+            'updated_at': datetime.fromtimestamp(updated).isoformat(timespec='seconds'),
+            'finished_at': datetime.fromtimestamp(finished).isoformat(timespec='seconds') if finished else None
+        }
+
+    def iter_results(self, job_id):
+        """Yield (row_number, record, result) for every row of a job, in input order."""
+        cursor = self._db().execute(
+            'SELECT r.row_number, r.record, s.result FROM bulk_job_rows r '
+            'LEFT JOIN bulk_job_results s ON s.job_id = r.job_id AND s.dedupe_key = r.dedupe_key '
+            'WHERE r.job_id = ? ORDER BY r.row_number', (job_id,))
+        for row_number, record, result in cursor:
+            yield row_number, json.loads(record), json.loads(result) if result else None
+
+    def _purge(self, conn, now):
+        """Delete finished jobs past the retention period; caller commits."""
+        expired = [row[0] for row in conn.execute(
+            'SELECT id FROM bulk_jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (now - self.retention,))]
+        for job_id in expired:
+            for table, column in (('bulk_job_results', 'job_id'), ('bulk_job_rows', 'job_id'), ('bulk_jobs', 'id')):
+                conn.execute(f'DELETE FROM {table} WHERE {column} = ?', (job_id,))
+        if expired:
+            logger.info(f"Purged {len(expired)} expired bulk jobs")
+
+    def _claim(self):
+        """Take the oldest queued job, or one whose lease has run out; returns its id or None."""
+        conn = self._db()
+        now = time.time()
+        with conn:
+            row = conn.execute(
+                "SELECT id, completed_rows FROM bulk_jobs WHERE status IN ('queued', 'running') AND lease_until < ? "
+                "ORDER BY created_at LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            job_id, completed_rows = row
+            # Only if no other worker claimed it since the SELECT
+            claimed = conn.execute(
+                "UPDATE bulk_jobs SET status = 'running', lease_owner = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running') AND lease_until < ?",
+                (self.worker_id, now + self.lease, now, job_id, now)).rowcount
+        if not claimed:
+            return None
+        if completed_rows:
+            self.jobs_resumed += 1
+            logger.info(f"Resuming bulk job {job_id} from checkpoint ({completed_rows} rows done)")
+        return job_id
+
+    def _checkpoint(self, conn, job_id, results, status='running'):
+        """Commit computed results and renew the lease; False if another worker now owns the job."""
+        now = time.time()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO bulk_job_results (job_id, dedupe_key, result) VALUES (?, ?, ?)',
+                             ((job_id, key, json.dumps(result)) for key, result in results))
+            owned = conn.execute(
+                'UPDATE bulk_jobs SET completed_rows = (SELECT COUNT(*) FROM bulk_job_results WHERE job_id = ?), '
+                'status = ?, lease_until = ?, updated_at = ?, finished_at = ? WHERE id = ? AND lease_owner = ?',
+                (job_id, status, 0 if status != 'running' else now + self.lease, now,
+                 now if status != 'running' else None, job_id, self.worker_id)).rowcount
+        if not owned:
+            logger.warning(f"Bulk job {job_id} lease lost, stopping")
+        return bool(owned)
+
+    def _run(self, job_id):
+        conn = self._db()
+        # The first row of every distinct key that has no result yet
+        pending = conn.execute(
+            'SELECT dedupe_key, record, MIN(row_number) AS first_row FROM bulk_job_rows '
+            'WHERE job_id = ? AND dedupe_key NOT IN (SELECT dedupe_key FROM bulk_job_results WHERE job_id = ?) '
+            'GROUP BY dedupe_key ORDER BY first_row', (job_id, job_id)).fetchall()
+        keys = [key for key, _, _ in pending]
+        records = [json.loads(record) for _, record, _ in pending]
+        
+        batch = []
+        last_checkpoint = time.monotonic()
+        for index, _, result in iter_bulk_results(records):
+            batch.append((keys[index - 1], result))
+            self.rows_computed += 1
+            if len(batch) >= self.checkpoint_rows or time.monotonic() - last_checkpoint > self.lease / 4:
+                if not self._checkpoint(conn, job_id, batch):
+                    return
+                batch = []
+                last_checkpoint = time.monotonic()
+        if self._checkpoint(conn, job_id, batch, status='completed'):
+            logger.info(f"Bulk job {job_id} completed")
+
+    def _work(self):
+        while True:
+            job_id = None
+            try:
+                job_id = self._claim()
+                if job_id:
+                    self._run(job_id)
+                    continue
+            except sqlite3.Error as e:
+                logger.error(f"Bulk job store error: {str(e)}")
+            except Exception as e:
+                logger.error(f"Bulk job {job_id} failed: {str(e)}")
+                now = time.time()
+                # The thread must outlive a store that is failing too; the
+                # job is retried once its lease runs out
+                try:
+                    with self._db() as conn:
+                        conn.execute("UPDATE bulk_jobs SET status = 'failed', error = ?, lease_until = 0, "
+                                     "updated_at = ?, finished_at = ? WHERE id = ? AND lease_owner = ?",
+                                     (str(e), now, now, job_id, self.worker_id))
+                except sqlite3.Error as db_error:
+                    logger.error(f"Could not mark bulk job {job_id} failed: {str(db_error)}")
+            # Poll now and then for jobs orphaned by a worker process that died
+            self._wake.wait(min(30, self.lease))
+            self._wake.clear()
+
+    def start(self):
+        """Start the background worker once per process; it resumes any unfinished jobs.
+
+        Called by the /bulk_jobs endpoints, so processes that never see a bulk
+        job request never start the thread.
+        """
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name='bulk-jobs', daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        try:
+            jobs = dict(self._db().execute('SELECT status, COUNT(*) FROM bulk_jobs GROUP BY status').fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Bulk job store error: {str(e)}")
+            jobs = {}
+        return {'enabled': True, 'jobs': jobs, 'rows_computed': self.rows_computed,
+                'jobs_resumed': self.jobs_resumed}
+
+BULK_JOBS = BulkJobStore(BULK_JOBS_DB or None, BULK_JOB_CHECKPOINT_ROWS, BULK_JOB_LEASE, BULK_JOB_RETENTION)
+
+@app.route('/bulk_toll', methods=['POST'])
+def bulk_toll():
+    if request.cookies.get('bulk_access') != 'verified':
+        return jsonify({'error': 'Bulk access not verified'}), 401
+    
+    output_format = (request.args.get('format') or request.form.get('format') or 'ndjson').lower()
+    if output_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Unsupported format, use ndjson or csv'}), 400
+    
+    try:
+        header, records = read_bulk_upload()
+    except TollApiError as e:
+        return jsonify(e.payload), e.status_code
+    
+    logger.info(f"Bulk toll request: {len(records)} rows, format={output_format}")
+    note_request(rows=len(records))
+    
+    def generate_ndjson():
+        for row_number, record, result in iter_bulk_results(records):
+            yield json.dumps({'row': row_number, **record, **result}) + '\n'
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header + BULK_RESULT_COLUMNS)
+        for row_number, record, result in iter_bulk_results(records):
+            writer.writerow([record.get(column, '') for column in header] +
+                            [result[column] for column in BULK_RESULT_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if output_format == 'csv':
+        response = Response(generate_csv(), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=toll_calculation_results.csv'
+    else:
+        response = Response(generate_ndjson(), mimetype='application/x-ndjson')
+    # Ask proxies not to buffer so rows reach the client as they complete
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/bulk_jobs', methods=['POST'])
+def submit_bulk_job():
+    if request.cookies.get('bulk_access') != 'verified':
+        return jsonify({'error': 'Bulk access not verified'}), 401
+    if not BULK_JOBS.enabled:
+        return jsonify({'error': 'Bulk jobs are disabled (BULK_JOBS_DB is not set)'}), 503
+    
+    try:
+        header, records = read_bulk_upload()
+    except TollApiError as e:
+        return jsonify(e.payload), e.status_code
+    if not records:
+        return jsonify({'error': 'CSV file has no rows'}), 400
+    
+    try:
+        job = BULK_JOBS.submit(header, records)
+    except sqlite3.Error as e:
+        logger.error(f"Bulk job submit failed: {str(e)}")
+        return jsonify({'error': 'Could not store the bulk job'}), 500
+    note_request(rows=len(records))
+    job.pop('header')
+    return jsonify({**job, 'status_url': f"/bulk_jobs/{job['job_id']}",
+                    'results_url': f"/bulk_jobs/{job['job_id']}/results"}), 202
+
+@app.route('/bulk_jobs/<job_id>')
+def bulk_job_status(job_id):
+    if request.cookies.get('bulk_access') != 'verified':
+        return jsonify({'error': 'Bulk access not verified'}), 401
+    job = BULK_JOBS.get(job_id) if BULK_JOBS.enabled else None
+    if job is None:
+        return jsonify({'error': 'Bulk job not found'}), 404
+    if job['status'] in ('queued', 'running'):
+        # After a restart, polling an unfinished job brings this process's worker up to resume it
+        BULK_JOBS.start()
+    job.pop('header')
+    return jsonify(job)
+
+@app.route('/bulk_jobs/<job_id>/results')
+def bulk_job_results(job_id):
+    if request.cookies.get('bulk_access') != 'verified':
+        return jsonify({'error': 'Bulk access not verified'}), 401
+    job = BULK_JOBS.get(job_id) if BULK_JOBS.enabled else None
+    if job is None:
+        return jsonify({'error': 'Bulk job not found'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'error': f"Bulk job is {job['status']}", 'status': job['status'],
+                        'progress': job['progress']}), 409
+    output_format = (request.args.get('format') or 'csv').lower()
+    if output_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Unsupported format, use ndjson or csv'}), 400
+    header = job['header']
+    
+    def generate_ndjson():
+        for row_number, record, result in BULK_JOBS.iter_results(job_id):
+            yield json.dumps({'row': row_number, **record, **result}) + '\n'
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header + BULK_RESULT_COLUMNS)
+        for _, record, result in BULK_JOBS.iter_results(job_id):
+            writer.writerow([record.get(column, '') for column in header] +
+                            [result[column] for column in BULK_RESULT_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if output_format == 'csv':
+        response = Response(generate_csv(), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename=toll_calculation_results_{job_id}.csv'
+    else:
+        response = Response(generate_ndjson(), mimetype='application/x-ndjson')
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""ASGI entry point: serves the toll and fuel lookups on an asyncio event loop.
+
+/get_toll_data, /get_fuel_price, /get_fuel_prices, /estimate_toll and
+/trip_cost run the same step generators as the WSGI views, but upstream
+calls are awaited with the non-blocking client, so one process can hold
+hundreds of Lepton/Google requests in flight. Parsing, simplification and
+serialisation are resumed in worker threads. Everything else is passed
+through to the Flask app unchanged.
+
+Run with: uvicorn asgi:app --workers 2
+"""
+import io
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import (app as flask_app, run_upstream_async, toll_data_view_steps, fuel_price_view_steps,
+                 fuel_prices_view_steps, estimate_toll_view_steps, trip_cost_view_steps, UPSTREAM)
+
+flask_app.debug = False
+
+ASYNC_VIEWS = {
+    ('POST', '/get_toll_data'): toll_data_view_steps,
+    ('POST', '/get_fuel_price'): fuel_price_view_steps,
+    ('POST', '/get_fuel_prices'): fuel_prices_view_steps,
+    ('POST', '/estimate_toll'): estimate_toll_view_steps,
+    ('POST', '/trip_cost'): trip_cost_view_steps
+}
+
+wsgi_fallback = WsgiToAsgi(flask_app)
+
+
+async def read_body(receive):
+    body = io.BytesIO()
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            raise ValueError('ASGI app received a non-HTTP-request message')
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope, built the same way the fallback wrapper does."""
+    converter = WsgiToAsgiInstance(flask_app)
+    converter.scope = scope
+    return converter.build_environ(scope, body)
+
+
+async def dispatch_async_view(view_steps, environ):
+    """Run an async view inside a Flask request context, mirroring Flask.full_dispatch_request."""
+    with flask_app.request_context(environ):
+        try:
+            try:
+                rv = flask_app.preprocess_request()
+                if rv is None:
+                    rv = await run_upstream_async(view_steps())
+            except Exception as e:
+                rv = flask_app.handle_user_exception(e)
+            return flask_app.finalize_request(rv)
+        except Exception as e:
+            return flask_app.handle_exception(e)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await UPSTREAM.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    view_steps = ASYNC_VIEWS.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if view_steps is None:
+        await wsgi_fallback(scope, receive, send)
+        return
+
+    environ = build_environ(scope, await read_body(receive))
+    response = await dispatch_async_view(view_steps, environ)
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
@@ -0,0 +1,177 @@
+"""Cold-start benchmark: import time and first-request latency of the app.
+
+Every run starts a fresh interpreter, imports app and sends one request
+through the Flask test client, then the same request again. It reports
+the time from spawning the process to the first response, `import app`
+and both requests, for the app with COLD_START_MODE on and off.
+
+Runs use a private bytecode cache, filled by one unmeasured run, and a fresh
+temp directory each, so results do not depend on the state of __pycache__
+or on cache files left by earlier runs. --no-bytecode compiles everything
+from source on every start instead, the worst case on a read-only filesystem
+without precompiled files.
+
+Without --upstream the app has no API key and serves sample data; with
+--upstream mock it calls benchmarks/mock_upstream.py.
+
+Usage:
+    python benchmarks/bench_cold_start.py [--mode cold|standard|both] [--endpoint index|toll|fuel]
+                                          [--runs 15] [--upstream none|mock] [--no-bytecode]
+                                          [--budget-ms 500] [--json]
+
+With --budget-ms the script exits with status 1 when the median time from
+spawn to the first response of any measured mode is over budget.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from mock_upstream import MockUpstream  # noqa: E402
+
+REQUESTS = {
+    'index': ('GET', '/', None),
+    'toll': ('POST', '/get_toll_data', {'origin': 'Delhi', 'destination': 'Mumbai', 'journey_type': 'car'}),
+    'fuel': ('POST', '/get_fuel_price', {'location': 'Delhi', 'fuel_type': 'petrol'})
+}
+
+# Runs in the child interpreter; prints one JSON line and exits without teardown
+CHILD = """
+import json, os, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+method, path, body = json.loads(sys.argv[1])
+timings = []
+for _ in range(2):
+    start = time.perf_counter()
+    response = client.open(path, method=method, json=body)
+    response.get_data()
+    timings.append(time.perf_counter() - start)
+    assert response.status_code == 200, response.status_code
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': timings[0] * 1000,
+    'second_request_ms': timings[1] * 1000,
+    'requests_imported': 'requests' in sys.modules,
+    'numpy_imported': 'numpy' in sys.modules,
+    'modules': len(sys.modules)
+}), flush=True)
+os._exit(0)
+"""
+
+
+def child_env(mode, pycache, upstream_url, bytecode):
+    env = {key: value for key, value in os.environ.items()
+           if key not in ('LEPTON_API_KEY', 'GOOGLE_MAPS_API_KEY', 'VERCEL', 'PYTHONDONTWRITEBYTECODE')}
+    env.update(COLD_START_MODE='1' if mode == 'cold' else '0', LOG_LEVEL='WARNING',
+               PYTHONPYCACHEPREFIX=pycache)
+    if not bytecode:
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+    if upstream_url:
+        env.update(LEPTON_API_KEY='mock', GOOGLE_MAPS_API_KEY='mock',
+                   LEPTON_API_BASE=upstream_url, GOOGLE_MAPS_API_BASE=upstream_url)
+    return env
+
+
+def run_once(env, request_spec):
+    """Start one interpreter and return its timings plus the spawn-to-response wall time."""
+    tmpdir = tempfile.mkdtemp(prefix='ft_cold_start_')
+    try:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', CHILD, json.dumps(request_spec)], cwd=ROOT,
+                                   env=dict(env, TMPDIR=tmpdir), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True)
+        line = process.stdout.readline()
+        wall = time.perf_counter() - start
+        stderr = process.communicate()[1]
+        if process.returncode != 0 or not line:
+            sys.exit(f"Benchmark child failed (code {process.returncode}):\n{stderr}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    result = json.loads(line)
+    # Spawn to the end of the first request; the second request is not part of the cold start
+    result['spawn_to_response_ms'] = wall * 1000 - result['second_request_ms']
+    return result
+
+
+def summarise(runs):
+    summary = {}
+    for metric in ('spawn_to_response_ms', 'import_ms', 'first_request_ms', 'second_request_ms'):
+        values = sorted(run[metric] for run in runs)
+        summary[metric] = {
+            'p50': round(statistics.median(values), 1),
+            'p90': round(values[min(len(values) - 1, int(0.9 * len(values)))], 1),
+            'min': round(values[0], 1)
+        }
+    summary['requests_imported'] = any(run['requests_imported'] for run in runs)
+    summary['numpy_imported'] = any(run['numpy_imported'] for run in runs)
+    summary['modules'] = runs[-1]['modules']
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('cold', 'standard', 'both'), default='both')
+    parser.add_argument('--endpoint', choices=sorted(REQUESTS), default='toll')
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--upstream', choices=('none', 'mock'), default='none',
+                        help='none: no API key, sample data; mock: a local Lepton/Google stand-in')
+    parser.add_argument('--no-bytecode', action='store_true', help='compile from source on every start')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='fail if the median spawn-to-response time is over this')
+    parser.add_argument('--json', action='store_true', help='print the result as one JSON object')
+    args = parser.parse_args()
+
+    modes = ('cold', 'standard') if args.mode == 'both' else (args.mode,)
+    mock = MockUpstream() if args.upstream == 'mock' else None
+    upstream_url = mock.start() if mock else None
+    pycache = tempfile.mkdtemp(prefix='ft_cold_start_pycache_')
+    results = {}
+    try:
+        for mode in modes:
+            env = child_env(mode, pycache, upstream_url, not args.no_bytecode)
+            if not args.no_bytecode:
+                # Fill the private bytecode cache
+                run_once(env, REQUESTS[args.endpoint])
+            results[mode] = summarise([run_once(env, REQUESTS[args.endpoint]) for _ in range(args.runs)])
+    finally:
+        shutil.rmtree(pycache, ignore_errors=True)
+        if mock:
+            mock.stop()
+
+    over_budget = [mode for mode, summary in results.items()
+                   if args.budget_ms is not None and summary['spawn_to_response_ms']['p50'] > args.budget_ms]
+    if args.json:
+        print(json.dumps({'endpoint': args.endpoint, 'upstream': args.upstream, 'runs': args.runs,
+                          'bytecode': not args.no_bytecode, 'budget_ms': args.budget_ms,
+                          'over_budget': over_budget, 'modes': results}))
+    else:
+        print(f"Endpoint: {args.endpoint}, upstream: {args.upstream}, {args.runs} runs per mode, "
+              f"bytecode {'cached' if not args.no_bytecode else 'compiled on every start'} (ms, p50 / p90)")
+        print(f"{'mode':<10}{'spawn->response':>18}{'import app':>16}{'first request':>16}"
+              f"{'second request':>16}{'requests':>10}{'numpy':>7}")
+        for mode, summary in results.items():
+            cells = [f"{summary[metric]['p50']:.1f} / {summary[metric]['p90']:.1f}"
+                     for metric in ('spawn_to_response_ms', 'import_ms', 'first_request_ms', 'second_request_ms')]
+            print(f"{mode:<10}{cells[0]:>18}{cells[1]:>16}{cells[2]:>16}{cells[3]:>16}"
+                  f"{'loaded' if summary['requests_imported'] else 'no':>10}"
+                  f"{'loaded' if summary['numpy_imported'] else 'no':>7}")
+        if args.budget_ms is not None:
+            print(f"Budget {args.budget_ms:g} ms: " + (f"exceeded by {', '.join(over_budget)}" if over_budget else 'met'))
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark simplify_coordinates on the bundled Lepton response fixture.
+
+Compares the current iterative implementation (with and without numpy)
+against the original recursive Douglas-Peucker and checks that all of them
+return exactly the same points.
+
+Usage:
+    python benchmarks/bench_simplify.py [--repeat N] [--tolerance T]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+
+
+def legacy_simplify_coordinates(coords, tolerance=0.00001):
+    """The recursive implementation simplify_coordinates replaced."""
+    if len(coords) <= 2:
+        return coords
+
+    def point_line_distance(point, start, end):
+        if start == end:
+            return ((point[0] - start[0]) ** 2 + (point[1] - start[1]) ** 2) ** 0.5
+
+        n = abs((end[1] - start[1]) * point[0] - (end[0] - start[0]) * point[1] + end[0] * start[1] - end[1] * start[0])
+        d = ((end[1] - start[1]) ** 2 + (end[0] - start[0]) ** 2) ** 0.5
+        return n / d if d > 0 else 0
+
+    dmax = 0
+    index = 0
+    for i in range(1, len(coords) - 1):
+        d = point_line_distance(coords[i], coords[0], coords[-1])
+        if d > dmax:
+            index = i
+            dmax = d
+
+    if dmax > tolerance:
+        results1 = legacy_simplify_coordinates(coords[:index + 1], tolerance)
+        results2 = legacy_simplify_coordinates(coords[index:], tolerance)
+        return results1[:-1] + results2
+    else:
+        return [coords[0], coords[-1]]
+
+
+def load_route():
+    with open(os.path.join(ROOT, 'response_data.json')) as f:
+        data = json.load(f)
+    # Same conversion get_toll_data applies to the Lepton route
+    return [[float(coord[1]), float(coord[0])] for coord in data['route']]
+
+
+def best_of(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.00001)
+    args = parser.parse_args()
+
+    route = load_route()
+    print(f"Route points: {len(route)}, tolerance: {args.tolerance}, best of {args.repeat}")
+
+    legacy_time, expected = best_of(lambda: legacy_simplify_coordinates(route, args.tolerance), args.repeat)
+    rows = [('recursive (legacy)', legacy_time, True)]
+
+    current_time, current = best_of(lambda: app.simplify_coordinates(route, args.tolerance), args.repeat)
+    rows.append(('iterative (numpy)' if _has_numpy() else 'iterative (pure python)',
+                 current_time, current == expected))
+
+    if _has_numpy():
+        numpy_module = sys.modules.pop('numpy')
+        sys.modules['numpy'] = None  # makes "import numpy" raise ImportError
+        try:
+            fallback_time, fallback = best_of(lambda: app.simplify_coordinates(route, args.tolerance), args.repeat)
+        finally:
+            sys.modules['numpy'] = numpy_module
+        rows.append(('iterative (pure python)', fallback_time, fallback == expected))
+
+    print(f"Simplified points: {len(expected)}")
+    print(f"{'implementation':<26}{'time (ms)':>12}{'speed-up':>10}  identical")
+    for name, elapsed, identical in rows:
+        print(f"{name:<26}{elapsed * 1000:>12.2f}{legacy_time / elapsed:>9.1f}x  {identical}")
+
+    if not all(identical for _, _, identical in rows):
+        sys.exit('Simplified output differs from the legacy implementation')
+
+
+def _has_numpy():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Load benchmark for /get_toll_data, /get_fuel_price and bulk processing.
+
+Starts the mock upstream (benchmarks/mock_upstream.py) in-process and the
+app in a child process pointed at it. The app runs as WSGI on the threaded
+Werkzeug server or as ASGI under uvicorn. One scenario is then driven at a
+fixed concurrency, and the script reports throughput, p50/p99 latency and
+the server's peak RSS.
+
+Caches are disabled and every request uses a distinct query by default, so
+each request exercises the full hot path. Use --cache and --distinct to
+measure cached or coalesced traffic instead.
+
+Usage:
+    python benchmarks/load_test.py [--scenario toll|fuel|bulk] [--server wsgi|asgi]
+                                   [--concurrency 16] [--requests 200] [--rows 100]
+                                   [--route-points N] [--latency-ms 150] [--error-rate 0.01] [--json]
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from mock_upstream import MockUpstream, add_arguments  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, upstream_url, cache):
+    env = dict(os.environ,
+               LEPTON_API_KEY='mock', GOOGLE_MAPS_API_KEY='mock',
+               LEPTON_API_BASE=upstream_url, GOOGLE_MAPS_API_BASE=upstream_url,
+               LOG_LEVEL='WARNING')
+    if not cache:
+        env.update(TOLL_CACHE_SIZE='0', FUEL_CACHE_SIZE='0', GEOCODE_CACHE_SIZE='0', GEOCODE_CACHE_DB='')
+
+    if kind == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-c',
+                   f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Server exited during startup (code {process.returncode})")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/cache_stats", timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    sys.exit('Server did not start within 30 seconds')
+
+
+def read_rss_mb(pid, field):
+    """VmRSS / VmHWM of a process from /proc, in MB (None where /proc is unavailable)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def stop_server(process):
+    """Stop the server and return its peak RSS in MB."""
+    peak = read_rss_mb(process.pid, 'VmHWM')
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    if peak is None:
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak = maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+    return peak
+
+
+def bulk_csv(start, rows):
+    lines = ['origin,way_points,destination,journey_type']
+    lines += [f"Bench Town {start + i},,Mumbai,car" for i in range(rows)]
+    return '\n'.join(lines) + '\n'
+
+
+def make_request(scenario, base_url, session, index, distinct, rows):
+    """Send one scenario request; returns (ok, rows processed)."""
+    key = index % distinct if distinct else index
+    if scenario == 'toll':
+        response = session.post(f"{base_url}/get_toll_data", timeout=120,
+                                json={'origin': f'Bench Town {key}', 'destination': 'Mumbai', 'journey_type': 'car'})
+        return response.status_code == 200, 1
+    if scenario == 'fuel':
+        response = session.post(f"{base_url}/get_fuel_price", timeout=120,
+                                json={'location': f'Bench Town {key}', 'fuel_type': 'petrol'})
+        return response.status_code == 200, 1
+
+    response = session.post(f"{base_url}/bulk_toll?format=ndjson", timeout=600,
+                            data=bulk_csv(key * rows, rows).encode('utf-8'),
+                            cookies={'bulk_access': 'verified'})
+    if response.status_code != 200:
+        return False, 0
+    results = [json.loads(line) for line in response.text.splitlines() if line]
+    return all(result['status'] == 'SUCCESS' for result in results), len(results)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def run_load(args, base_url):
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+    latencies, failures, rows_done = [], [0], [0]
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok, rows = make_request(args.scenario, base_url, session, index, args.distinct, args.rows)
+            except requests.exceptions.RequestException:
+                ok, rows = False, 0
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                rows_done[0] += rows
+                if not ok:
+                    failures[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in range(args.concurrency):
+            executor.submit(worker)
+    wall = time.perf_counter() - started
+    return sorted(latencies), failures[0], rows_done[0], wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=('toll', 'fuel', 'bulk'), default='toll')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests (bulk: uploads) to send')
+    parser.add_argument('--rows', type=int, default=100, help='rows per bulk upload')
+    parser.add_argument('--warmup', type=int, default=None, help='unmeasured requests first (default: --concurrency)')
+    parser.add_argument('--distinct', type=int, default=0,
+                        help='cycle through this many distinct queries (default: every request distinct)')
+    parser.add_argument('--cache', action='store_true', help='leave the toll/fuel/geocode caches enabled')
+    parser.add_argument('--json', action='store_true', help='print the result as one JSON object')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = MockUpstream(args.route_points, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                        args.retry_after)
+    upstream_url = mock.start()
+    port = free_port()
+    server = start_server(args.server, port, upstream_url, args.cache)
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        warmup = args.concurrency if args.warmup is None else args.warmup
+        session = requests.Session()
+        for index in range(warmup):
+            # Negative indices keep warm-up queries out of the measured key space
+            make_request(args.scenario, base_url, session, -1 - index, 0, min(args.rows, 10))
+        baseline_rss = read_rss_mb(server.pid, 'VmRSS')
+        mock.requests.clear()
+
+        latencies, failures, rows, wall = run_load(args, base_url)
+    finally:
+        peak_rss = stop_server(server)
+        mock.stop()
+
+    result = {
+        'scenario': args.scenario,
+        'server': args.server,
+        'concurrency': args.concurrency,
+        'requests': len(latencies),
+        'failures': failures,
+        'rows': rows,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else 0.0,
+        'rows_per_second': round(rows / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        'baseline_rss_mb': round(baseline_rss, 1) if baseline_rss else None,
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss else None,
+        'route_points': mock.route_points,
+        'upstream_latency_ms': args.latency_ms,
+        'upstream_calls': dict(mock.requests)
+    }
+
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"Scenario: {args.scenario} via {args.server}, concurrency {args.concurrency}, "
+          f"{result['requests']} requests, route points {mock.route_points}, "
+          f"upstream latency {args.latency_ms} ms, error rate {args.error_rate}")
+    print(f"{'throughput (req/s)':>20}{'p50 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}"
+          f"{'failures':>10}{'peak RSS (MB)':>15}")
+    print(f"{result['throughput_rps']:>20.2f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+          f"{result['max_ms']:>10.1f}{failures:>10}{result['peak_rss_mb'] or 0:>15.1f}")
+    if args.scenario == 'bulk':
+        print(f"Rows processed: {rows} ({result['rows_per_second']:.1f} rows/s)")
+    print(f"Upstream calls: {result['upstream_calls']}")
+
+
+if __name__ == '__main__':
+    main()
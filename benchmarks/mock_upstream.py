@@ -0,0 +1,187 @@
+"""Local stand-in for the Lepton and Google APIs, for load tests that spend no quota.
+
+Serves:
+    GET /v1/toll                  response_data.json, or a synthetic route of --route-points points
+    GET /v1/fuel/prices           a price keyed by the query, as the Lepton fuel API returns it
+    GET /maps/api/geocode/json    deterministic coordinates inside India for any address
+
+Every response is delayed by --latency-ms (plus up to --jitter-ms), and an
+--error-rate fraction of requests fails with --error-status instead (a 429
+carries Retry-After: --retry-after when that is set).
+
+Usage:
+    python benchmarks/mock_upstream.py [--port 8900] [--route-points N] [--latency-ms 150] [--error-rate 0.01]
+
+then point the app at it:
+    LEPTON_API_BASE=http://127.0.0.1:8900 GOOGLE_MAPS_API_BASE=http://127.0.0.1:8900 \\
+    LEPTON_API_KEY=mock GOOGLE_MAPS_API_KEY=mock python app.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, 'response_data.json')
+
+
+def load_fixture():
+    with open(FIXTURE) as f:
+        return json.load(f)
+
+
+def synthetic_route(route, points, seed=1):
+    """Resample a [lng, lat] route to ``points`` points, with metre-scale noise.
+
+    Points are interpolated along the fixture route, so booths and metadata
+    still line up. The noise keeps Douglas-Peucker from discarding the extra
+    points as collinear.
+    """
+    rng = random.Random(seed)
+    last = len(route) - 1
+    resampled = []
+    for i in range(points):
+        position = i * last / max(1, points - 1)
+        index = min(int(position), last - 1)
+        fraction = position - index
+        (lng1, lat1), (lng2, lat2) = route[index][:2], route[index + 1][:2]
+        resampled.append([
+            round(lng1 + (lng2 - lng1) * fraction + rng.uniform(-2e-5, 2e-5), 5),
+            round(lat1 + (lat2 - lat1) * fraction + rng.uniform(-2e-5, 2e-5), 5)
+        ])
+    return resampled
+
+
+def geocode_address(address):
+    """Stable pseudo-coordinates inside India's bounding box for an address."""
+    digest = hashlib.sha1(address.strip().lower().encode('utf-8')).digest()
+    lat = 8.0 + int.from_bytes(digest[:4], 'big') / 2 ** 32 * 27.0
+    lng = 68.0 + int.from_bytes(digest[4:8], 'big') / 2 ** 32 * 29.0
+    return round(lat, 6), round(lng, 6)
+
+
+class MockUpstream:
+    """Threaded HTTP server replaying canned Lepton/Google responses."""
+
+    def __init__(self, route_points=None, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 error_status=503, retry_after=None, seed=1):
+        data = load_fixture()
+        if route_points:
+            data['route'] = synthetic_route(data['route'], route_points, seed)
+        self.route_points = len(data['route'])
+        self.toll_body = json.dumps(data).encode('utf-8')
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.server = None
+
+    def _count(self, key):
+        with self._lock:
+            self.requests[key] += 1
+
+    def _should_fail(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def respond(self, path, query):
+        """Return (status, body bytes) for a request, after the configured delay."""
+        time.sleep(self.latency + (random.uniform(0, self.jitter) if self.jitter else 0))
+        if self._should_fail():
+            self._count('errors')
+            return self.error_status, json.dumps({'message': 'Injected upstream failure'}).encode('utf-8')
+
+        if path == '/v1/toll':
+            self._count('toll')
+            return 200, self.toll_body
+        if path == '/v1/fuel/prices':
+            self._count('fuel')
+            location = query.get('query', [''])[0]
+            fuel_type = query.get('fuel_type', ['petrol'])[0]
+            body = {location: {f'{fuel_type}_price': 94.72, 'petrol_price': 94.72, 'diesel_price': 87.62}}
+            return 200, json.dumps(body).encode('utf-8')
+        if path == '/maps/api/geocode/json':
+            self._count('geocode')
+            lat, lng = geocode_address(query.get('address', [''])[0])
+            body = {'status': 'OK', 'results': [{'geometry': {'location': {'lat': lat, 'lng': lng}}}]}
+            return 200, json.dumps(body).encode('utf-8')
+        self._count('not_found')
+        return 404, json.dumps({'message': f'No mock for {path}'}).encode('utf-8')
+
+    def handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                status, body = mock.respond(url.path, parse_qs(url.query))
+                self.send_response(status)
+                if status == 429 and mock.retry_after is not None:
+                    self.send_header('Retry-After', f'{mock.retry_after:g}')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a daemon thread; returns the base URL."""
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument('--route-points', type=int, default=None,
+                        help='serve a synthetic route of this many points instead of the fixture route')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='extra random delay, up to this much')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='status returned for injected failures')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After seconds sent with injected 429s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = MockUpstream(args.route_points, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                        args.retry_after)
+    url = mock.start(args.host, args.port)
+    print(f"Mock Lepton/Google upstream on {url} (route points: {mock.route_points}, "
+          f"latency: {args.latency_ms} ms, error rate: {args.error_rate})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"Requests served: {dict(mock.requests)}")
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Build the place autocomplete index (data/places.idx) from the bundled gazetteer.
+
+The index is built from data/india_cities.csv, data/toll_plazas.csv and
+data/place_aliases.csv. Run this after editing any of them and commit the
+result; the app builds the index in memory at start-up (and logs a warning)
+when the file is missing.
+
+Usage:
+    python build_place_index.py [--output data/places.idx] [--check]
+
+With --check nothing is written and the script exits with status 1 when the
+index file is missing or was built from different CSVs.
+"""
+import argparse
+import sys
+import time
+
+from app import PlaceIndex, read_gazetteer, PLACE_INDEX_FILE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=PLACE_INDEX_FILE)
+    parser.add_argument('--check', action='store_true', help='only check that the index is up to date')
+    args = parser.parse_args()
+
+    places, aliases, digest = read_gazetteer()
+    if args.check:
+        try:
+            current = PlaceIndex.load(args.output)
+        except (OSError, ValueError) as e:
+            sys.exit(f"{args.output}: {str(e)}")
+        if current.source_digest != digest:
+            sys.exit(f"{args.output} is out of date, run python build_place_index.py")
+        print(f"{args.output} is up to date")
+        return
+
+    start = time.perf_counter()
+    index = PlaceIndex.build(places, aliases, digest)
+    index.save(args.output)
+    stats = index.stats()
+    print(f"Wrote {args.output}: {stats['places']} places, {len(aliases)} aliases, "
+          f"{stats['trie_nodes']} trie nodes in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 let map;
 let markers = [];
 let polyline;
+let detailLine; // Full-detail parts of the route for the current viewport, drawn over the overview
+let routeDetail = null; // { id, overviewMaxZoom, levels, loaded } for the route on the map
+let detailRequest = 0;
 let processedData = null; // Variable to store the processed data
+const tollResponses = new Map(); // Request body -> { etag, data } for revalidating repeat lookups
 
 // Custom marker icons
 const originIcon = L.icon({
@@ -37,6 +41,7 @@ function initMap() {
     L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
         maxZoom: 19,
     }).addTo(map);
+    map.on('moveend', refreshRouteDetail);
 }
 
 function showAlert(message) {
@@ -64,6 +69,8 @@ function clearMap() {
     if (polyline) {
         map.removeLayer(polyline);
     }
+    routeDetail = null;
+    showRouteDetail(null);
 }
 
 function formatPrice(price) {
@@ -115,17 +122,73 @@ function addMarker(lat, lng, title, type = 'default', tooltipData = null) {
     return marker;
 }
 
+// Decode a Google encoded polyline into [lat, lng] pairs
+function decodePolyline(encoded, precision = 5) {
+    const factor = Math.pow(10, precision);
+    const coordinates = [];
+    let index = 0, lat = 0, lng = 0;
+    
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let i = 0; i < 2; i++) {
+            let result = 0, shift = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        coordinates.push([lat / factor, lng / factor]);
+    }
+    return coordinates;
+}
+
+// Decode a flat delta-encoded integer array into [lat, lng] pairs
+function decodeDelta(deltas, precision = 5) {
+    const factor = Math.pow(10, precision);
+    const coordinates = [];
+    let lat = 0, lng = 0;
+    for (let i = 0; i + 1 < deltas.length; i += 2) {
+        lat += deltas[i];
+        lng += deltas[i + 1];
+        coordinates.push([lat / factor, lng / factor]);
+    }
+    return coordinates;
+}
+
+// Pull the route out of a /get_toll_data response, whichever format it came in
+function routeFromResponse(data) {
+    if (data.route_format === 'polyline' && typeof data.route_polyline === 'string') {
+        return { encoded: data.route_polyline, precision: data.route_precision };
+    }
+    if (data.route_format === 'delta' && Array.isArray(data.route_delta)) {
+        return decodeDelta(data.route_delta, data.route_precision);
+    }
+    return data.route_coordinates;
+}
+
+const routeStyle = {
+    color: '#ef4444',
+    weight: 4,
+    opacity: 0.8,
+    lineCap: 'round',
+    lineJoin: 'round'
+};
+
 function drawRoute(coordinates) {
+    // Accept an encoded polyline as well as [lat, lng] pairs
+    if (typeof coordinates === 'string') {
+        coordinates = decodePolyline(coordinates);
+    } else if (coordinates && typeof coordinates.encoded === 'string') {
+        coordinates = decodePolyline(coordinates.encoded, coordinates.precision);
+    }
     if (polyline) {
         map.removeLayer(polyline);
     }
-    polyline = L.polyline(coordinates, {
-        color: '#ef4444',
-        weight: 4,
-        opacity: 0.8,
-        lineCap: 'round',
-        lineJoin: 'round'
-    }).addTo(map);
+    polyline = L.polyline(coordinates, routeStyle).addTo(map);
     
     // Fit map to show all markers and route
     const bounds = polyline.getBounds();
@@ -133,6 +196,76 @@ function drawRoute(coordinates) {
     map.fitBounds(bounds, { padding: [50, 50] });
 }
 
+// Remember the route_id of an overview response so detail can be fetched on zoom
+function setRouteDetail(data) {
+    routeDetail = data.route_id && Array.isArray(data.route_levels) ? {
+        id: data.route_id,
+        overviewMaxZoom: data.route_levels[data.route_level].max_zoom,
+        levels: data.route_levels,
+        loaded: null
+    } : null;
+}
+
+// Draw full-detail parts over a faded overview, or go back to the overview alone
+function showRouteDetail(parts) {
+    if (detailLine) {
+        map.removeLayer(detailLine);
+        detailLine = null;
+    }
+    if (polyline) {
+        polyline.setStyle({ opacity: parts ? 0.3 : routeStyle.opacity });
+    }
+    if (parts && parts.length > 0) {
+        detailLine = L.polyline(parts, routeStyle).addTo(map);
+    }
+}
+
+// Fetch the route for the viewport once the map is zoomed in past the overview
+async function refreshRouteDetail() {
+    const detail = routeDetail;
+    if (!detail) return;
+    
+    const zoom = map.getZoom();
+    if (zoom <= detail.overviewMaxZoom) {
+        detailRequest++;
+        detail.loaded = null;
+        showRouteDetail(null);
+        return;
+    }
+    const level = detail.levels.findIndex(band => zoom <= band.max_zoom);
+    const view = map.getBounds();
+    if (detail.loaded && detail.loaded.level === level && detail.loaded.bounds.contains(view)) return;
+    
+    // Ask for a margin around the viewport so small pans need no new request
+    const bounds = view.pad(0.5);
+    const params = new URLSearchParams({
+        bbox: [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()]
+            .map(value => value.toFixed(5)).join(','),
+        zoom,
+        route_format: 'polyline'
+    });
+    const request = ++detailRequest;
+    try {
+        const response = await fetch(`/route/${detail.id}?${params}`);
+        // Ignore answers overtaken by a newer viewport or route
+        if (request !== detailRequest || routeDetail !== detail) return;
+        if (!response.ok) {
+            if (response.status === 404) {
+                // The server no longer has this route; keep showing the overview
+                routeDetail = null;
+                showRouteDetail(null);
+            }
+            return;
+        }
+        const data = await response.json();
+        if (request !== detailRequest || routeDetail !== detail) return;
+        detail.loaded = { level, bounds };
+        showRouteDetail(data.parts.map(part => decodePolyline(part, data.route_precision)));
+    } catch (error) {
+        console.error('Error loading route detail:', error);
+    }
+}
+
 function validateInputs() {
     const origin = document.getElementById('origin').value;
     const destination = document.getElementById('destination').value;
@@ -170,20 +303,27 @@ async function calculateToll() {
             .map(input => input.value)
             .filter(value => value.trim() !== '');
 
+        const body = JSON.stringify({
+            origin,
+            destination,
+            waypoints,
+            journey_type: journeyType,
+            route_format: 'polyline',
+            route_detail: 'overview'
+        });
+        const headers = { 'Content-Type': 'application/json' };
+        const previous = tollResponses.get(body);
+        if (previous) {
+            headers['If-None-Match'] = previous.etag;
+        }
+
         const response = await fetch('/get_toll_data', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                origin,
-                destination,
-                waypoints,
-                journey_type: journeyType
-            })
+            headers,
+            body
         });
 
-        if (!response.ok) {
+        if (!response.ok && response.status !== 304) {
             const contentType = response.headers.get('content-type');
             let errorMessage;
             
@@ -203,10 +343,16 @@ async function calculateToll() {
             return;
         }
 
-        const data = await response.json();
+        // 304 means the quote is unchanged, reuse the body we already have
+        const data = response.status === 304 ? previous.data : await response.json();
+        const etag = response.headers.get('ETag');
+        if (etag && response.status !== 304) {
+            tollResponses.set(body, { etag, data });
+        }
+        const route = routeFromResponse(data);
         
         // Validate required data
-        if (!data.origin_coords || !data.destination_coords || !data.route_coordinates) {
+        if (!data.origin_coords || !data.destination_coords || !route) {
             showAlert('Could not plot the route. Please try different locations.');
             return;
         }
@@ -243,8 +389,9 @@ async function calculateToll() {
             }
             
             // Draw the route if coordinates are valid
-            if (Array.isArray(data.route_coordinates) && data.route_coordinates.length > 0) {
-                drawRoute(data.route_coordinates);
+            if ((Array.isArray(route) && route.length > 0) || (route.encoded && route.encoded.length > 0)) {
+                setRouteDetail(data);
+                drawRoute(route);
             }
 
             // Update toll info with safe defaults
@@ -273,7 +420,7 @@ function addWaypointInput() {
     const isFirstViaPoint = container.children.length === 0;
     
     waypointDiv.innerHTML = `
-        <input type="text" class="waypoint-input" placeholder="Enter via point">
+        <input type="text" class="waypoint-input" list="place-suggestions" autocomplete="off" placeholder="Enter via point">
         ${!isFirstViaPoint ? `
         <button type="button" class="waypoint-btn remove-waypoint">
             <span class="material-icons">remove</span>
@@ -291,6 +438,40 @@ function addWaypointInput() {
     }
 }
 
+// Place suggestions for every input using the shared datalist, including via points added later
+const placeSuggestions = new Map(); // Typed text -> suggested place names
+let suggestionTimer;
+
+async function fetchPlaceSuggestions(text) {
+    const key = text.trim().toLowerCase();
+    if (!placeSuggestions.has(key)) {
+        const response = await fetch(`/autocomplete?input=${encodeURIComponent(key)}&limit=8`);
+        if (!response.ok) {
+            return [];
+        }
+        const data = await response.json();
+        placeSuggestions.set(key, data.predictions.map(prediction => prediction.name));
+    }
+    return placeSuggestions.get(key);
+}
+
+document.addEventListener('input', function(event) {
+    const input = event.target;
+    if (input.getAttribute('list') !== 'place-suggestions' || input.value.trim().length < 2) {
+        return;
+    }
+    clearTimeout(suggestionTimer);
+    suggestionTimer = setTimeout(async () => {
+        try {
+            const names = await fetchPlaceSuggestions(input.value);
+            const datalist = document.getElementById('place-suggestions');
+            datalist.replaceChildren(...names.map(name => new Option(name)));
+        } catch (error) {
+            console.error('Place suggestions failed:', error);
+        }
+    }, 150);
+});
+
 // Handle coordinates toggle
 document.addEventListener('DOMContentLoaded', function() {
     const coordinatesToggle = document.getElementById('coordinates-toggle');
@@ -1020,60 +1201,8 @@ async function processCSVFile(file) {
     reader.readAsText(file);
 }
 
-// Process rows with better error handling
-async function processRows(data, progressFill, progressCount) {
-    const header = [...data[0], 'number_of_tolls', 'total_toll_price', 'status', 'error_message'];
-    const rows = [header];
-    const total = data.length - 1;
-    
-    for (let i = 1; i < data.length; i++) {
-        const row = data[i];
-        const progress = (i / total) * 100;
-        progressFill.style.width = `${progress}%`;
-        progressCount.textContent = `${i}/${total}`;
-        
-        try {
-            // Process row with retry logic
-            let retries = 3;
-            let result;
-            let error = null;
-            
-            while (retries > 0) {
-                try {
-                    result = await processSingleRow(row, data[0]);
-                    break;
-                } catch (err) {
-                    error = err;
-                    retries--;
-                    if (retries > 0) {
-                        await new Promise(resolve => setTimeout(resolve, 1000));
-                    }
-                }
-            }
-            
-            if (result) {
-                rows.push([
-                    ...row,
-                    result.toll_count || 0,
-                    result.total_toll_price || 0,
-                    'SUCCESS',
-                    ''
-                ]);
-            } else {
-                throw error || new Error('Failed to process row after retries');
-            }
-        } catch (error) {
-            console.error(`Error processing row ${i}:`, error);
-            rows.push([
-                ...row,
-                0,
-                0,
-                'ERROR',
-                error.message || 'Unknown error'
-            ]);
-        }
-    }
-    
+// Serialise parsed CSV rows back into CSV text
+function toCSV(rows) {
     return rows.map(row => row.map(cell => {
         if (cell === null || cell === undefined) return '';
         const cellStr = cell.toString();
@@ -1084,73 +1213,72 @@ async function processRows(data, progressFill, progressCount) {
     }).join(',')).join('\n');
 }
 
-// Process single row with better error handling
-async function processSingleRow(row, header) {
-    const originIndex = header.indexOf('origin');
-    const destinationIndex = header.indexOf('destination');
-    const waypointsIndex = header.indexOf('way_points');
-    const journeyTypeIndex = header.indexOf('journey_type');
+// Process rows on the server, reading per-row results as they stream back
+async function processRows(data, progressFill, progressCount) {
+    const header = [...data[0], 'number_of_tolls', 'total_toll_price', 'status', 'error_message'];
+    const results = new Array(data.length).fill(null);
+    const total = data.length - 1;
+    let completed = 0;
+    
+    const formData = new FormData();
+    formData.append('file', new Blob([toCSV(data)], { type: 'text/csv' }), 'bulk.csv');
     
-    // Get values directly without parsing coordinates
-    const origin = row[originIndex].trim();
-    const destination = row[destinationIndex].trim();
+    const response = await fetch('/bulk_toll?format=ndjson', {
+        method: 'POST',
+        body: formData
+    });
     
-    // Parse waypoints
-    let waypoints = [];
-    if (waypointsIndex >= 0 && row[waypointsIndex]) {
-        // Split waypoints by comma, but handle quoted values
-        waypoints = row[waypointsIndex]
-            .split(/,(?=(?:[^"]*"[^"]*")*[^"]*$)/)
-            .map(wp => wp.trim().replace(/^"|"$/g, ''))
-            .filter(wp => wp); // Remove empty waypoints
+    if (!response.ok) {
+        let errorMessage = `HTTP ${response.status}: ${response.statusText}`;
+        try {
+            const errorData = await response.json();
+            errorMessage = errorData.error || errorMessage;
+        } catch (e) {
+            // Keep the status based message
+        }
+        throw new Error(errorMessage);
     }
     
-    const requestData = {
-        origin: origin,
-        destination: destination,
-        waypoints: waypoints,
-        journey_type: row[journeyTypeIndex].trim()
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    
+    const handleLine = (line) => {
+        if (!line.trim()) return;
+        const result = JSON.parse(line);
+        results[result.row] = result;
+        completed++;
+        progressFill.style.width = `${(completed / total) * 100}%`;
+        progressCount.textContent = `${completed}/${total}`;
     };
     
-    try {
-        const response = await fetch('/get_toll_data', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(requestData)
-        });
-        
-        if (!response.ok) {
-            const contentType = response.headers.get('content-type');
-            let errorMessage;
-            
-            try {
-                if (contentType && contentType.includes('application/json')) {
-                    const errorData = await response.json();
-                    errorMessage = errorData.error || 'Unknown error';
-                } else {
-                    const text = await response.text();
-                    errorMessage = text || response.statusText || 'Unknown error';
-                }
-            } catch (e) {
-                errorMessage = `HTTP ${response.status}: ${response.statusText}`;
-            }
-            
-            throw new Error(errorMessage);
-        }
-        
-        const result = await response.json();
-        if (!result) {
-            throw new Error('Empty response from server');
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffered + decoder.decode());
+    
+    const rows = [header];
+    for (let i = 1; i < data.length; i++) {
+        const result = results[i];
+        if (result) {
+            rows.push([
+                ...data[i],
+                result.number_of_tolls || 0,
+                result.total_toll_price || 0,
+                result.status,
+                result.error_message || ''
+            ]);
+        } else {
+            rows.push([...data[i], 0, 0, 'ERROR', 'No result returned for row']);
         }
-        
-        return result;
-    } catch (error) {
-        console.error('Row processing error:', {
-            requestData,
-            error: error.message
-        });
-        throw new Error(`Failed to process row: ${error.message}`);
     }
+    
+    return toCSV(rows);
 }
 
 // Download CSV with proper encoding
@@ -0,0 +1,87 @@
+"""Shared fixtures. The API keys are cleared before the app is imported, so
+toll and fuel lookups serve the bundled sample data and no test reaches the
+real upstream APIs. Tests that need upstream responses either stub them in
+process (``lepton``) or set keys and talk to benchmarks/mock_upstream.py
+(``mock_upstream``), which the app is pointed at. Every cache is kept in memory.
+"""
+import io
+import os
+import sys
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+FIXTURE = os.path.join(ROOT, 'response_data.json')
+
+from mock_upstream import MockUpstream  # noqa: E402
+
+MOCK = MockUpstream()
+MOCK_URL = MOCK.start()
+
+for name in ('LEPTON_API_KEY', 'GOOGLE_MAPS_API_KEY'):
+    os.environ.pop(name, None)
+os.environ.update(LEPTON_API_BASE=MOCK_URL, GOOGLE_MAPS_API_BASE=MOCK_URL,
+                  TOLL_CACHE_DB='', GEOCODE_CACHE_DB='', FUEL_CACHE_DB='')
+
+import app as app_module  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    MOCK.stop()
+
+
+class StubUpstream:
+    """Answers every request made through ``requests`` with ``status`` and ``body``.
+
+    The body defaults to the recorded Lepton toll response in response_data.json.
+    """
+
+    def __init__(self):
+        with open(FIXTURE, 'rb') as f:
+            self.body = f.read()
+        self.status = 200
+        self.calls = 0
+
+    def send(self, request):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.status
+        response.headers['Content-Type'] = 'application/json'
+        response.raw = io.BytesIO(self.body)
+        response.url, response.request = request.url, request
+        return response
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with empty caches and zeroed counters, so results do not leak between tests."""
+    for cache in app_module.ResultCache.registry.values():
+        cache.clear()
+        cache.hits = cache.misses = 0
+
+
+@pytest.fixture
+def lepton(monkeypatch):
+    """Set an API key and answer upstream calls from a StubUpstream instead of the network."""
+    stub = StubUpstream()
+    monkeypatch.setattr(app_module, 'API_KEY', 'test')
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', lambda adapter, request, **kwargs: stub.send(request))
+    return stub
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    """Set API keys so lookups reach the mock server, with its request counts reset and no injected errors."""
+    monkeypatch.setattr(app_module, 'API_KEY', 'mock')
+    monkeypatch.setattr(app_module, 'GOOGLE_MAPS_API_KEY', 'mock')
+    MOCK.requests.clear()
+    yield MOCK
+    MOCK.error_rate, MOCK.error_status, MOCK.retry_after = 0.0, 503, None
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
@@ -0,0 +1,100 @@
+"""asgi.py: toll and fuel lookups dispatched to the async step views, everything else to Flask."""
+import asyncio
+import json
+
+import httpx
+
+import app
+import asgi
+from tests.conftest import FIXTURE
+
+QUERY = {'origin': 'Delhi', 'destination': 'Jaipur', 'journey_type': 'car'}
+
+
+def call(method, path, payload=None, headers=()):
+    """Run one HTTP request through the ASGI app and return (status, headers, body)."""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()), *headers],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    # Split the body across two messages, as servers may do
+    messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True},
+                {'type': 'http.request', 'body': body[10:], 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    start = sent[0]
+    response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_toll_lookup_matches_the_wsgi_view(client):
+    status, headers, body = call('POST', '/get_toll_data', QUERY)
+    expected = client.post('/get_toll_data', json=QUERY)
+    assert status == 200
+    assert headers['etag'] == expected.headers['ETag']
+    assert json.loads(body) == expected.get_json()
+
+
+def test_errors_from_async_views_are_json(client):
+    status, _, body = call('POST', '/get_toll_data', {**QUERY, 'journey_types': []})
+    assert status == 400
+    assert json.loads(body) == {'error': 'journey_types must be a non-empty list'}
+
+
+def test_fuel_lookup_runs_as_an_async_view():
+    status, _, body = call('POST', '/get_fuel_price', {'location': 'Delhi', 'fuel_type': 'petrol'})
+    assert status == 200
+    assert 'delhi' in json.loads(body)
+
+
+def test_other_routes_fall_back_to_flask():
+    status, headers, body = call('GET', '/')
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert b'<html' in body.lower()
+
+
+def test_upstream_calls_are_awaited_on_the_async_client(monkeypatch):
+    urls = []
+
+    def handler(request):
+        urls.append(str(request.url))
+        with open(FIXTURE, 'rb') as f:
+            return httpx.Response(200, content=f.read(), headers={'Content-Type': 'application/json'})
+
+    async def lookup():
+        monkeypatch.setattr(app.UPSTREAM, '_async_session', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            return await app.run_upstream_async(app.compute_toll_data_steps('Delhi', 'Jaipur', [], 'car'))
+        finally:
+            await app.UPSTREAM.aclose()
+
+    monkeypatch.setattr(app, 'API_KEY', 'test')
+    result = asyncio.run(lookup())
+    assert len(urls) == 1 and '/v1/toll?' in urls[0]
+    assert result['toll_count'] == len(result['toll_booths']) > 0
+
+
+def test_lifespan_closes_the_upstream_client():
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi.app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
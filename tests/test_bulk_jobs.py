@@ -0,0 +1,123 @@
+"""BulkJobStore: deduplicated rows, leases and resuming from the last checkpoint after a crash.
+
+Each store stands in for one worker process; all of them share one SQLite
+file and none starts its background thread.
+"""
+import sqlite3
+import time
+
+import pytest
+
+import app
+
+HEADER = app.BULK_CSV_COLUMNS
+
+
+def records(origins):
+    return [{'origin': origin, 'way_points': '', 'destination': 'Mumbai', 'journey_type': 'car'} for origin in origins]
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.BulkJobStore, 'start', lambda self: None)
+    return str(tmp_path / 'jobs.sqlite3')
+
+
+def test_duplicate_rows_are_computed_once(db_path, mock_upstream):
+    store = app.BulkJobStore(db_path, checkpoint_rows=4)
+    job = store.submit(HEADER, records(['Delhi', 'delhi ', 'Jaipur', 'Delhi']))
+    assert (job['total_rows'], job['unique_rows'], job['status']) == (4, 2, 'queued')
+
+    assert store._claim() == job['job_id']
+    store._run(job['job_id'])
+    assert store.rows_computed == 2
+    assert mock_upstream.requests['toll'] == 2
+    job = store.get(job['job_id'])
+    assert (job['status'], job['completed_rows'], job['progress']) == ('completed', 2, 1.0)
+    rows = list(store.iter_results(job['job_id']))
+    assert [row_number for row_number, _, _ in rows] == [1, 2, 3, 4]
+    assert all(result['status'] == 'SUCCESS' and result['number_of_tolls'] == 17 for _, _, result in rows)
+
+
+def test_claimed_job_is_not_claimed_again_while_leased(db_path):
+    first, second = app.BulkJobStore(db_path), app.BulkJobStore(db_path)
+    older = first.submit(HEADER, records(['Delhi']))['job_id']
+    newer = first.submit(HEADER, records(['Jaipur']))['job_id']
+    assert first._claim() == older
+    assert second._claim() == newer
+    assert first._claim() is None
+
+
+def test_job_resumes_from_checkpoint_after_a_crash(db_path, mock_upstream, monkeypatch):
+    crashed = app.BulkJobStore(db_path, checkpoint_rows=4)
+    origins = [f'Town {i}' for i in range(12)]
+    job_id = crashed.submit(HEADER, records(origins))['job_id']
+    assert crashed._claim() == job_id
+
+    # The process dies right after its first checkpoint
+    checkpoint = crashed._checkpoint
+
+    def checkpoint_then_crash(conn, job_id, results, status='running'):
+        checkpoint(conn, job_id, results, status)
+        raise Crash()
+
+    monkeypatch.setattr(crashed, '_checkpoint', checkpoint_then_crash)
+    with pytest.raises(Crash):
+        crashed._run(job_id)
+    assert crashed.get(job_id)['completed_rows'] == 4
+
+    restarted = app.BulkJobStore(db_path, checkpoint_rows=4)
+    assert restarted._claim() is None
+    # Let the dead worker's lease run out
+    with restarted._db() as conn:
+        conn.execute('UPDATE bulk_jobs SET lease_until = ? WHERE id = ?', (time.time() - 1, job_id))
+    assert restarted._claim() == job_id
+    restarted._run(job_id)
+    assert restarted.jobs_resumed == 1
+    assert restarted.rows_computed == 8
+    job = restarted.get(job_id)
+    assert (job['status'], job['completed_rows']) == ('completed', 12)
+    assert [record['origin'] for _, record, _ in restarted.iter_results(job_id)] == origins
+
+    # The crashed worker lost its lease and cannot overwrite the finished job
+    assert not checkpoint(crashed._db(), job_id, [])
+    assert restarted.get(job_id)['status'] == 'completed'
+
+
+def test_worker_survives_a_store_error_while_recording_a_failure(db_path, monkeypatch):
+    store = app.BulkJobStore(db_path)
+    job_id = store.submit(HEADER, records(['Delhi']))['job_id']
+    claimed = []
+
+    def claim():
+        claimed.append(job_id)
+        return job_id
+
+    def run(job_id):
+        monkeypatch.setattr(store, '_db', lambda: sqlite3.connect('file:missing?mode=ro', uri=True))
+        raise Crash('row failed')
+
+    class Stop(Exception):
+        pass
+
+    def wait(timeout):
+        if len(claimed) == 2:
+            raise Stop()
+
+    monkeypatch.setattr(store, '_claim', claim)
+    monkeypatch.setattr(store, '_run', run)
+    monkeypatch.setattr(store._wake, 'wait', wait)
+    # The failed UPDATE is logged and the loop polls again instead of ending
+    with pytest.raises(Stop):
+        store._work()
+    assert claimed == [job_id, job_id]
+
+
+def test_bulk_jobs_are_disabled_without_a_database(client):
+    client.set_cookie('bulk_access', 'verified')
+    response = client.post('/bulk_jobs', data=b'origin,way_points,destination,journey_type\nDelhi,,Mumbai,car\n')
+    assert response.status_code == 503
@@ -0,0 +1,54 @@
+"""/bulk_toll: CSV parsing and rows streamed back in upload order."""
+import json
+
+import pytest
+
+import app
+
+CSV = ('origin,way_points,destination,journey_type\n'
+       'Delhi,,Jaipur,car\n'
+       ',,Jaipur,car\n'
+       'Pune,Lonavala,Mumbai,car\n')
+
+
+@pytest.fixture
+def bulk_client(client):
+    client.set_cookie('bulk_access', 'verified')
+    return client
+
+
+def test_parse_bulk_csv_pads_short_rows_and_skips_blank_ones():
+    header, records = app.parse_bulk_csv('\ufefforigin,way_points,destination,journey_type\nDelhi,,Jaipur\n,,,\n')
+    assert header == app.BULK_CSV_COLUMNS
+    assert records == [{'origin': 'Delhi', 'way_points': '', 'destination': 'Jaipur', 'journey_type': ''}]
+
+
+@pytest.mark.parametrize('text, message', [
+    ('', 'CSV file is empty'),
+    ('origin,destination\nDelhi,Jaipur\n', 'Missing required columns: way_points, journey_type'),
+])
+def test_parse_bulk_csv_rejects_bad_files(text, message):
+    with pytest.raises(ValueError, match=message):
+        app.parse_bulk_csv(text)
+
+
+def test_rows_stream_as_ndjson_in_order(bulk_client):
+    response = bulk_client.post('/bulk_toll', data=CSV)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(row['row'], row['origin'], row['status']) for row in rows] == [
+        (1, 'Delhi', 'SUCCESS'), (2, '', 'ERROR'), (3, 'Pune', 'SUCCESS')]
+    assert rows[1]['error_message'] == 'Invalid origin or destination format'
+
+
+def test_rows_stream_as_csv(bulk_client):
+    response = bulk_client.post('/bulk_toll?format=csv', data=CSV)
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == ','.join(app.BULK_CSV_COLUMNS + app.BULK_RESULT_COLUMNS)
+    assert len(lines) == 4
+    assert lines[2].endswith(',0,0,ERROR,Invalid origin or destination format')
+
+
+def test_bulk_toll_requires_verified_access(client):
+    assert client.post('/bulk_toll', data=CSV).status_code == 401
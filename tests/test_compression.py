@@ -0,0 +1,54 @@
+"""Negotiated gzip and ETag/304 revalidation for JSON responses."""
+import gzip
+
+import pytest
+
+import app
+
+QUERY = {'origin': 'Delhi', 'destination': 'Mumbai', 'journey_type': 'car'}
+
+
+@pytest.fixture
+def gzip_everything(monkeypatch):
+    monkeypatch.setattr(app, 'COMPRESSION_THRESHOLD', 0)
+
+
+def quote(client, headers=None, **data):
+    return client.post('/get_toll_data', json={**QUERY, **data}, headers=headers)
+
+
+def test_matching_if_none_match_gets_an_empty_304(client):
+    first = quote(client)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and etag
+    revalidated = quote(client, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert revalidated.headers['ETag'] == etag
+    assert quote(client, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_gzip_variant_has_its_own_etag(client, gzip_everything):
+    plain = quote(client)
+    zipped = quote(client, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert plain.headers['Vary'] == zipped.headers['Vary'] == 'Accept-Encoding'
+    assert quote(client, headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']}).status_code == 304
+
+
+def test_small_bodies_are_not_gzipped(client):
+    response = quote(client, headers={'Accept-Encoding': 'gzip'})
+    assert len(response.get_data()) <= app.COMPRESSION_THRESHOLD
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_equivalent_queries_share_an_etag(client):
+    etags = {quote(client, destination=name).headers['ETag'] for name in ('Bombay', 'mumbai', 'Mumbai ')}
+    assert len(etags) == 1
+
+
+def test_route_format_changes_the_etag(client):
+    assert quote(client).headers['ETag'] != quote(client, route_format='polyline').headers['ETag']
@@ -0,0 +1,100 @@
+"""/get_fuel_prices: deduplicated lookups, per-location and per-fuel-type errors, and bounded fan-out."""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import app
+
+
+def lookup_failing_for(fuel_types, monkeypatch):
+    """Make fuel lookups for ``fuel_types`` fail with a 503, leaving the others on the mock upstream."""
+    lookup = app.lookup_fuel_price_steps
+
+    def failing_lookup(location, fuel_type='petrol', coordinates_given=False, date=None):
+        if fuel_type in fuel_types:
+            raise app.FuelApiError('Fuel price service temporarily unavailable', 503)
+        return (yield from lookup(location, fuel_type, coordinates_given, date))
+
+    monkeypatch.setattr(app, 'lookup_fuel_price_steps', failing_lookup)
+
+
+def test_duplicate_locations_and_fuel_types_are_looked_up_once(client, mock_upstream):
+    response = client.post('/get_fuel_prices', json={'locations': ['Dilli', 'dilli ', 'Dilli'],
+                                                     'fuel_types': ['petrol', 'diesel', 'Petrol']})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['fuel_types'] == ['petrol', 'diesel']
+    assert body['summary'] == {'requested': 3, 'locations': 1, 'lookups': 2, 'failed': 0}
+    assert (mock_upstream.requests['geocode'], mock_upstream.requests['fuel']) == (1, 2)
+    assert list(body['results']) == ['Dilli', 'dilli']
+    assert body['results']['Dilli'] == body['results']['dilli']
+    assert (body['results']['Dilli']['petrol_price'], body['results']['Dilli']['diesel_price']) == (94.72, 87.62)
+
+
+def test_coordinate_strings_and_objects_share_a_lookup(client, mock_upstream):
+    body = client.post('/get_fuel_prices', json={
+        'locations': ['28.6139,77.209', {'lat': 28.6139, 'lng': 77.209}]}).get_json()
+    assert body['summary']['locations'] == 1
+    assert list(body['results']) == ['28.6139,77.209']
+    assert mock_upstream.requests['fuel'] == 1
+    assert mock_upstream.requests['geocode'] == 0
+
+
+def test_errors_are_reported_per_location_and_fuel_type(client, mock_upstream, monkeypatch):
+    lookup_failing_for({'diesel'}, monkeypatch)
+    response = client.post('/get_fuel_prices', json={'locations': ['Dilli', '', {'lat': 'north'}],
+                                                     'fuel_types': ['petrol', 'diesel']})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results['Dilli']['petrol_price'] == 94.72
+    assert results['Dilli']['diesel_price'] is None
+    assert results['Dilli']['errors'] == {
+        'diesel': {'error': 'Fuel price service temporarily unavailable', 'status_code': 503}}
+    for invalid in ('', '{"lat": "north"}'):
+        assert (results[invalid]['error'], results[invalid]['status_code']) == ('Invalid location', 400)
+    assert response.get_json()['summary']['failed'] == 3
+
+
+def test_a_location_failing_for_every_fuel_type_gets_one_error(client, mock_upstream, monkeypatch):
+    lookup_failing_for({'petrol', 'diesel'}, monkeypatch)
+    body = client.post('/get_fuel_prices', json={'locations': ['Dilli'],
+                                                 'fuel_types': ['petrol', 'diesel']}).get_json()
+    assert body['results']['Dilli'] == {'location': 'Dilli', 'coordinates': None,
+                                        'error': 'Fuel price service temporarily unavailable', 'status_code': 503}
+
+
+@pytest.mark.parametrize('payload, error', [
+    ({}, 'locations must be a non-empty list'),
+    ({'locations': 'Delhi'}, 'locations must be a non-empty list'),
+    ({'locations': ['Delhi'], 'fuel_types': [0]}, 'fuel_types must be a list of fuel type names'),
+    ({'locations': ['Delhi'], 'fuel_types': ['petrol', 'diesel', 'cng', 'lpg', 'ev']},
+     'At most 4 fuel types per request'),
+    ({'locations': ['Delhi', 'Jaipur', 'Agra']}, 'At most 2 locations per request'),
+])
+def test_invalid_requests_are_rejected(client, monkeypatch, payload, error):
+    monkeypatch.setattr(app, 'FUEL_BATCH_MAX_LOCATIONS', 2)
+    response = client.post('/get_fuel_prices', json=payload)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+
+def test_async_driver_bounds_a_fan_out_by_max_workers():
+    gate = Future()
+    active, peak = [0], [0]
+
+    def step():
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        yield gate
+        active[0] -= 1
+        return active[0]
+
+    def fan_out():
+        return (yield app.Concurrently((step() for _ in range(6)), 2))
+
+    threading.Timer(0.1, gate.set_result, (None,)).start()
+    results = asyncio.run(app.run_upstream_async(fan_out()))
+    assert len(results) == 6
+    assert peak[0] == 2
@@ -0,0 +1,31 @@
+"""The app pointed at benchmarks/mock_upstream.py through LEPTON_API_BASE and GOOGLE_MAPS_API_BASE."""
+from mock_upstream import geocode_address, load_fixture, synthetic_route
+
+
+def test_toll_lookup_reaches_the_mock(client, mock_upstream):
+    response = client.post('/get_toll_data', json={'origin': 'Delhi', 'destination': 'Mumbai', 'journey_type': 'car'})
+    assert response.status_code == 200
+    assert response.get_json()['toll_count'] == len(load_fixture()['toll_booths'])
+    assert mock_upstream.requests == {'toll': 1}
+
+
+def test_fuel_lookup_geocodes_through_the_mock(client, mock_upstream):
+    response = client.post('/get_fuel_price', json={'location': 'Chakan MIDC Phase 2', 'fuel_type': 'diesel'})
+    assert response.status_code == 200
+    assert mock_upstream.requests == {'geocode': 1, 'fuel': 1}
+    lat, lng = geocode_address('Chakan MIDC Phase 2')
+    assert response.get_json() == {f'{lat},{lng}': {'diesel_price': 87.62, 'petrol_price': 94.72}}
+
+
+def test_geocodes_are_stable_and_inside_india():
+    lat, lng = geocode_address('Chakan MIDC Phase 2')
+    assert (lat, lng) == geocode_address('  chakan midc phase 2 ')
+    assert 8 <= lat <= 35 and 68 <= lng <= 97
+
+
+def test_synthetic_route_keeps_the_fixture_endpoints():
+    route = load_fixture()['route']
+    resampled = synthetic_route(route, 5000)
+    assert len(resampled) == 5000
+    for (lng, lat), (original_lng, original_lat) in ((resampled[0], route[0][:2]), (resampled[-1], route[-1][:2])):
+        assert abs(lng - original_lng) < 1e-4 and abs(lat - original_lat) < 1e-4
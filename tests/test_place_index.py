@@ -0,0 +1,104 @@
+"""PlaceIndex: trie lookups, typo-tolerant suggestions, the binary file format and place correction."""
+import pytest
+
+import app
+
+PLACES = [
+    {'name': 'Mumbai', 'region': 'Maharashtra', 'lat': 19.076, 'lng': 72.8777, 'population': 12442373, 'kind': 'city'},
+    {'name': 'Mysore', 'region': 'Karnataka', 'lat': 12.2958, 'lng': 76.6394, 'population': 887446, 'kind': 'city'},
+    {'name': 'Mandya', 'region': 'Karnataka', 'lat': 12.5218, 'lng': 76.8951, 'population': 137358, 'kind': 'city'},
+    {'name': 'Muzaffarpur', 'region': 'Bihar', 'lat': 26.1209, 'lng': 85.3647, 'population': 393724, 'kind': 'city'},
+    {'name': 'Mulund Exit', 'region': 'Eastern Express Highway', 'lat': 19.17, 'lng': 72.95, 'population': 0,
+     'kind': 'toll_plaza'},
+]
+ALIASES = [('bombay', 'Mumbai'), ('mysuru', 'Mysore')]
+
+
+@pytest.fixture(scope='module')
+def index():
+    return app.PlaceIndex.build(PLACES, ALIASES, b'digest')
+
+
+def names(index, matches):
+    return [(index.name(place_id), edits) for place_id, edits in matches]
+
+
+def test_normalise_place_name_folds_case_accents_and_punctuation():
+    assert app.normalise_place_name('  Múmbai,  MAHARASHTRA ') == 'mumbai maharashtra'
+
+
+def test_exact_name_and_alias_resolve(index):
+    assert index.resolve('mumbai') == 'Mumbai'
+    assert index.resolve('Bombay') == 'Mumbai'
+    assert index.resolve('MYSURU') == 'Mysore'
+    assert index.resolve('Mulund Exit', kinds=('city',)) is None
+    assert index.resolve('Mumba') is None
+
+
+def test_prefix_completions_are_ranked_by_population(index):
+    assert names(index, index.complete('mu', limit=5)) == [('Mumbai', 0), ('Muzaffarpur', 0), ('Mulund Exit', 0)]
+    assert names(index, index.complete('bom')) == [('Mumbai', 0)]
+    assert index.complete('') == []
+
+
+def test_fuzzy_completions_follow_exact_ones(index):
+    # A swap of adjacent letters is one edit
+    assert names(index, index.complete('mysroe')) == [('Mysore', 1)]
+    assert names(index, index.complete('mandla')) == [('Mandya', 1)]
+    # No typos allowed below four characters
+    assert index.complete('myx') == []
+    assert index.complete('xyzzy') == []
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    path = tmp_path / 'places.idx'
+    index.save(path)
+    loaded = app.PlaceIndex.load(path)
+    assert loaded.source_digest == b'digest'.ljust(16, b'\0')
+    assert loaded.complete('mu', limit=5) == index.complete('mu', limit=5)
+    assert loaded.describe(loaded.complete('bombay')[0][0]) == index.describe(index.complete('bombay')[0][0])
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'places.idx'
+    path.write_bytes(b'not an index')
+    with pytest.raises(ValueError):
+        app.PlaceIndex.load(path)
+    path.write_bytes(app.PlaceIndex.MAGIC + b'\0' * 16 + b'\1')
+    with pytest.raises(ValueError):
+        app.PlaceIndex.load(path)
+
+
+def test_bundled_index_is_up_to_date():
+    _, _, digest = app.read_gazetteer()
+    assert app.PlaceIndex.load(app.PLACE_INDEX_FILE).source_digest == digest
+
+
+@pytest.mark.parametrize('location, expected', [
+    ('Bombay', 'Mumbai'),
+    ('bengaluru', 'Bangalore'),
+    ('Delhi', 'Delhi'),
+    # Real towns missing from the gazetteer, one letter from a listed city
+    ('Mandla', 'Mandla'),
+    ('Jajpur', 'Jajpur'),
+    ('Kolkatta', 'Kolkatta'),
+    # Renames and spelling variants of the same city
+    ('Gurugram', 'Gurgaon'),
+    ('Allahabad', 'Prayagraj'),
+    ('ballari', 'Bellary'),
+    # Distinct places next to a listed city
+    ('Faizabad', 'Faizabad'),
+    ('Ernakulam', 'Ernakulam'),
+])
+def test_process_location_only_resolves_exact_names_and_aliases(location, expected):
+    assert app.process_location(location) == expected
+
+
+def test_autocomplete_endpoint(client):
+    response = client.get('/autocomplete?input=Hyd&limit=3')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=86400'
+    predictions = response.get_json()['predictions']
+    assert predictions[0]['name'] == 'Hyderabad'
+    assert predictions[0]['kind'] == 'city'
+    assert client.get('/autocomplete?input=Hyd&limit=x').status_code == 400
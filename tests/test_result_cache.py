@@ -0,0 +1,82 @@
+"""ResultCache: LRU eviction, TTL expiry, the shared SQLite layer and cached toll quotes."""
+import pytest
+
+import app
+
+QUERY = {'origin': 'Delhi', 'destination': 'Jaipur', 'journey_type': 'car'}
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Keep the caches built here out of the app's registry."""
+    monkeypatch.setattr(app.ResultCache, 'registry', dict(app.ResultCache.registry))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A controllable time.time for the cache."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = app.ResultCache('test_lru', max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = app.ResultCache('test_ttl', max_entries=10, ttl=60)
+    cache.set('default', 'x')
+    cache.set('short', 'y', ttl=5)
+    clock[0] += 10
+    assert cache.get('short') is None
+    assert cache.get('default') == 'x'
+    clock[0] += 60
+    assert cache.get('default', 'missing') == 'missing'
+    stats = cache.stats()
+    assert stats['expirations'] == 2
+    assert (stats['hits'], stats['misses']) == (1, 2)
+
+
+def test_disabled_cache_stores_nothing():
+    cache = app.ResultCache('test_disabled', max_entries=0, ttl=60)
+    cache.set('a', 1)
+    assert not cache.enabled
+    assert cache.get('a') is None
+
+
+def test_sqlite_layer_is_shared_and_outlives_memory(clock, tmp_path):
+    db_path = str(tmp_path / 'cache.sqlite3')
+    writer = app.ResultCache('test_sqlite', max_entries=10, ttl=60, db_path=db_path)
+    writer.set(['delhi', 'jaipur', [], 'car'], {'total_toll_price': 11741.0})
+    # A second instance stands in for another worker process or a restart
+    reader = app.ResultCache('test_sqlite', max_entries=10, ttl=60, db_path=db_path)
+    assert reader.get(['delhi', 'jaipur', [], 'car']) == {'total_toll_price': 11741.0}
+    clock[0] += 61
+    reader._entries.clear()
+    assert reader.get(['delhi', 'jaipur', [], 'car']) is None
+
+
+def test_equivalent_queries_share_a_cached_quote(client, lepton):
+    first = client.post('/get_toll_data', json=QUERY)
+    second = client.post('/get_toll_data', json={**QUERY, 'origin': '  delhi '})
+    assert first.status_code == second.status_code == 200
+    assert first.get_json() == second.get_json()
+    assert lepton.calls == 1
+    assert client.get('/cache_stats').get_json()['toll_quotes']['hits'] == 1
+
+
+def test_upstream_errors_are_not_cached(client, lepton):
+    quote = lepton.body
+    lepton.status, lepton.body = 404, b'{"message": "No route found"}'
+    assert client.post('/get_toll_data', json=QUERY).status_code == 404
+    lepton.status, lepton.body = 200, quote
+    assert client.post('/get_toll_data', json=QUERY).status_code == 200
+    assert lepton.calls == 2
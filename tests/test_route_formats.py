@@ -0,0 +1,75 @@
+"""Compact route encodings: Google polyline and integer deltas, and how clients ask for them."""
+import sys
+
+import polyline
+import pytest
+
+import app
+from benchmarks.bench_simplify import load_route
+
+# The worked example from Google's encoded polyline algorithm documentation
+REFERENCE_POINTS = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+REFERENCE_POLYLINE = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+
+@pytest.fixture(params=['numpy', 'pure python'])
+def implementation(request, monkeypatch):
+    if request.param == 'pure python':
+        monkeypatch.setitem(sys.modules, 'numpy', None)
+    return request.param
+
+
+def test_reference_vector(implementation):
+    deltas = app.quantise_route(REFERENCE_POINTS)
+    assert deltas == [3850000, -12020000, 220000, -75000, 255200, -550300]
+    assert app.encode_polyline(deltas) == REFERENCE_POLYLINE
+
+
+def test_polyline_round_trips_the_fixture_route(implementation):
+    route = load_route()
+    decoded = polyline.decode(app.encode_polyline(app.quantise_route(route)), 5)
+    assert decoded == [(round(lat, 5), round(lng, 5)) for lat, lng in route]
+
+
+def test_rounding_is_half_away_from_zero(implementation):
+    assert app.quantise_route([[0.000005, -0.000005], [0.000015, -0.000015]]) == [1, -1, 1, -1]
+
+
+def test_deltas_add_up_to_the_quantised_points(implementation):
+    route = load_route()[:500]
+    deltas = app.quantise_route(route)
+    lat = lng = 0
+    for (expected_lat, expected_lng), dlat, dlng in zip(route, deltas[::2], deltas[1::2]):
+        lat, lng = lat + dlat, lng + dlng
+        assert (lat, lng) == (round(expected_lat * 1e5), round(expected_lng * 1e5))
+
+
+def quote(client, headers=None, **data):
+    return client.post('/get_toll_data', headers=headers,
+                       json={'origin': 'Delhi', 'destination': 'Jaipur', 'journey_type': 'car', **data})
+
+
+def test_route_format_from_body_or_accept_header(client):
+    coordinates = quote(client).get_json()
+    assert 'route_format' not in coordinates
+    by_body = quote(client, route_format='polyline').get_json()
+    by_header = quote(client, headers={'Accept': 'application/json; route="polyline"'}).get_json()
+    assert by_body == by_header
+    assert 'route_coordinates' not in by_body
+    assert (by_body['route_format'], by_body['route_precision']) == ('polyline', 5)
+    assert polyline.decode(by_body['route_polyline'], 5) == [tuple(point) for point in coordinates['route_coordinates']]
+    assert quote(client, route_format='delta').get_json()['route_delta'] == app.quantise_route(
+        coordinates['route_coordinates'])
+
+
+def test_unknown_route_format_is_rejected(client):
+    response = quote(client, route_format='geojson')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'route_format must be one of: coordinates, polyline, delta'}
+
+
+def test_cached_quotes_are_not_modified(client, lepton):
+    first = quote(client).get_json()
+    quote(client, route_format='polyline')
+    assert quote(client).get_json() == first
+    assert lepton.calls == 1
@@ -0,0 +1,44 @@
+"""Route overviews and viewport queries against the full-detail route of a toll quote."""
+import json
+from array import array
+
+import app
+from tests.conftest import FIXTURE
+
+QUERY = {'origin': 'Delhi', 'destination': 'Mumbai', 'journey_type': 'car'}
+EVERYWHERE = '-90,-180,90,180'
+
+
+def fixture_route_points():
+    with open(FIXTURE) as f:
+        return len(json.load(f)['route'])
+
+
+def test_deepest_zoom_serves_every_parsed_point(client, lepton):
+    full = client.post('/get_toll_data', json=QUERY).get_json()
+    overview = client.post('/get_toll_data', json={**QUERY, 'route_detail': 'overview'}).get_json()
+    assert lepton.calls == 1
+    assert overview['route_id'] == full['route_id']
+    assert len(overview['route_coordinates']) < len(full['route_coordinates'])
+
+    detail = client.get(f"/route/{overview['route_id']}?bbox={EVERYWHERE}&zoom=22").get_json()
+    assert detail['points'] == fixture_route_points() > len(full['route_coordinates'])
+
+
+def test_multi_vehicle_quotes_share_the_stored_route(client, lepton):
+    single = client.post('/get_toll_data', json=QUERY).get_json()
+    multi = client.post('/get_toll_data', json={**QUERY, 'journey_types': ['car', 'truck']}).get_json()
+    assert multi['route_id'] == single['route_id']
+
+
+def test_sample_data_overview_stores_the_served_route(client):
+    overview = client.post('/get_toll_data', json={**QUERY, 'route_detail': 'overview'}).get_json()
+    served = len(app.build_sample_toll_result()['route_coordinates'])
+    detail = client.get(f"/route/{overview['route_id']}?bbox={EVERYWHERE}&zoom=22").get_json()
+    assert detail['points'] == served
+
+
+def test_flat_routes_quantise_like_coordinate_pairs():
+    pairs = [[28.61394, 77.20902], [28.6, 77.21], [19.07609, 72.87766]]
+    flat = array('d', (value for pair in pairs for value in pair))
+    assert app.quantise_route(flat) == app.quantise_route(pairs)
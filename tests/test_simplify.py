@@ -0,0 +1,47 @@
+"""simplify_coordinates must keep exactly the points the original recursive Douglas-Peucker kept."""
+import random
+import sys
+
+import pytest
+
+import app
+from benchmarks.bench_simplify import legacy_simplify_coordinates, load_route
+
+
+def random_routes(count=300, seed=7):
+    rng = random.Random(seed)
+    for _ in range(count):
+        lat, lng = rng.uniform(8, 35), rng.uniform(68, 97)
+        route = []
+        for _ in range(rng.randint(3, 400)):
+            lat += rng.uniform(-1e-3, 1e-3)
+            lng += rng.uniform(-1e-3, 1e-3)
+            route.append([round(lat, 5), round(lng, 5)])
+        if rng.random() < 0.1:
+            route.append(list(route[0]))  # a loop: first and last points equal
+        yield route, rng.choice([0.00001, 0.0001, 0.001])
+
+
+@pytest.fixture(params=['numpy', 'pure python'])
+def implementation(request, monkeypatch):
+    """Run each test with and without numpy's vectorised distances."""
+    if request.param == 'numpy':
+        monkeypatch.setattr(app, 'DOUGLAS_PEUCKER_VECTOR_MIN', 8)
+    else:
+        monkeypatch.setitem(sys.modules, 'numpy', None)
+    return request.param
+
+
+def test_fixture_route_matches_recursive_version(implementation):
+    route = load_route()
+    assert app.simplify_coordinates(route) == legacy_simplify_coordinates(route)
+
+
+def test_random_routes_match_recursive_version(implementation):
+    for route, tolerance in random_routes():
+        assert app.simplify_coordinates(route, tolerance) == legacy_simplify_coordinates(route, tolerance)
+
+
+@pytest.mark.parametrize('route', [[], [[28.6, 77.2]], [[28.6, 77.2], [26.9, 75.8]]])
+def test_two_points_or_fewer_are_returned_as_is(route):
+    assert app.simplify_coordinates(route) == route
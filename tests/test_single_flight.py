@@ -0,0 +1,84 @@
+"""SingleFlight: identical lookups in flight share one upstream round trip, its result or its error."""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import app
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def gated(gate, outcome):
+    """Step generator that waits for ``gate`` and then returns or raises ``outcome``."""
+    yield gate
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+
+def never_run():
+    raise AssertionError('a coalesced caller ran its own lookup')
+    yield
+
+
+def run_leader_and_follower(flight, outcome):
+    """Start a lookup, join a second caller to it, then let it finish; returns both futures."""
+    gate = Future()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(app.run_upstream, flight.run('delhi-jaipur', gated(gate, outcome)))
+        wait_for(lambda: flight.stats()['in_flight'] == 1)
+        follower = executor.submit(app.run_upstream, flight.run('delhi-jaipur', never_run()))
+        wait_for(lambda: flight.stats()['coalesced'] == 1)
+        gate.set_result(None)
+    return leader, follower
+
+
+def test_follower_gets_the_leaders_result():
+    flight = app.SingleFlight('test_result')
+    leader, follower = run_leader_and_follower(flight, {'toll_count': 17})
+    assert follower.result() is leader.result()
+    assert flight.stats() == {'leaders': 1, 'coalesced': 1, 'in_flight': 0}
+
+
+def test_follower_gets_the_leaders_exception():
+    flight = app.SingleFlight('test_error')
+    error = app.TollApiError('Toll service temporarily unavailable', 503)
+    leader, follower = run_leader_and_follower(flight, error)
+    assert leader.exception() is error
+    assert follower.exception() is error
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_finished_lookups_are_not_reused():
+    flight = app.SingleFlight('test_finished')
+    for value in (1, 2):
+        gate = Future()
+        gate.set_result(None)
+        assert app.run_upstream(flight.run('delhi-jaipur', gated(gate, value))) == value
+    assert flight.stats() == {'leaders': 2, 'coalesced': 0, 'in_flight': 0}
+
+
+def test_concurrent_identical_requests_make_one_upstream_call(lepton, monkeypatch):
+    release = threading.Event()
+    send = lepton.send
+
+    def slow_send(request):
+        release.wait(5)
+        return send(request)
+
+    monkeypatch.setattr(lepton, 'send', slow_send)
+    query = {'origin': 'Delhi', 'destination': 'Jaipur', 'journey_type': 'car'}
+    coalesced = app.TOLL_FLIGHTS.stats()['coalesced']
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(app.app.test_client().post, '/get_toll_data', json=query)
+        wait_for(lambda: app.TOLL_FLIGHTS.stats()['in_flight'] == 1)
+        second = executor.submit(app.app.test_client().post, '/get_toll_data', json=query)
+        wait_for(lambda: app.TOLL_FLIGHTS.stats()['coalesced'] > coalesced)
+        release.set()
+    assert first.result().get_json() == second.result().get_json()
+    assert lepton.calls == 1
@@ -0,0 +1,64 @@
+"""/get_toll_data: sample data, several vehicle classes per request and errors passed on from Lepton."""
+import pytest
+
+
+def quote(client, **data):
+    return client.post('/get_toll_data', json={'origin': 'Delhi', 'destination': 'Jaipur', 'journey_type': 'car', **data})
+
+
+def test_sample_quote_without_an_api_key(client):
+    response = quote(client)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['toll_count'] == len(result['toll_booths']) > 0
+    assert result['total_toll_price'] == sum(booth['price'] for booth in result['toll_booths'])
+
+
+def test_invalid_locations_are_rejected(client):
+    response = quote(client, origin='')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid origin or destination format'}
+
+
+def test_upstream_error_is_returned_with_its_status(client, lepton):
+    lepton.status, lepton.body = 403, b'{"message": "Invalid API key"}'
+    response = quote(client)
+    assert response.status_code == 403
+    assert response.get_json() == {'error': 'Invalid API key', 'status_code': 403}
+
+
+def test_unparseable_upstream_response(client, lepton):
+    lepton.body = b'<html>Bad gateway</html>'
+    response = quote(client)
+    assert response.status_code == 500
+    assert response.get_json()['error'] == 'Failed to parse API response'
+
+
+def test_several_vehicle_classes_share_one_route(client, lepton):
+    response = quote(client, journey_type=None, journey_types=['car', 'truck', ' car '])
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['journey_types'] == ['car', 'truck']
+    assert set(result['tolls']) == {'car', 'truck'}
+    assert result['errors'] == {}
+    assert result['route_coordinates']
+    assert lepton.calls == 2
+
+
+def test_journey_type_list_is_read_as_journey_types(client):
+    result = quote(client, journey_type=['car', 'bus']).get_json()
+    assert result['journey_types'] == ['car', 'bus']
+
+
+@pytest.mark.parametrize('journey_types, error', [
+    ([], 'journey_types must be a non-empty list'),
+    ('car', 'journey_types must be a non-empty list'),
+    ([''], 'journey_types must be a non-empty list'),
+    ([None, '  '], 'journey_types must be a non-empty list'),
+    (['car', 0], 'journey_types must be a list of vehicle type names'),
+    ([{'type': 'car'}], 'journey_types must be a list of vehicle type names'),
+])
+def test_invalid_journey_types_are_rejected(client, journey_types, error):
+    response = quote(client, journey_types=journey_types)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
@@ -0,0 +1,64 @@
+"""Waypoint journeys quoted leg by leg (split_legs) against the mock Lepton API."""
+import pytest
+
+import app
+
+
+def toll_request(client, waypoints, split_legs=True, origin='Delhi', destination='Mumbai'):
+    return client.post('/get_toll_data', json={'origin': origin, 'destination': destination, 'waypoints': waypoints,
+                                               'journey_type': 'car', 'split_legs': split_legs})
+
+
+def test_journey_legs_skip_repeated_stops():
+    assert app.journey_legs(['Delhi', 'Jaipur', 'jaipur ', 'Mumbai']) == [('Delhi', 'Jaipur'), ('Jaipur', 'Mumbai')]
+    assert app.journey_legs(['Delhi', 'Delhi', 'DELHI']) == []
+
+
+def test_legs_are_stitched_and_reused(client, mock_upstream):
+    response = toll_request(client, ['Jaipur', 'Indore'])
+    assert response.status_code == 200
+    result = response.get_json()
+    assert mock_upstream.requests['toll'] == 3
+    assert [(leg['origin'], leg['destination'], leg['cached']) for leg in result['legs']] == [
+        ('Delhi', 'Jaipur', False), ('Jaipur', 'Indore', False), ('Indore', 'Mumbai', False)]
+    assert result['toll_count'] == 3 * 17
+    assert len(result['waypoint_coords']) == 2
+
+    # Removing one waypoint only fetches the new leg next to it
+    result = toll_request(client, ['Jaipur']).get_json()
+    assert mock_upstream.requests['toll'] == 4
+    assert [leg['cached'] for leg in result['legs']] == [True, False]
+
+
+@pytest.mark.parametrize('waypoints, legs', [
+    (['Jaipur', 'Jaipur'], 2),
+    (['Delhi', 'Jaipur', 'Mumbai'], 2),
+])
+def test_repeated_waypoints_are_quoted_once(client, mock_upstream, waypoints, legs):
+    result = toll_request(client, waypoints).get_json()
+    assert len(result['legs']) == legs
+    assert mock_upstream.requests['toll'] == legs
+
+
+def test_journey_without_legs_is_quoted_whole(client, mock_upstream):
+    split = toll_request(client, ['Delhi'], origin='Delhi', destination='delhi')
+    assert split.status_code == 200
+    assert 'legs' not in split.get_json()
+    assert mock_upstream.requests['toll'] == 1
+    unsplit = toll_request(client, ['Delhi'], split_legs=False, origin='Delhi', destination='delhi')
+    assert unsplit.status_code == split.status_code
+    assert unsplit.get_json() == split.get_json()
+
+
+def test_split_legs_must_be_a_boolean(client):
+    assert toll_request(client, ['Jaipur'], split_legs='yes').status_code == 400
+
+
+def test_overview_of_a_split_journey_joins_the_full_leg_routes(client, mock_upstream):
+    result = client.post('/get_toll_data', json={'origin': 'Delhi', 'destination': 'Mumbai', 'waypoints': ['Jaipur'],
+                                                 'journey_type': 'car', 'split_legs': True,
+                                                 'route_detail': 'overview'}).get_json()
+    assert all(leg['route_id'] for leg in result['legs'])
+    detail = client.get(f"/route/{result['route_id']}?bbox=-90,-180,90,180&zoom=22").get_json()
+    # The mock answers every leg with the fixture route
+    assert detail['points'] == 2 * mock_upstream.route_points
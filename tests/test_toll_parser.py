@@ -0,0 +1,57 @@
+"""TollResponseParser against json.loads, on the response_data.json fixture and edge cases."""
+import json
+
+import pytest
+
+import app
+from tests.conftest import FIXTURE
+
+with open(FIXTURE, 'rb') as f:
+    RAW = f.read()
+
+
+def chunked(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def as_json(parsed):
+    """The parser's output in json.loads form: route_points back to [lng, lat] pairs, booths as dicts."""
+    result = dict(parsed)
+    points = result.pop('route_points', None)
+    if points is not None:
+        result['route'] = [[points[i + 1], points[i]] for i in range(0, len(points), 2)]
+    if 'toll_booths' in result:
+        result['toll_booths'] = [booth.to_dict() for booth in result['toll_booths']]
+    return result
+
+
+@pytest.mark.parametrize('chunk_size', [97, 1024, 65536, len(RAW)])
+def test_fixture_parses_like_json_loads(chunk_size):
+    parser = app.TollResponseParser(chunked(RAW, chunk_size))
+    assert as_json(parser.parse()) == json.loads(RAW)
+    assert parser.bytes_read == len(RAW)
+
+
+def test_multibyte_characters_split_across_chunks():
+    body = json.dumps({'toll_booths': [{'name': 'Tolí – Plaza'}], 'note': 'पथकर'}, ensure_ascii=False).encode()
+    assert as_json(app.TollResponseParser(chunked(body, 1)).parse()) == json.loads(body)
+
+
+def test_route_elements_with_altitude():
+    body = b'{"route": [[77.1, 28.6, 210.5], [77.2, 28.7, 212.0]]}'
+    assert list(app.TollResponseParser([body]).parse()['route_points']) == [28.6, 77.1, 28.7, 77.2]
+
+
+def test_empty_body_parses_to_none():
+    assert app.TollResponseParser([b'', b'  ']).parse() is None
+
+
+@pytest.mark.parametrize('body', [
+    b'{"route": [[77.1, 28.6], [77.2',
+    b'{"toll_count": 3',
+    b'{"toll_count": 3} trailing',
+    b'[1, 2]',
+])
+def test_malformed_bodies_raise_value_error(body):
+    with pytest.raises(ValueError):
+        app.TollResponseParser(chunked(body, 5)).parse()
@@ -0,0 +1,82 @@
+"""/trip_cost: request validation, route sampling and the fuel arithmetic."""
+import pytest
+
+import app
+
+TRIP = {'origin': 'Delhi', 'destination': 'Mumbai', 'journey_type': 'car', 'fuel_type': 'diesel',
+        'mileage_kmpl': 12, 'sample_km': 200}
+
+
+@pytest.mark.parametrize('change, error', [
+    ({'mileage_kmpl': None}, 'mileage_kmpl is required'),
+    ({'mileage_kmpl': 'twelve'}, 'mileage_kmpl and sample_km must be numbers'),
+    ({'sample_km': [50]}, 'mileage_kmpl and sample_km must be numbers'),
+    ({'mileage_kmpl': 0}, 'mileage_kmpl must be between 0 and 100 km per litre'),
+    ({'mileage_kmpl': 120}, 'mileage_kmpl must be between 0 and 100 km per litre'),
+    ({'sample_km': 1}, 'sample_km must be between 5 and 1000'),
+])
+def test_invalid_requests_are_rejected(client, change, error):
+    response = client.post('/trip_cost', json={**TRIP, **change})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+
+def test_body_must_be_an_object(client):
+    assert client.post('/trip_cost', data='mileage', content_type='text/plain').status_code == 400
+
+
+def test_route_segments_are_equal_and_scaled_to_the_road_distance():
+    route = [[19.0, 73.0], [20.0, 73.0], [21.0, 73.0]]
+    geometry_km = app.haversine_km(19.0, 73.0, 21.0, 73.0)
+    total_km, source, segments = app.route_segments(route, 50)
+    assert (round(total_km, 6), source, len(segments)) == (round(geometry_km, 6), 'geometry', 5)
+    assert segments[0]['coords'] == [19.2, 73.0]
+    assert segments[-1]['end_km'] == pytest.approx(geometry_km, abs=1e-3)
+
+    total_km, source, segments = app.route_segments(route, 50, distance_km=300)
+    assert (total_km, source, len(segments)) == (300, 'route_metadata', 6)
+    assert [segment['distance_km'] for segment in segments] == [50.0] * 6
+    assert segments[2]['coords'] == [round(19 + 2 * 2.5 / 6, 5), 73.0]
+
+
+def test_fuel_cost_adds_up_along_the_route(client, mock_upstream):
+    response = client.post('/trip_cost', json=TRIP)
+    assert response.status_code == 200
+    trip = response.get_json()
+    segments = trip['segments']
+    assert trip['distance_source'] == 'route_metadata'
+    assert sum(segment['distance_km'] for segment in segments) == pytest.approx(trip['distance_km'], abs=0.01)
+    assert {segment['fuel_price'] for segment in segments} == {87.62}
+    litres = trip['distance_km'] / 12
+    assert trip['fuel'] == {'litres': round(litres, 3), 'cost': round(litres * 87.62, 2), 'average_price': 87.62}
+    assert trip['total_cost'] == pytest.approx(trip['toll']['total_toll_price'] + litres * 87.62, abs=0.01)
+    # One toll call, and at most one fuel call per sampled segment
+    assert mock_upstream.requests['toll'] == 1
+    assert 1 <= mock_upstream.requests['fuel'] <= len(segments)
+
+
+def test_unpriced_segments_borrow_the_nearest_price(client, mock_upstream, monkeypatch):
+    lookup = app.lookup_fuel_price_steps
+
+    def no_price_south_of_24(location, *args):
+        if float(location.split(',')[0]) < 24:
+            raise app.FuelApiError('No fuel price for this location', 404)
+        return (yield from lookup(location, *args))
+
+    monkeypatch.setattr(app, 'lookup_fuel_price_steps', no_price_south_of_24)
+    segments = client.post('/trip_cost', json=TRIP).get_json()['segments']
+    assert [segment['price_from'] for segment in segments] == [
+        'nearest' if segment['coords'][0] < 24 else 'sample' for segment in segments]
+    assert 'nearest' in {segment['price_from'] for segment in segments}
+    assert {segment['fuel_price'] for segment in segments} == {87.62}
+
+
+def test_trip_fails_when_no_segment_is_priced(client, mock_upstream, monkeypatch):
+    def no_price(location, *args):
+        raise app.FuelApiError('No fuel price for this location', 404)
+        yield
+
+    monkeypatch.setattr(app, 'lookup_fuel_price_steps', no_price)
+    response = client.post('/trip_cost', json=TRIP)
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'No fuel price for this location'}
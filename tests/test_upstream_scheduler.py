@@ -0,0 +1,88 @@
+"""UpstreamScheduler: token bucket, AIMD concurrency limit, Retry-After pauses and priorities."""
+import threading
+import time
+
+import pytest
+
+import app
+from tests.conftest import MOCK_URL
+
+
+def test_429_halves_the_limit_and_pauses_admissions(mock_upstream):
+    mock_upstream.error_rate, mock_upstream.error_status, mock_upstream.retry_after = 1.0, 429, 0.3
+    scheduler = app.UpstreamScheduler('test', initial_limit=8, min_limit=1, max_limit=8)
+    client = app.UpstreamClient(max_retries=0, schedulers={MOCK_URL.split('//')[1]: scheduler})
+
+    response = client.get(f'{MOCK_URL}/v1/toll')
+    assert response.status_code == 429
+    stats = scheduler.stats()
+    assert (stats['throttled'], stats['decreases'], stats['limit']) == (1, 1, 4)
+    assert stats['paused_for'] > 0.2
+
+    # The next call waits out Retry-After before it is admitted
+    started = time.monotonic()
+    scheduler.acquire()
+    assert time.monotonic() - started >= 0.25
+    scheduler.release()
+
+
+def test_healthy_responses_grow_a_saturated_limit():
+    scheduler = app.UpstreamScheduler('test', initial_limit=2, max_limit=8, latency_tolerance=0)
+    for _ in range(10):
+        scheduler.acquire()
+        scheduler.acquire()
+        scheduler.release(0.01, 200)
+        scheduler.release(0.01, 200)
+    assert scheduler.stats()['limit'] > 2
+    assert scheduler.increases > 0
+
+
+def test_token_bucket_spaces_out_calls():
+    scheduler = app.UpstreamScheduler('test', rate=50, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        scheduler.acquire()
+        scheduler.release()
+    # One token up front, then one every 20 ms
+    assert time.monotonic() - started >= 0.09
+
+
+def test_full_queue_times_out():
+    scheduler = app.UpstreamScheduler('test', initial_limit=1, min_limit=1, max_limit=1, queue_timeout=0.1)
+    scheduler.acquire()
+    with pytest.raises(app.UpstreamSaturatedError):
+        scheduler.acquire()
+    assert scheduler.stats()['rejected'] == 1
+
+
+def test_interactive_calls_are_admitted_before_bulk():
+    scheduler = app.UpstreamScheduler('test', initial_limit=2, min_limit=2, max_limit=2, bulk_share=1.0)
+    scheduler.acquire()
+    scheduler.acquire()
+    admitted = []
+
+    def call(priority):
+        scheduler.acquire(priority)
+        admitted.append(priority)
+
+    threads = [threading.Thread(target=call, args=(priority,)) for priority in ('bulk', 'interactive')]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    assert scheduler.stats()['queue_depth'] == {'interactive': 1, 'bulk': 1}
+
+    scheduler.release()
+    scheduler.release()
+    for thread in threads:
+        thread.join(2)
+    assert admitted == ['interactive', 'bulk']
+
+
+def test_bulk_calls_leave_room_for_interactive_ones():
+    scheduler = app.UpstreamScheduler('test', initial_limit=4, min_limit=4, max_limit=4, bulk_share=0.5,
+                                      queue_timeout=0.05)
+    scheduler.acquire('bulk')
+    scheduler.acquire('bulk')
+    with pytest.raises(app.UpstreamSaturatedError):
+        scheduler.acquire('bulk')
+    scheduler.acquire('interactive')